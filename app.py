@@ -1,31 +1,32 @@
-from flask import Flask, render_template, request, jsonify, session, redirect, url_for, send_file, send_from_directory, g
+from flask import Flask, render_template, request, jsonify, session, redirect, url_for, send_file, send_from_directory, g, Response, stream_with_context
 from flask_sqlalchemy import SQLAlchemy
 from flask_bcrypt import Bcrypt
-from sqlalchemy.exc import SQLAlchemyError, OperationalError
-from sqlalchemy import text
+from sqlalchemy.exc import SQLAlchemyError, OperationalError, ProgrammingError, StatementError, IntegrityError, DataError
+from sqlalchemy import text, event
+from sqlalchemy.pool import Pool
+from sqlalchemy.engine import Engine
 from datetime import datetime, timedelta, timezone
 
 import json
 import os
 import sqlite3
-from reportlab.lib import colors
-from reportlab.lib.pagesizes import letter, A4
-from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer, Image, PageBreak
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-from reportlab.lib.units import inch
-from reportlab.graphics.shapes import Drawing
-from reportlab.graphics.charts.linecharts import HorizontalLineChart
-from reportlab.graphics.charts.barcharts import VerticalBarChart
-from reportlab.pdfbase import pdfmetrics
-from reportlab.pdfbase.ttfonts import TTFont
-from reportlab.lib.enums import TA_CENTER, TA_LEFT, TA_RIGHT
-from reportlab.graphics.charts.piecharts import Pie
-from reportlab.graphics.charts.barcharts import VerticalBarChart
-from reportlab.graphics.shapes import Drawing
-from reportlab.lib import colors
-import httpx
-import asyncio
+import threading
+import time
+import atexit
+import uuid
+import hashlib
+import math
+from collections import OrderedDict, Counter, deque
+from contextlib import contextmanager, closing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, BrokenExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+import multiprocessing
+import importlib.util
+from functools import lru_cache
+# ReportLab / OpenAI / httpx / NumPy 體積大，改在第一次用到時才 import（見 get_pdf_font、get_openai_client），
+# 讓每個 worker 開機時不必先載入報告與 AI 功能
 from werkzeug.utils import secure_filename
+import click
 
 # === 統一的失敗訊息（無 API Key / 客戶端不可用 / 連線錯誤等一律用此訊息） ===
 FAILURE_TEXT = "AI建議暫時無法生成，請稍後再試。系統仍可正常提供其他學習建議。"
@@ -34,75 +35,164 @@ MIN_SESSION_MINUTES = 1
 def is_eligible_session(s):
     return s.end_time is not None and (s.duration_minutes or 0) >= MIN_SESSION_MINUTES
 
-# --- OpenAI 可用性偵測 ---
+# --- OpenAI 可用性偵測（只確認套件存在，第一次用到 AI 功能時才 import，見 get_openai_client） ---
+OPENAI_AVAILABLE = importlib.util.find_spec('openai') is not None
+OPENAI_RETRYABLE_ERRORS = ()  # 載入 openai 後才填入
 try:
-    from openai import OpenAI
     from dotenv import load_dotenv
     load_dotenv()
-    OPENAI_AVAILABLE = True
-    print("OpenAI API 已載入")
 except ImportError:
     OPENAI_AVAILABLE = False
+if OPENAI_AVAILABLE:
+    print("OpenAI API 可用（第一次使用時載入）")
+else:
     print("OpenAI API 未安裝，AI建議功能將不可用")
 
 # 管理開關：若要在部署時關閉，設環境變數 AI_SUGGESTIONS_ENABLED=false
 AI_SUGGESTIONS_ENABLED = os.environ.get('AI_SUGGESTIONS_ENABLED', 'true').lower() == 'true'
 
 def has_openai_client() -> bool:
-    return OPENAI_AVAILABLE and AI_SUGGESTIONS_ENABLED and (client is not None)
+    return OPENAI_AVAILABLE and AI_SUGGESTIONS_ENABLED and (get_openai_client() is not None)
+
+# OpenAI HTTP 連線池與呼叫限制（每個行程各自一份）
+# OPENAI_BASE_URL 可指向 OpenAI 相容服務，例如壓測用的 benchmarks/openai_stub.py
+OPENAI_BASE_URL = os.environ.get('OPENAI_BASE_URL') or None
+OPENAI_MAX_CONNECTIONS = int(os.environ.get('OPENAI_MAX_CONNECTIONS', 8))
+OPENAI_MAX_KEEPALIVE_CONNECTIONS = int(os.environ.get('OPENAI_MAX_KEEPALIVE_CONNECTIONS', 4))
+OPENAI_KEEPALIVE_EXPIRY = float(os.environ.get('OPENAI_KEEPALIVE_EXPIRY', 60))    # 閒置連線保留秒數
+OPENAI_CONNECT_TIMEOUT = float(os.environ.get('OPENAI_CONNECT_TIMEOUT', 10))
+OPENAI_MAX_CONCURRENCY = int(os.environ.get('OPENAI_MAX_CONCURRENCY', 4))        # 同時進行的 OpenAI 呼叫上限
+OPENAI_SLOT_TIMEOUT = float(os.environ.get('OPENAI_SLOT_TIMEOUT', 10))            # 等待呼叫名額的上限
+OPENAI_CALL_DEADLINE = float(os.environ.get('OPENAI_CALL_DEADLINE', 45))          # 單次呼叫（含等待、重試、串流）的總期限
+OPENAI_MAX_RETRIES = int(os.environ.get('OPENAI_MAX_RETRIES', 2))
+
+def build_openai_http_client():
+    """共用的 keep-alive 連線池；連線數不少於呼叫上限，呼叫不會卡在 httpx 連線池"""
+    import httpx
+    return httpx.Client(
+        timeout=httpx.Timeout(OPENAI_CALL_DEADLINE, connect=OPENAI_CONNECT_TIMEOUT, pool=OPENAI_SLOT_TIMEOUT),
+        limits=httpx.Limits(max_connections=max(OPENAI_MAX_CONNECTIONS, OPENAI_MAX_CONCURRENCY),
+                            max_keepalive_connections=OPENAI_MAX_KEEPALIVE_CONNECTIONS,
+                            keepalive_expiry=OPENAI_KEEPALIVE_EXPIRY),
+        follow_redirects=True,
+        verify=True,
+        headers={'User-Agent': 'OpenAI-Python/1.0'}
+    )
 
-# 初始化 OpenAI client（若無 API Key，client=None）
-if OPENAI_AVAILABLE and AI_SUGGESTIONS_ENABLED:
+def _create_openai_client():
+    """建立 OpenAI client（若無 API Key 或初始化失敗回 None）
+    重試由 openai_chat_completion 在期限內自行處理，client 本身不重試"""
+    global OPENAI_RETRYABLE_ERRORS
     try:
+        from openai import OpenAI, APIConnectionError, RateLimitError, InternalServerError
+        OPENAI_RETRYABLE_ERRORS = (APIConnectionError, RateLimitError, InternalServerError)  # 含 APITimeoutError
         api_key = os.environ.get('OPENAI_API_KEY')
         if not api_key:
-            from dotenv import load_dotenv
-            load_dotenv()
-            api_key = os.environ.get('OPENAI_API_KEY')
-        if api_key:
-            try:
-                custom_http_client = httpx.Client(
-                    timeout=httpx.Timeout(60.0, connect=20.0, read=40.0),
-                    limits=httpx.Limits(max_keepalive_connections=1, max_connections=1),
-                    follow_redirects=True,
-                    verify=True,
-                    headers={'User-Agent': 'OpenAI-Python/1.0', 'Connection': 'close'}
-                )
-                client = OpenAI(api_key=api_key, http_client=custom_http_client, timeout=60.0, max_retries=2)
-                print("✓ OpenAI 客戶端初始化成功（自定義 HTTP 客戶端）")
-            except Exception as e1:
-                print(f"自定義 HTTP 客戶端失敗: {e1}")
-                try:
-                    os.environ['OPENAI_API_KEY'] = api_key
-                    client = OpenAI(timeout=45.0, max_retries=1)
-                    print("✓ OpenAI 客戶端初始化成功（環境變數方式）")
-                except Exception as e2:
-                    print(f"環境變數方式也失敗: {e2}")
-                    client = None
-        else:
-            client = None
             print("✗ 未找到 OPENAI_API_KEY")
+            return None
+        try:
+            client = OpenAI(api_key=api_key, base_url=OPENAI_BASE_URL, http_client=build_openai_http_client(),
+                            timeout=OPENAI_CALL_DEADLINE, max_retries=0)
+            print(f"✓ OpenAI 客戶端初始化成功（連線池 {OPENAI_MAX_CONNECTIONS}，同時呼叫上限 {OPENAI_MAX_CONCURRENCY}）")
+            if OPENAI_BASE_URL:
+                print(f"⚠ OpenAI base URL 改為 {OPENAI_BASE_URL}")
+            return client
+        except Exception as e1:
+            print(f"自定義 HTTP 客戶端失敗: {e1}")
+            try:
+                client = OpenAI(base_url=OPENAI_BASE_URL, timeout=OPENAI_CALL_DEADLINE, max_retries=0)
+                print("✓ OpenAI 客戶端初始化成功（環境變數方式）")
+                return client
+            except Exception as e2:
+                print(f"環境變數方式也失敗: {e2}")
+                return None
     except Exception as e:
-        client = None
         print(f"✗ OpenAI 初始化失敗: {e}")
-else:
-    client = None
+        return None
 
-# --- Matplotlib（PDF 圖表用） ---
-try:
-    import matplotlib
-    matplotlib.use('Agg')
-    import matplotlib.pyplot as plt
-    import numpy as np
-    from matplotlib.font_manager import FontProperties
-    plt.rcParams['font.sans-serif'] = ['DejaVu Sans']
-    plt.rcParams['axes.unicode_minus'] = False
-    CHARTS_AVAILABLE = True
-except ImportError:
-    CHARTS_AVAILABLE = False
-    print("Charts功能暫時無法使用，將生成純文字報告")
+_openai_client = None
+_openai_client_pid = None
+_openai_client_lock = threading.Lock()
+
+def get_openai_client():
+    """第一次使用 AI 功能時才 import openai / httpx 並建立 client；每個行程各建一份，
+    fork 出來的 worker 不會沿用父行程的連線池"""
+    global _openai_client, _openai_client_pid
+    if _openai_client_pid == os.getpid():
+        return _openai_client
+    with _openai_client_lock:
+        if _openai_client_pid != os.getpid():
+            _openai_client = _create_openai_client() if OPENAI_AVAILABLE and AI_SUGGESTIONS_ENABLED else None
+            _openai_client_pid = os.getpid()
+        return _openai_client
+
+class OpenAIDeadlineExceeded(Exception):
+    """等待名額或呼叫 OpenAI 超過 OPENAI_CALL_DEADLINE"""
+
+class OpenAICallLimiter:
+    """行程內共用的 semaphore，限制同時對 OpenAI 發出的呼叫數，並統計等待名額的時間。
+    名額等待不超過 OPENAI_SLOT_TIMEOUT 與呼叫剩餘期限；等不到就放棄（rejected），不排隊到天荒地老。"""
+
+    def __init__(self, max_concurrency, slot_timeout):
+        self.max_concurrency = max_concurrency
+        self.slot_timeout = slot_timeout
+        self._semaphore = threading.BoundedSemaphore(max_concurrency)
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self.stats = {'calls': 0, 'rejected': 0, 'errors': 0, 'deadline_exceeded': 0, 'retries': 0,
+                      'max_in_flight': 0, 'wait_ms_total': 0.0, 'wait_ms_max': 0.0}
+
+    def count(self, name, n=1):
+        with self._lock:
+            self.stats[name] += n
+
+    @contextmanager
+    def slot(self, deadline):
+        """取得一個呼叫名額；deadline 為 time.monotonic() 的絕對時間"""
+        start = time.monotonic()
+        timeout = min(self.slot_timeout, deadline - start)
+        if timeout <= 0 or not self._semaphore.acquire(timeout=timeout):
+            self.count('rejected')
+            raise OpenAIDeadlineExceeded(f'等待 OpenAI 呼叫名額逾時（上限 {self.max_concurrency}）')
+        waited_ms = (time.monotonic() - start) * 1000
+        with self._lock:
+            self.in_flight += 1
+            self.stats['calls'] += 1
+            self.stats['max_in_flight'] = max(self.stats['max_in_flight'], self.in_flight)
+            self.stats['wait_ms_total'] += waited_ms
+            self.stats['wait_ms_max'] = max(self.stats['wait_ms_max'], waited_ms)
+        try:
+            yield
+        except OpenAIDeadlineExceeded:
+            self.count('deadline_exceeded')
+            raise
+        except Exception:
+            self.count('errors')
+            raise
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+            self._semaphore.release()
+
+    def snapshot(self):
+        with self._lock:
+            data = dict(self.stats)
+            data['in_flight'] = self.in_flight
+        data['max_concurrency'] = self.max_concurrency
+        data['wait_ms_avg'] = round(data['wait_ms_total'] / data['calls'], 1) if data['calls'] else 0.0
+        data['wait_ms_total'] = round(data['wait_ms_total'], 1)
+        data['wait_ms_max'] = round(data['wait_ms_max'], 1)
+        return data
 
-from io import BytesIO
+openai_limiter = OpenAICallLimiter(OPENAI_MAX_CONCURRENCY, OPENAI_SLOT_TIMEOUT)
+
+# --- NumPy（情緒時間序列壓縮儲存用；只確認套件存在，用到的函式內才 import） ---
+NUMPY_AVAILABLE = importlib.util.find_spec('numpy') is not None
+# PDF 內的圖表由 ReportLab 繪製，不需要 Matplotlib
+
+from io import BytesIO, RawIOBase
+from urllib.parse import quote
+import zipfile
 import base64
 
 app = Flask(__name__)
@@ -133,9 +223,31 @@ app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
     'pool_recycle': 300,    # 5 分鐘回收連線
 }
 
+# bcrypt 工作因子（2^rounds 次運算）；既有雜湊內含各自的 rounds，調整後仍可驗證。用 benchmarks/bench_password_hash.py 挑選
+app.config['BCRYPT_LOG_ROUNDS'] = int(os.environ.get('BCRYPT_LOG_ROUNDS', 12))
+
 db = SQLAlchemy(app)
 bcrypt = Bcrypt(app)
 
+def _dispose_engine_after_fork():
+    # fork 出來的子行程（gunicorn --preload 的 worker、報告排版子行程）不可沿用父行程的資料庫連線；
+    # 只丟掉參照，不關閉父行程的 socket
+    with app.app_context():
+        db.engine.dispose(close=False)
+
+os.register_at_fork(after_in_child=_dispose_engine_after_fork)
+
+def worker_pool_context():
+    """背景行程池（報告排版等）的 multiprocessing context。
+    行程池在 worker 收到請求後才建立，此時已有多條執行緒；直接 fork 可能複製到被其他執行緒持有的鎖而卡死，
+    因此改由單執行緒的 forkserver 產生子行程：forkserver 啟動時匯入一次 app，子行程由它 fork 而來。
+    不支援 forkserver 的平台用 spawn，每個子行程第一次執行工作時各自匯入 app。"""
+    if 'forkserver' not in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context('spawn')
+    context = multiprocessing.get_context('forkserver')
+    context.set_forkserver_preload([__name__])  # 預設只預載 __main__；預載 app，子行程不必各自重新匯入
+    return context
+
 # -------- 影片根目錄與科目資料夾映射 --------
 DEFAULT_VIDEO_ROOT = os.path.join('static', 'video')
 LEGACY_VIDEO_ROOT = os.path.join('static', 'videos')
@@ -151,29 +263,45 @@ SUBJECT_DIR_MAP = {
 }
 ALLOWED_VIDEO_EXTS = {'.mp4', '.m4v', '.webm', '.ogg'}
 
-# -------- PDF 字型註冊 --------
-try:
-    font_paths = [
-        './fonts/MSJH.TTC', 'C:/Windows/Fonts/msjh.ttc', 'C:/Windows/Fonts/msjh.ttf',
-        '/System/Library/Fonts/PingFang.ttc', '/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf',
-        './static/fonts/NotoSansCJK-Regular.ttc'
-    ]
-    PDF_FONT = None
-    for fp in font_paths:
-        if os.path.exists(fp):
-            try:
-                pdfmetrics.registerFont(TTFont('ChineseFont', fp))
-                PDF_FONT = 'ChineseFont'
-                print(f"成功載入中文字體: {fp}")
-                break
-            except Exception as e:
-                print(f"載入字體失敗 {fp}: {e}")
-    if PDF_FONT is None:
+# -------- PDF 字型註冊（第一次產生報告時才載入 ReportLab 並探測字型） --------
+PDF_FONT_PATHS = [
+    './fonts/MSJH.TTC', 'C:/Windows/Fonts/msjh.ttc', 'C:/Windows/Fonts/msjh.ttf',
+    '/System/Library/Fonts/PingFang.ttc', '/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf',
+    './static/fonts/NotoSansCJK-Regular.ttc'
+]
+_pdf_font = None
+_pdf_font_lock = threading.Lock()
+
+def _register_pdf_font():
+    try:
+        from reportlab.pdfbase import pdfmetrics
+        from reportlab.pdfbase.ttfonts import TTFont
+        for fp in PDF_FONT_PATHS:
+            if os.path.exists(fp):
+                try:
+                    pdfmetrics.registerFont(TTFont('ChineseFont', fp))
+                    print(f"成功載入中文字體: {fp}")
+                    return 'ChineseFont'
+                except Exception as e:
+                    print(f"載入字體失敗 {fp}: {e}")
         print("警告: 無法載入中文字體，將使用 Helvetica")
-        PDF_FONT = 'Helvetica'
-except Exception as e:
-    print(f"字體註冊過程發生錯誤: {e}")
-    PDF_FONT = 'Helvetica'
+    except Exception as e:
+        print(f"字體註冊過程發生錯誤: {e}")
+    return 'Helvetica'
+
+@lru_cache(maxsize=None)
+def pdf_font_identifier():
+    """報告字型的識別字串（第一個存在的字型檔路徑），只檢查檔案、不載入 ReportLab；用於報告內容雜湊"""
+    return next((fp for fp in PDF_FONT_PATHS if os.path.exists(fp)), 'Helvetica')
+
+def get_pdf_font():
+    """回傳報告使用的字型名稱（每個行程第一次呼叫時載入 ReportLab 並註冊；只在 render_report_pdf 內使用）"""
+    global _pdf_font
+    if _pdf_font is None:
+        with _pdf_font_lock:
+            if _pdf_font is None:
+                _pdf_font = _register_pdf_font()
+    return _pdf_font
 
 # 修正所有時間相關函數
 def get_taiwan_now():
@@ -202,7 +330,17 @@ class Child(db.Model):
     ai_suggestion = db.Column(db.Text)
     pdf_report_path = db.Column(db.String(255))
     pdf_generated_at = db.Column(db.DateTime)
+    analytics_version = db.Column(db.Integer, nullable=False, default=0, server_default='0')  # 場次異動時遞增，作為 SessionAnalytics 快取鍵
+    ai_suggestion_version = db.Column(db.Integer)  # 產生 ai_suggestion 時的 analytics_version；不同即代表建議已過時
+    ai_suggestion_at = db.Column(db.DateTime)
     study_sessions = db.relationship('StudySession', backref='child', lazy=True, cascade='all, delete-orphan')
+    ai_suggestion_jobs = db.relationship('AISuggestionJob', lazy=True, cascade='all, delete-orphan')
+    subject_summaries = db.relationship('ChildSubjectSummary', lazy=True, cascade='all, delete-orphan')
+    daily_rollups = db.relationship('ChildDailySubjectRollup', lazy=True, cascade='all, delete-orphan')
+
+    __table_args__ = (
+        db.Index('ix_child_user_id', 'user_id'),
+    )
 
 class StudySession(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -213,7 +351,18 @@ class StudySession(db.Model):
     end_time = db.Column(db.DateTime)
     avg_attention = db.Column(db.Float)
     avg_emotion_score = db.Column(db.Float)
+    # 情緒數據的累計值（寫入時遞增），結束學習時直接讀取，不必掃描 EmotionData
+    emotion_count = db.Column(db.Integer, default=0)
+    attention_sum = db.Column(db.Float, default=0.0)
+    confidence_sum = db.Column(db.Float, default=0.0)
+    max_seq = db.Column(db.Integer)  # chunks 模式下已接收的最大序號（去重用）
     emotion_data = db.relationship('EmotionData', backref='study_session', lazy=True, cascade='all, delete-orphan')
+    emotion_chunks = db.relationship('EmotionChunk', backref='study_session', lazy=True, cascade='all, delete-orphan')
+
+    __table_args__ = (
+        # 各頁面依 child_id 篩選並依 start_time 排序；行事曆依 start_time 範圍查詢
+        db.Index('ix_study_session_child_start', 'child_id', 'start_time'),
+    )
 
 class EmotionData(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -222,6 +371,25 @@ class EmotionData(db.Model):
     emotion = db.Column(db.String(20))
     attention_level = db.Column(db.Integer)
     confidence = db.Column(db.Float)
+    seq = db.Column(db.Integer)  # 前端每個場次遞增的序號；重送時以 (session_id, seq) 去重
+
+    __table_args__ = (
+        db.Index('uq_emotion_data_session_seq', 'session_id', 'seq', unique=True),
+    )
+
+class EmotionChunk(db.Model):
+    """一個學習場次某一分鐘內的情緒樣本，打包成固定長度的二進位紀錄（格式見 emotion_chunk_dtype）"""
+    id = db.Column(db.Integer, primary_key=True)
+    session_id = db.Column(db.Integer, db.ForeignKey('study_session.id'), nullable=False)
+    chunk_start = db.Column(db.DateTime, nullable=False)  # 該分鐘起點（台灣時間）
+    sample_count = db.Column(db.Integer, nullable=False, default=0)
+    attention_sum = db.Column(db.Float, nullable=False, default=0.0)
+    confidence_sum = db.Column(db.Float, nullable=False, default=0.0)
+    payload = db.Column(db.LargeBinary, nullable=False)
+
+    __table_args__ = (
+        db.Index('uq_emotion_chunk_session_start', 'session_id', 'chunk_start', unique=True),
+    )
 
 class VideoWatch(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -233,6 +401,506 @@ class VideoWatch(db.Model):
     ended_at = db.Column(db.DateTime)
     duration_seconds = db.Column(db.Integer, default=0)
 
+    __table_args__ = (
+        db.Index('ix_video_watch_session_id', 'session_id'),
+    )
+
+class SubjectAttentionMixin:
+    """由 attention_sum / attention_count / attention_nonzero_count 算出科目平均專注度（ChildSubjectSummary 與 SubjectStats 共用）"""
+    __slots__ = ()
+
+    @property
+    def avg_attention(self):
+        """科目平均專注度（0 計入、None 不計），供 dashboard 使用"""
+        return self.attention_sum / self.attention_count if self.attention_count else 0.0
+
+    @property
+    def avg_attention_nonzero(self):
+        """科目平均專注度（忽略 0 與 None）；沒有資料回 None"""
+        return self.attention_sum / self.attention_nonzero_count if self.attention_nonzero_count else None
+
+class ChildSubjectSummary(SubjectAttentionMixin, db.Model):
+    """每個小孩每個科目的已完成場次彙總（只計 is_eligible_session 的場次），結束 / 刪除學習時同步更新"""
+    child_id = db.Column(db.Integer, db.ForeignKey('child.id'), primary_key=True)
+    subject = db.Column(db.String(50), primary_key=True)
+    session_count = db.Column(db.Integer, nullable=False, default=0)
+    total_minutes = db.Column(db.Integer, nullable=False, default=0)
+    attention_sum = db.Column(db.Float, nullable=False, default=0.0)
+    attention_count = db.Column(db.Integer, nullable=False, default=0)          # avg_attention 不為 None 的場次
+    attention_nonzero_count = db.Column(db.Integer, nullable=False, default=0)  # avg_attention 不為 0 / None 的場次
+
+class ChildDailySubjectRollup(db.Model):
+    """每個小孩每天每個科目計入統計的場次彙總（條件同 eligible_session_filter；行事曆用，日期依 start_time），結束 / 刪除學習時同步更新"""
+    child_id = db.Column(db.Integer, db.ForeignKey('child.id'), primary_key=True)
+    study_date = db.Column(db.Date, primary_key=True)
+    subject = db.Column(db.String(50), primary_key=True)
+    session_count = db.Column(db.Integer, nullable=False, default=0)
+    total_minutes = db.Column(db.Integer, nullable=False, default=0)
+    attention_sum = db.Column(db.Float, nullable=False, default=0.0)
+    attention_count = db.Column(db.Integer, nullable=False, default=0)   # avg_attention 不為 None 的場次
+    best_attention = db.Column(db.Float, nullable=False, default=0.0)    # 當天該科目單場最高 avg_attention（None 視為 0）
+
+    @property
+    def avg_attention(self):
+        return self.attention_sum / self.attention_count if self.attention_count else None
+
+class AISuggestionJob(db.Model):
+    """背景產生 AI 建議的工作（queued → running → done / failed），存在資料庫以便重啟後繼續"""
+    id = db.Column(db.String(32), primary_key=True)
+    child_id = db.Column(db.Integer, db.ForeignKey('child.id', ondelete='CASCADE'), nullable=False)
+    status = db.Column(db.String(16), nullable=False, default='queued')
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    result = db.Column(db.Text)
+    error = db.Column(db.String(500))
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+
+    __table_args__ = (
+        db.Index('ix_ai_suggestion_job_child_status', 'child_id', 'status'),
+    )
+
+class AISuggestionCache(db.Model):
+    """AI 建議快取：key 為 (model, 參數, system / user prompt) 的 SHA-256，同樣的學習摘要不必再呼叫 OpenAI"""
+    key = db.Column(db.String(64), primary_key=True)
+    model = db.Column(db.String(64), nullable=False)
+    response = db.Column(db.Text, nullable=False)
+    hit_count = db.Column(db.Integer, nullable=False, default=0)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    last_used_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        db.Index('ix_ai_suggestion_cache_last_used', 'last_used_at'),
+    )
+
+class SchemaMigration(db.Model):
+    """已套用的資料庫 migration（見 SCHEMA_MIGRATIONS）"""
+    version = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    description = db.Column(db.String(255), nullable=False)
+    applied_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+# --------- 學習場次的情緒累計值 ---------
+def apply_emotion_aggregates(rows):
+    """依 session_id 彙總新寫入的情緒資料，於同一交易內遞增 StudySession 的累計欄位（呼叫端負責 commit）
+
+    結束學習時只會 flush 當下 worker 的緩衝；其他 worker 緩衝中的資料可能在場次結束後才寫入，
+    這時重算該場次的平均值並更新科目 / 每日彙總，結果與所有資料都在結束前寫入相同"""
+    totals = {}
+    for r in rows:
+        t = totals.setdefault(r['session_id'], [0, 0.0, 0.0])
+        t[0] += 1
+        t[1] += r.get('attention_level') or 0
+        t[2] += r.get('confidence') or 0
+    for session_id, (count, att_sum, conf_sum) in totals.items():
+        db.session.execute(
+            db.update(StudySession)
+            .where(StudySession.id == session_id)
+            .values(emotion_count=db.func.coalesce(StudySession.emotion_count, 0) + count,
+                    attention_sum=db.func.coalesce(StudySession.attention_sum, 0) + att_sum,
+                    confidence_sum=db.func.coalesce(StudySession.confidence_sum, 0) + conf_sum)
+        )
+    if not totals:
+        return
+    late = (StudySession.query
+            .filter(StudySession.id.in_(list(totals)), StudySession.end_time.isnot(None))
+            .populate_existing()
+            .all())
+    for s in late:
+        remove_session_from_summary(s)
+        apply_session_emotion_averages(s)
+        add_session_to_summary(s)
+
+def emotion_totals_subquery():
+    """各場次的情緒筆數 / 專注度總和 / 信心值總和（合併 EmotionData 與 EmotionChunk 兩種儲存方式）"""
+    row_totals = (db.select(EmotionData.session_id.label('session_id'),
+                            db.func.count(EmotionData.id).label('cnt'),
+                            db.func.coalesce(db.func.sum(EmotionData.attention_level), 0).label('att_sum'),
+                            db.func.coalesce(db.func.sum(EmotionData.confidence), 0).label('conf_sum'))
+                  .group_by(EmotionData.session_id))
+    chunk_totals = (db.select(EmotionChunk.session_id.label('session_id'),
+                              db.func.sum(EmotionChunk.sample_count).label('cnt'),
+                              db.func.sum(EmotionChunk.attention_sum).label('att_sum'),
+                              db.func.sum(EmotionChunk.confidence_sum).label('conf_sum'))
+                    .group_by(EmotionChunk.session_id))
+    both = db.union_all(row_totals, chunk_totals).subquery()
+    return (db.select(both.c.session_id,
+                      db.func.sum(both.c.cnt).label('cnt'),
+                      db.func.sum(both.c.att_sum).label('att_sum'),
+                      db.func.sum(both.c.conf_sum).label('conf_sum'))
+            .group_by(both.c.session_id)
+            .subquery())
+
+def apply_session_emotion_averages(s):
+    """由累計欄位算出 avg_attention / avg_emotion_score；舊資料（欄位為空）改用一次 SQL 彙總。回傳筆數"""
+    if s.emotion_count is None:
+        totals = emotion_totals_subquery()
+        row = db.session.execute(
+            db.select(totals.c.cnt, totals.c.att_sum, totals.c.conf_sum).where(totals.c.session_id == s.id)
+        ).first()
+        count, att_sum, conf_sum = row if row else (0, 0, 0)
+        s.emotion_count, s.attention_sum, s.confidence_sum = int(count or 0), float(att_sum or 0), float(conf_sum or 0)
+    if s.emotion_count:
+        s.avg_attention = s.attention_sum / s.emotion_count
+        s.avg_emotion_score = s.confidence_sum / s.emotion_count
+    return s.emotion_count
+
+# --------- 情緒時間序列的壓縮儲存（EMOTION_STORAGE=chunks） ---------
+# rows  : 每個樣本一筆 EmotionData（預設，相容舊資料）
+# chunks: 每個場次每分鐘一筆 EmotionChunk，樣本以 6 bytes 固定長度紀錄打包
+EMOTION_STORAGE = os.environ.get('EMOTION_STORAGE', 'rows').lower()
+if EMOTION_STORAGE == 'chunks' and not NUMPY_AVAILABLE:
+    print("⚠ 未安裝 NumPy，EMOTION_STORAGE=chunks 無法使用，改用 rows")
+    EMOTION_STORAGE = 'rows'
+
+# 與 static/script.js 的 EMOTION_LABELS 順序一致；未知標籤存 255
+EMOTION_LABEL_CODES = ['anger', 'disgust', 'fear', 'happy', 'neutral', 'sad', 'surprise', 'no_emotion']
+EMOTION_CODE_BY_LABEL = {label: i for i, label in enumerate(EMOTION_LABEL_CODES)}
+EMOTION_UNKNOWN_CODE = 255
+
+@lru_cache(maxsize=None)
+def emotion_chunk_dtype():
+    # offset_ms：相對於 chunk_start 的毫秒數（一分鐘內 < 65536）
+    import numpy as np
+    return np.dtype([('offset_ms', '<u2'), ('emotion', 'u1'), ('attention', 'u1'), ('confidence', '<f2')])
+
+def pack_emotion_samples(chunk_start, rows):
+    """把同一分鐘的情緒樣本打包成 bytes"""
+    import numpy as np
+    arr = np.zeros(len(rows), dtype=emotion_chunk_dtype())
+    for i, r in enumerate(rows):
+        offset = int((r['timestamp'] - chunk_start).total_seconds() * 1000)
+        arr[i] = (min(max(offset, 0), 59999),
+                  EMOTION_CODE_BY_LABEL.get(r.get('emotion'), EMOTION_UNKNOWN_CODE),
+                  min(max(int(r.get('attention_level') or 0), 0), 254),
+                  r.get('confidence') or 0.0)
+    return arr.tobytes()
+
+def unpack_emotion_chunk(chunk):
+    """EmotionChunk → 結構化陣列（唯讀，直接引用 payload）"""
+    import numpy as np
+    return np.frombuffer(chunk.payload, dtype=emotion_chunk_dtype())
+
+def append_emotion_chunks(rows):
+    """把樣本依（場次, 分鐘）分組後附加到 EmotionChunk（呼叫端負責 commit）"""
+    groups = {}
+    for r in rows:
+        chunk_start = r['timestamp'].replace(second=0, microsecond=0)
+        groups.setdefault((r['session_id'], chunk_start), []).append(r)
+
+    for (session_id, chunk_start), items in groups.items():
+        payload = pack_emotion_samples(chunk_start, items)
+        att_sum = float(sum(r.get('attention_level') or 0 for r in items))
+        conf_sum = float(sum(r.get('confidence') or 0 for r in items))
+        chunk = (EmotionChunk.query
+                 .filter_by(session_id=session_id, chunk_start=chunk_start)
+                 .with_for_update()
+                 .first())
+        if chunk:
+            chunk.payload = bytes(chunk.payload) + payload
+            chunk.sample_count += len(items)
+            chunk.attention_sum += att_sum
+            chunk.confidence_sum += conf_sum
+        else:
+            db.session.add(EmotionChunk(session_id=session_id, chunk_start=chunk_start,
+                                        sample_count=len(items), attention_sum=att_sum,
+                                        confidence_sum=conf_sum, payload=payload))
+
+EMOTION_ATTENTION_MAX = 3  # static/script.js 的 calcAttention 最大值
+
+def _is_finite_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool) and math.isfinite(value)
+
+def normalize_emotion_sample(sample):
+    """驗證前端送來的一筆情緒樣本，回傳 {'emotion', 'attention_level', 'confidence'}；格式錯誤回 None
+    emotion 必須是 EMOTION_LABEL_CODES 之一；attention_level 為 0~EMOTION_ATTENTION_MAX 的整數；confidence 為有限數值"""
+    if not isinstance(sample, dict):
+        return None
+    emotion = sample.get('emotion')
+    attention = sample.get('attention_level')
+    confidence = sample.get('confidence')
+    if emotion not in EMOTION_LABEL_CODES:
+        return None
+    if attention is not None:
+        if not _is_finite_number(attention) or attention != int(attention) or not 0 <= attention <= EMOTION_ATTENTION_MAX:
+            return None
+        attention = int(attention)
+    if confidence is not None:
+        if not _is_finite_number(confidence):
+            return None
+        confidence = float(confidence)
+    return {'emotion': emotion, 'attention_level': attention, 'confidence': confidence}
+
+def parse_seq(value):
+    """前端送來的序號 → 非負整數；沒有或無效則回 None（不去重）"""
+    try:
+        seq = int(value)
+    except (TypeError, ValueError):
+        return None
+    return seq if seq >= 0 else None
+
+def _dedupe_batch(rows):
+    """同一批內重複的 (session_id, seq) 只保留第一筆"""
+    seen, unique = set(), []
+    for r in rows:
+        key = (r['session_id'], r.get('seq'))
+        if key[1] is not None:
+            if key in seen:
+                continue
+            seen.add(key)
+        unique.append(r)
+    return unique
+
+def _insert_emotion_rows(rows):
+    """寫入 EmotionData；有序號的資料以 ON CONFLICT DO NOTHING 去重，回傳實際寫入的資料"""
+    plain = [r for r in rows if r.get('seq') is None]
+    with_seq = [r for r in rows if r.get('seq') is not None]
+    if plain:
+        db.session.execute(db.insert(EmotionData), plain)
+    if not with_seq:
+        return plain
+
+    dialect = db.session.get_bind().dialect.name
+    if dialect == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert as upsert_insert
+    elif dialect == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert as upsert_insert
+    else:
+        db.session.execute(db.insert(EmotionData), with_seq)
+        return rows
+
+    stmt = (upsert_insert(EmotionData)
+            .on_conflict_do_nothing(index_elements=['session_id', 'seq'])
+            .returning(EmotionData.session_id, EmotionData.attention_level, EmotionData.confidence))
+    inserted = [dict(r._mapping) for r in db.session.execute(stmt, with_seq)]
+    return plain + inserted
+
+def _filter_new_chunk_samples(rows):
+    """chunks 模式沒有逐筆的唯一索引：以每個場次的 max_seq 高水位去重（前端依序號順序送出）"""
+    session_ids = {r['session_id'] for r in rows if r.get('seq') is not None}
+    if not session_ids:
+        return rows
+    high_water = dict(db.session.query(StudySession.id, StudySession.max_seq)
+                      .filter(StudySession.id.in_(session_ids))
+                      .with_for_update()
+                      .all())
+    accepted, new_max = [], {}
+    for r in sorted(rows, key=lambda r: -1 if r.get('seq') is None else r['seq']):
+        seq = r.get('seq')
+        if seq is not None:
+            current = new_max.get(r['session_id'], high_water.get(r['session_id']))
+            if current is not None and seq <= current:
+                continue
+            new_max[r['session_id']] = seq
+        accepted.append(r)
+    for session_id, seq in new_max.items():
+        db.session.execute(db.update(StudySession).where(StudySession.id == session_id).values(max_seq=seq))
+    return accepted
+
+def write_emotion_samples(rows):
+    """依 EMOTION_STORAGE 寫入情緒樣本並遞增場次累計值（呼叫端負責 commit）；回傳實際寫入筆數
+
+    rows: [{'session_id', 'timestamp', 'emotion', 'attention_level', 'confidence', 'seq'}, ...]
+    重送的樣本（相同 session_id + seq）會被略過，不影響累計值
+    """
+    rows = _dedupe_batch(rows)
+    if not rows:
+        return 0
+    if EMOTION_STORAGE == 'chunks':
+        written = _filter_new_chunk_samples(rows)
+        if written:
+            append_emotion_chunks(written)
+    else:
+        written = _insert_emotion_rows(rows)
+    apply_emotion_aggregates(written)
+    return len(written)
+
+def read_session_emotion_series(session_id):
+    """讀取一個場次的完整情緒時間序列（兩種儲存方式合併、依時間排序），回傳 NumPy 陣列：
+    timestamp (datetime64[ms])、emotion (uint8 代碼，見 EMOTION_LABEL_CODES)、attention (uint8)、confidence (float32)
+    """
+    import numpy as np
+    parts_ts, parts_emotion, parts_att, parts_conf = [], [], [], []
+
+    chunks = (EmotionChunk.query
+              .filter_by(session_id=session_id)
+              .order_by(EmotionChunk.chunk_start)
+              .all())
+    for chunk in chunks:
+        arr = unpack_emotion_chunk(chunk)
+        parts_ts.append(np.datetime64(chunk.chunk_start, 'ms') + arr['offset_ms'].astype('timedelta64[ms]'))
+        parts_emotion.append(arr['emotion'])
+        parts_att.append(arr['attention'])
+        parts_conf.append(arr['confidence'].astype(np.float32))
+
+    legacy = (db.session.query(EmotionData.timestamp, EmotionData.emotion,
+                               EmotionData.attention_level, EmotionData.confidence)
+              .filter(EmotionData.session_id == session_id)
+              .all())
+    if legacy:
+        parts_ts.append(np.array([r[0] for r in legacy], dtype='datetime64[ms]'))
+        parts_emotion.append(np.array([EMOTION_CODE_BY_LABEL.get(r[1], EMOTION_UNKNOWN_CODE) for r in legacy], dtype=np.uint8))
+        parts_att.append(np.array([r[2] or 0 for r in legacy], dtype=np.uint8))
+        parts_conf.append(np.array([r[3] or 0 for r in legacy], dtype=np.float32))
+
+    if not parts_ts:
+        return {'timestamp': np.array([], dtype='datetime64[ms]'), 'emotion': np.array([], dtype=np.uint8),
+                'attention': np.array([], dtype=np.uint8), 'confidence': np.array([], dtype=np.float32)}
+
+    ts = np.concatenate(parts_ts)
+    order = np.argsort(ts, kind='stable')
+    return {
+        'timestamp': ts[order],
+        'emotion': np.concatenate(parts_emotion)[order],
+        'attention': np.concatenate(parts_att)[order],
+        'confidence': np.concatenate(parts_conf)[order]
+    }
+
+# --------- 情緒數據 write-behind 緩衝（每個 gunicorn worker 各一份） ---------
+EMOTION_BUFFER_ENABLED = os.environ.get('EMOTION_BUFFER_ENABLED', 'true').lower() == 'true'
+EMOTION_BUFFER_FLUSH_ROWS = int(os.environ.get('EMOTION_BUFFER_FLUSH_ROWS', 200))        # 累積多少筆就寫入
+EMOTION_BUFFER_FLUSH_SECONDS = float(os.environ.get('EMOTION_BUFFER_FLUSH_SECONDS', 2.0))  # 最多等待幾秒就寫入
+EMOTION_BUFFER_CAPACITY = int(os.environ.get('EMOTION_BUFFER_CAPACITY', 20000))          # 超過就丟棄並計數
+
+class EmotionWriteBuffer:
+    """把 /record_emotion 的每筆資料先收進記憶體，依筆數或時間門檻批次 INSERT + 一次 commit。
+
+    - 背景執行緒在第一次 add() 時才啟動（fork 後的 worker 會各自重新啟動）
+    - flush() 可同步呼叫：結束學習前先寫入，確保平均值計算完整
+    - 連線錯誤（OperationalError）時資料放回佇列，容量滿時丟棄並計入 dropped_rows
+    - 資料本身有問題（型別錯誤、違反約束）時對半拆批重試，只丟棄寫不進去的那幾筆並計入 rejected_rows，
+      不會讓一筆壞資料卡住之後所有的 flush；其他錯誤（例如 schema 不符的 ProgrammingError）與連線錯誤一樣整批放回佇列
+    """
+
+    def __init__(self, flush_rows, flush_seconds, capacity):
+        self.flush_rows = flush_rows
+        self.flush_seconds = flush_seconds
+        self.capacity = capacity
+        self._rows = []
+        self._cond = threading.Condition()
+        self._flush_lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        self._closed = False
+        self.stats = {
+            'enqueued_rows': 0, 'flushed_rows': 0, 'dropped_rows': 0, 'rejected_rows': 0,
+            'flush_count': 0, 'failed_flushes': 0,
+            'last_flush_ms': 0.0, 'max_flush_ms': 0.0, 'total_flush_ms': 0.0
+        }
+
+    def _ensure_worker(self):
+        if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+            return
+        self._pid = os.getpid()
+        self._thread = threading.Thread(target=self._run, name='emotion-write-behind', daemon=True)
+        self._thread.start()
+
+    def add(self, row):
+        with self._cond:
+            if len(self._rows) >= self.capacity:
+                self.stats['dropped_rows'] += 1
+                return False
+            self._rows.append(row)
+            self.stats['enqueued_rows'] += 1
+            if len(self._rows) >= self.flush_rows:
+                self._cond.notify()
+            if not self._closed:
+                self._ensure_worker()
+        return True
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if len(self._rows) < self.flush_rows and not self._closed:
+                    self._cond.wait(self.flush_seconds)
+                closed = self._closed
+            self.flush()
+            if closed:
+                return
+
+    def _requeue(self, rows):
+        with self._cond:
+            room = max(0, self.capacity - len(self._rows))
+            self.stats['dropped_rows'] += max(0, len(rows) - room)
+            self._rows = rows[:room] + self._rows
+
+    @staticmethod
+    def _is_data_error(e):
+        """違反約束、資料型別錯誤（含參數轉換時被包成 StatementError 的 ValueError / TypeError）"""
+        if isinstance(e, (IntegrityError, DataError, ValueError, TypeError)):
+            return True
+        return type(e) is StatementError and isinstance(e.orig, (ValueError, TypeError))
+
+    @staticmethod
+    def _write(rows):
+        with app.app_context():
+            try:
+                write_emotion_samples(rows)
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+                raise
+
+    def flush(self):
+        """把目前佇列中的資料寫入；回傳寫入筆數。
+        整批失敗時：資料錯誤對半拆開各自 commit，單筆仍失敗就丟棄；其他錯誤放回佇列等下次"""
+        with self._flush_lock:
+            with self._cond:
+                rows, self._rows = self._rows, []
+            if not rows:
+                return 0
+
+            started = time.perf_counter()
+            written = rejected = 0
+            pending = [rows]
+            while pending:
+                batch = pending.pop()
+                try:
+                    self._write(batch)
+                    written += len(batch)
+                except Exception as e:
+                    data_error = self._is_data_error(e)
+                    if data_error and len(batch) == 1:
+                        print(f"⚠ 丟棄無法寫入的情緒數據 {batch[0]}: {e}")
+                        rejected += 1
+                        continue
+                    if data_error:
+                        mid = len(batch) // 2
+                        pending.extend([batch[mid:], batch[:mid]])  # 先處理前半段，維持原本順序
+                        continue
+                    print(f"✗ 情緒數據批次寫入失敗，放回佇列（{len(batch)} 筆）: {e}")
+                    self._requeue(batch + [r for b in reversed(pending) for r in b])
+                    with self._cond:
+                        self.stats['failed_flushes'] += 1
+                    break
+
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            with self._cond:
+                self.stats['rejected_rows'] += rejected
+                if written:
+                    self.stats['flush_count'] += 1
+                    self.stats['flushed_rows'] += written
+                    self.stats['last_flush_ms'] = round(elapsed_ms, 2)
+                    self.stats['max_flush_ms'] = round(max(self.stats['max_flush_ms'], elapsed_ms), 2)
+                    self.stats['total_flush_ms'] += elapsed_ms
+            return written
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        self.flush()
+
+    def snapshot(self):
+        with self._cond:
+            data = dict(self.stats)
+            data['queue_depth'] = len(self._rows)
+        data['avg_flush_ms'] = round(data.pop('total_flush_ms') / data['flush_count'], 2) if data['flush_count'] else 0.0
+        data['enabled'] = EMOTION_BUFFER_ENABLED
+        return data
+
+emotion_buffer = EmotionWriteBuffer(EMOTION_BUFFER_FLUSH_ROWS, EMOTION_BUFFER_FLUSH_SECONDS, EMOTION_BUFFER_CAPACITY)
+atexit.register(emotion_buffer.close)  # worker 正常結束時寫入剩餘資料
+
 SUBJECTS = {
     'math': '數學',
     'science': '自然科學',
@@ -244,10 +912,313 @@ SUBJECTS = {
 EDUCATION_STAGES = {'elementary': '國小', 'middle': '國中', 'high': '高中'}
 GENDERS = {'male': '男生', 'female': '女生'}
 
-def compute_overall_avg_attention_percent(sessions):
-    """以『場次平均』計算整體平均專注度（0~100%），忽略 0 與 None。"""
-    vals = [s.avg_attention for s in sessions if s.avg_attention]  # 0 被排除
-    return round(sum(vals) / len(vals) * 100 / 3) if vals else 0
+# ----------------- 科目彙總（ChildSubjectSummary） -----------------
+def _apply_subject_summary_delta(s, sign):
+    if not is_eligible_session(s):
+        return
+    row = db.session.get(ChildSubjectSummary, (s.child_id, s.subject), with_for_update=True)
+    if row is None:
+        if sign < 0:
+            return
+        row = ChildSubjectSummary(child_id=s.child_id, subject=s.subject, session_count=0, total_minutes=0,
+                                  attention_sum=0.0, attention_count=0, attention_nonzero_count=0)
+        db.session.add(row)
+    row.session_count += sign
+    row.total_minutes += sign * (s.duration_minutes or 0)
+    if s.avg_attention is not None:
+        row.attention_sum += sign * s.avg_attention
+        row.attention_count += sign
+        if s.avg_attention:
+            row.attention_nonzero_count += sign
+    if row.session_count <= 0:
+        db.session.delete(row)
+
+def bump_analytics_version(child_id):
+    """讓該小孩的 SessionAnalytics 快取失效（與呼叫端同一交易）"""
+    (Child.query.filter_by(id=child_id)
+     .update({Child.analytics_version: db.func.coalesce(Child.analytics_version, 0) + 1},
+             synchronize_session=False))
+
+def add_session_to_summary(s):
+    """場次結束後計入科目彙總與每日彙總（與呼叫端同一交易）"""
+    _apply_subject_summary_delta(s, 1)
+    _apply_daily_rollup_delta(s, 1)
+    bump_analytics_version(s.child_id)
+
+def remove_session_from_summary(s):
+    """場次刪除或重新結算前，從科目彙總與每日彙總扣除（未計入的場次不受影響）"""
+    _apply_subject_summary_delta(s, -1)
+    _apply_daily_rollup_delta(s, -1)
+    bump_analytics_version(s.child_id)
+
+def load_subject_summaries(child_id):
+    """{subject: ChildSubjectSummary}，依 SUBJECTS 的順序排列"""
+    order = {key: i for i, key in enumerate(SUBJECTS)}
+    rows = ChildSubjectSummary.query.filter_by(child_id=child_id).all()
+    rows.sort(key=lambda r: (order.get(r.subject, len(order)), r.subject))
+    return {r.subject: r for r in rows}
+
+def summary_overall_attention_percent(summaries):
+    """整體平均專注度（0~100%）：以場次平均計算，忽略 0 與 None"""
+    att_sum = sum(r.attention_sum for r in summaries.values())
+    att_cnt = sum(r.attention_nonzero_count for r in summaries.values())
+    return round(att_sum / att_cnt * 100 / 3) if att_cnt else 0
+
+def rebuild_subject_summaries(child_id=None):
+    """由 StudySession 重新計算科目彙總（修復用）；child_id 為 None 時重建全部。回傳寫入筆數"""
+    existing = ChildSubjectSummary.query
+    if child_id is not None:
+        existing = existing.filter_by(child_id=child_id)
+    existing.delete(synchronize_session=False)
+
+    rows = [ChildSubjectSummary(child_id=cid, subject=subject, session_count=cnt, total_minutes=minutes,
+                                attention_sum=att_sum, attention_count=att_cnt, attention_nonzero_count=nonzero)
+            for cid, subject, cnt, minutes, att_sum, att_cnt, nonzero in query_subject_stats(child_id)]
+    db.session.add_all(rows)
+    return len(rows)
+
+# ----------------- SQL 彙總查詢（回傳 tuple，不載入 StudySession 物件） -----------------
+def eligible_session_filter():
+    """與 is_eligible_session 相同的條件：已結束且時長 >= MIN_SESSION_MINUTES（None 視為 0）"""
+    return db.and_(StudySession.end_time.isnot(None),
+                   db.func.coalesce(StudySession.duration_minutes, 0) >= MIN_SESSION_MINUTES)
+
+def query_subject_stats(child_id=None):
+    """[(child_id, subject, 場次數, 總分鐘, 專注度總和, 專注度筆數, 非 0 專注度筆數)]；child_id 為 None 時查全部"""
+    query = (db.session.query(StudySession.child_id, StudySession.subject,
+                              db.func.count(StudySession.id),
+                              db.func.coalesce(db.func.sum(StudySession.duration_minutes), 0),
+                              db.func.coalesce(db.func.sum(StudySession.avg_attention), 0.0),
+                              db.func.count(StudySession.avg_attention),
+                              db.func.count(db.func.nullif(StudySession.avg_attention, 0)))
+             .filter(eligible_session_filter())
+             .group_by(StudySession.child_id, StudySession.subject))
+    if child_id is not None:
+        query = query.filter(StudySession.child_id == child_id)
+    return [(cid, subject, cnt, int(minutes), float(att_sum), att_cnt, nonzero)
+            for cid, subject, cnt, minutes, att_sum, att_cnt, nonzero in query.all()]
+
+def query_recent_attention_trend(child_id, limit=10):
+    """最近 limit 場的 [(start_time, avg_attention)]，依時間由舊到新"""
+    rows = (db.session.query(StudySession.start_time, StudySession.avg_attention)
+            .filter(StudySession.child_id == child_id, eligible_session_filter())
+            .order_by(StudySession.start_time.desc(), StudySession.id.desc())
+            .limit(limit)
+            .all())
+    return [tuple(r) for r in reversed(rows)]
+
+def query_attention_endpoints(child_id, n=3):
+    """非 0 專注度的場次數，以及最早 n 場、最近 n 場的專注度（皆依時間由舊到新）"""
+    base = (db.session.query(StudySession.avg_attention)
+            .filter(StudySession.child_id == child_id, eligible_session_filter(),
+                    StudySession.avg_attention != 0))
+    count = base.count()
+    early = [a for (a,) in base.order_by(StudySession.start_time, StudySession.id).limit(n).all()]
+    recent = [a for (a,) in base.order_by(StudySession.start_time.desc(), StudySession.id.desc()).limit(n).all()]
+    return count, early, list(reversed(recent))
+
+def query_hourly_attention(child_id):
+    """[(開始時段 0~23, 非 0 平均專注度或 None)]，依該時段第一次出現的時間排序"""
+    hour = db.extract('hour', StudySession.start_time)
+    first_seen = db.func.min(StudySession.start_time)
+    rows = (db.session.query(hour, db.func.avg(db.func.nullif(StudySession.avg_attention, 0)), first_seen)
+            .filter(StudySession.child_id == child_id, eligible_session_filter())
+            .group_by(hour)
+            .order_by(first_seen)
+            .all())
+    return [(int(h), avg) for h, avg, _ in rows]
+
+# ----------------- 唯讀場次投影（SessionRow） -----------------
+class SessionRow:
+    """只含分析頁面需要欄位的唯讀場次；不進 ORM identity map，也沒有 emotion_data 等關聯"""
+    __slots__ = ('id', 'subject', 'start_time', 'end_time', 'duration_minutes', 'avg_attention')
+
+    def __init__(self, id, subject, start_time, end_time, duration_minutes, avg_attention):
+        self.id = id
+        self.subject = subject
+        self.start_time = start_time
+        self.end_time = end_time
+        self.duration_minutes = duration_minutes
+        self.avg_attention = avg_attention
+
+SESSION_ROW_COLUMNS = (StudySession.id, StudySession.subject, StudySession.start_time,
+                       StudySession.end_time, StudySession.duration_minutes, StudySession.avg_attention)
+
+def query_session_rows(child_id, *criteria, order_by=None, limit=None):
+    """以欄位查詢取得 [SessionRow]，供不會修改資料的頁面與 API 使用"""
+    stmt = db.select(*SESSION_ROW_COLUMNS).where(StudySession.child_id == child_id, *criteria)
+    if order_by is not None:
+        stmt = stmt.order_by(*order_by) if isinstance(order_by, (list, tuple)) else stmt.order_by(order_by)
+    if limit is not None:
+        stmt = stmt.limit(limit)
+    return [SessionRow(*row) for row in db.session.execute(stmt)]
+
+# ----------------- 學習分析（SessionAnalytics，各頁面與 PDF 報告共用） -----------------
+ANALYTICS_CACHE_SIZE = int(os.getenv('ANALYTICS_CACHE_SIZE', '256'))
+
+class SubjectStats(SubjectAttentionMixin):
+    """ChildSubjectSummary 的唯讀快照，可安全地跨 request 保存在快取中"""
+    __slots__ = ('session_count', 'total_minutes', 'attention_sum', 'attention_count', 'attention_nonzero_count')
+
+    def __init__(self, row):
+        for name in self.__slots__:
+            setattr(self, name, getattr(row, name))
+
+class SessionAnalytics:
+    """一個小孩的學習統計，只計 is_eligible_session 的場次；整體 / 科目平均專注度一律忽略 0 與 None。
+    科目統計讀 ChildSubjectSummary，趨勢、時段與進步幅度由 SQL 彙總，不載入 StudySession 物件。"""
+
+    def __init__(self, child_id):
+        self.child_id = child_id
+        self.subjects = {subject: SubjectStats(r) for subject, r in load_subject_summaries(child_id).items()}
+        self.total_sessions = sum(r.session_count for r in self.subjects.values())
+        self.total_minutes = sum(r.total_minutes for r in self.subjects.values())
+        att_sum = sum(r.attention_sum for r in self.subjects.values())
+        att_cnt = sum(r.attention_nonzero_count for r in self.subjects.values())
+        self.overall_attention = att_sum / att_cnt if att_cnt else None  # 0~3
+        self.overall_attention_percent = summary_overall_attention_percent(self.subjects)
+        self.recent_trend = query_recent_attention_trend(child_id)
+        self.hourly_attention = query_hourly_attention(child_id)
+
+        self.improvement_rate = 0
+        att_count, early_att, recent_att = query_attention_endpoints(child_id)
+        if att_count >= 5:
+            early = sum(early_att) / 3
+            recent = sum(recent_att) / 3
+            if early:
+                self.improvement_rate = round((recent - early) / early * 100)
+
+    @property
+    def best_hour(self):
+        """平均專注度最高的開始時段；同分時取較早出現者"""
+        if not self.hourly_attention:
+            return None
+        return max(self.hourly_attention, key=lambda x: x[1] or 0)[0]
+
+    @property
+    def most_studied_subject(self):
+        """總學習時間最長的科目代碼"""
+        if not self.subjects:
+            return None
+        return max(self.subjects.items(), key=lambda kv: kv[1].total_minutes)[0]
+
+    @property
+    def most_frequent_subject(self):
+        """學習次數最多的科目代碼；同次數時取 SUBJECTS 順序較前者"""
+        if not self.subjects:
+            return None
+        return max(self.subjects.items(), key=lambda kv: kv[1].session_count)[0]
+
+_analytics_cache = OrderedDict()  # child_id -> (analytics_version, SessionAnalytics)
+_analytics_lock = threading.Lock()
+
+def get_session_analytics(child):
+    """依 (child.id, child.analytics_version) 快取的 SessionAnalytics；場次異動後版本遞增即自動重算"""
+    version = child.analytics_version or 0
+    with _analytics_lock:
+        cached = _analytics_cache.get(child.id)
+        if cached and cached[0] == version:
+            _analytics_cache.move_to_end(child.id)
+            return cached[1]
+
+    analytics = SessionAnalytics(child.id)
+    with _analytics_lock:
+        _analytics_cache[child.id] = (version, analytics)
+        _analytics_cache.move_to_end(child.id)
+        while len(_analytics_cache) > ANALYTICS_CACHE_SIZE:
+            _analytics_cache.popitem(last=False)
+    return analytics
+
+# ----------------- 每日彙總（ChildDailySubjectRollup，行事曆用） -----------------
+CALENDAR_SUBJECT_COLORS = {
+    'math': '#3498DB', 'science': '#2ECC71', 'language': '#E74C3C',
+    'social': '#F39C12', 'art': '#9B59B6', 'cs': '#1ABC9C'
+}
+
+def _day_range(day):
+    start = datetime(day.year, day.month, day.day)
+    return start, start + timedelta(days=1)
+
+def _recompute_best_attention(row, exclude_session_id):
+    day_start, day_end = _day_range(row.study_date)
+    best = (db.session.query(db.func.max(db.func.coalesce(StudySession.avg_attention, 0.0)))
+            .filter(StudySession.child_id == row.child_id,
+                    StudySession.subject == row.subject,
+                    StudySession.start_time >= day_start,
+                    StudySession.start_time < day_end,
+                    eligible_session_filter(),
+                    StudySession.id != exclude_session_id)
+            .scalar())
+    row.best_attention = float(best or 0.0)
+
+def _apply_daily_rollup_delta(s, sign):
+    # 與科目彙總相同，只計入 is_eligible_session 的場次
+    if not is_eligible_session(s) or s.start_time is None:
+        return
+    key = (s.child_id, s.start_time.date(), s.subject)
+    row = db.session.get(ChildDailySubjectRollup, key, with_for_update=True)
+    if row is None:
+        if sign < 0:
+            return
+        row = ChildDailySubjectRollup(child_id=key[0], study_date=key[1], subject=key[2], session_count=0,
+                                      total_minutes=0, attention_sum=0.0, attention_count=0, best_attention=0.0)
+        db.session.add(row)
+    attention = s.avg_attention or 0.0
+    row.session_count += sign
+    row.total_minutes += sign * (s.duration_minutes or 0)
+    if s.avg_attention is not None:
+        row.attention_sum += sign * s.avg_attention
+        row.attention_count += sign
+    if row.session_count <= 0:
+        db.session.delete(row)
+    elif sign > 0:
+        row.best_attention = max(row.best_attention, attention)
+    elif attention >= row.best_attention:
+        _recompute_best_attention(row, s.id)  # 扣掉的是當天最高分的場次才需要重查
+
+def load_daily_rollups(child_id, start_date, end_date):
+    """[start_date, end_date) 區間的每日彙總，依日期、SUBJECTS 順序排列（單一索引範圍掃描）"""
+    order = {key: i for i, key in enumerate(SUBJECTS)}
+    rows = (ChildDailySubjectRollup.query
+            .filter(ChildDailySubjectRollup.child_id == child_id,
+                    ChildDailySubjectRollup.study_date >= start_date,
+                    ChildDailySubjectRollup.study_date < end_date)
+            .all())
+    rows.sort(key=lambda r: (r.study_date, order.get(r.subject, len(order)), r.subject))
+    return rows
+
+def best_daily_rollup(rows):
+    """單場最高專注度的科目；同分時取 SUBJECTS 順序較前者"""
+    return max(rows, key=lambda r: r.best_attention) if rows else None
+
+def rebuild_daily_rollups(child_id=None):
+    """由 StudySession 重新計算每日彙總（修復用）；child_id 為 None 時重建全部。回傳寫入筆數"""
+    day = db.func.date(StudySession.start_time)
+    query = (db.session.query(StudySession.child_id, day, StudySession.subject,
+                              db.func.count(StudySession.id),
+                              db.func.coalesce(db.func.sum(StudySession.duration_minutes), 0),
+                              db.func.coalesce(db.func.sum(StudySession.avg_attention), 0.0),
+                              db.func.count(StudySession.avg_attention),
+                              db.func.max(db.func.coalesce(StudySession.avg_attention, 0.0)))
+             .filter(eligible_session_filter())
+             .filter(StudySession.start_time.isnot(None))
+             .group_by(StudySession.child_id, day, StudySession.subject))
+    existing = ChildDailySubjectRollup.query
+    if child_id is not None:
+        query = query.filter(StudySession.child_id == child_id)
+        existing = existing.filter_by(child_id=child_id)
+    existing.delete(synchronize_session=False)
+
+    rows = []
+    for cid, study_date, subject, cnt, minutes, att_sum, att_cnt, best in query.all():
+        if isinstance(study_date, str):  # SQLite 的 date() 回傳字串
+            study_date = datetime.strptime(study_date, '%Y-%m-%d').date()
+        rows.append(ChildDailySubjectRollup(child_id=cid, study_date=study_date, subject=subject,
+                                            session_count=cnt, total_minutes=int(minutes),
+                                            attention_sum=float(att_sum), attention_count=att_cnt,
+                                            best_attention=float(best or 0.0)))
+    db.session.add_all(rows)
+    return len(rows)
 
 # ----------------- 影片輔助 -----------------
 def get_subject_video_dir(subject_key: str) -> str:
@@ -277,50 +1248,126 @@ def build_video_static_url(subject_key: str, filename: str) -> str:
     rel_path = f"{static_root_name}/{folder}/{filename}"
     return url_for('static', filename=rel_path)
 
+# ----------------- AI 建議快取 -----------------
+AI_CACHE_ENABLED = os.environ.get('AI_CACHE_ENABLED', 'true').lower() == 'true'
+AI_CACHE_TTL_SECONDS = int(os.environ.get('AI_CACHE_TTL_SECONDS', 7 * 24 * 3600))
+AI_CACHE_MAX_ENTRIES = int(os.environ.get('AI_CACHE_MAX_ENTRIES', 5000))
+
+class AISuggestionResponseCache:
+    """以 AISuggestionCache 表實作的 TTL + LRU 快取（資料庫共用，所有 worker 皆可命中）。
+    get / put 在 db.session 的 SAVEPOINT 內操作、由呼叫端 commit；資料庫錯誤時只回滾該 SAVEPOINT
+    （呼叫端尚未 commit 的變更不受影響），並視為未命中，不影響產生建議。"""
+
+    def __init__(self, ttl_seconds, max_entries):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self.stats = {'hits': 0, 'misses': 0, 'stores': 0, 'expired': 0, 'evicted': 0, 'errors': 0}
+
+    @staticmethod
+    def make_key(model, messages, **params):
+        payload = json.dumps({'model': model, 'messages': messages, 'params': params},
+                             ensure_ascii=False, sort_keys=True)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def _count(self, name, n=1):
+        with self._lock:
+            self.stats[name] += n
+
+    def get(self, key):
+        """命中回傳快取文字並更新 LRU 時間；未命中或已過期回傳 None"""
+        try:
+            with db.session.begin_nested():
+                entry = db.session.get(AISuggestionCache, key)
+                now = datetime.utcnow()
+                expired = entry is not None and entry.created_at < now - timedelta(seconds=self.ttl_seconds)
+                if expired:
+                    db.session.delete(entry)
+                elif entry is not None:
+                    entry.hit_count += 1
+                    entry.last_used_at = now
+        except SQLAlchemyError as e:
+            self._count('errors')
+            print(f'⚠ AI 建議快取讀取失敗: {e}')
+            return None
+        if expired:
+            self._count('expired')
+        if entry is None or expired:
+            self._count('misses')
+            return None
+        self._count('hits')
+        return entry.response
+
+    def put(self, key, model, response):
+        """寫入快取，並清掉過期項目與超過 max_entries 的最久未使用項目"""
+        try:
+            with db.session.begin_nested():
+                now = datetime.utcnow()
+                db.session.merge(AISuggestionCache(key=key, model=model, response=response, hit_count=0,
+                                                   created_at=now, last_used_at=now))
+                db.session.flush()
+                expired = (AISuggestionCache.query
+                           .filter(AISuggestionCache.created_at < now - timedelta(seconds=self.ttl_seconds))
+                           .delete(synchronize_session=False))
+                overflow = AISuggestionCache.query.count() - self.max_entries
+                evicted = 0
+                if overflow > 0:
+                    oldest = (db.session.query(AISuggestionCache.key)
+                              .order_by(AISuggestionCache.last_used_at)
+                              .limit(overflow)
+                              .subquery())
+                    evicted = (AISuggestionCache.query
+                               .filter(AISuggestionCache.key.in_(db.select(oldest.c.key)))
+                               .delete(synchronize_session=False))
+            self._count('stores')
+            self._count('expired', expired)
+            self._count('evicted', evicted)
+        except SQLAlchemyError as e:
+            self._count('errors')
+            print(f'⚠ AI 建議快取寫入失敗: {e}')
+
+    def snapshot(self):
+        with self._lock:
+            data = dict(self.stats)
+        lookups = data['hits'] + data['misses']
+        data['hit_rate'] = round(data['hits'] / lookups, 3) if lookups else 0.0
+        data['enabled'] = AI_CACHE_ENABLED
+        return data
+
+ai_response_cache = AISuggestionResponseCache(AI_CACHE_TTL_SECONDS, AI_CACHE_MAX_ENTRIES)
+
 # ----------------- AI 產生建議 -----------------
-def generate_ai_suggestions(child, study_sessions):
-    """使用 OpenAI 生成個人化學習建議；任一失敗情境皆回 FAILURE_TEXT"""
-    if not has_openai_client():
-        return FAILURE_TEXT
+AI_SUGGESTION_MODEL = "gpt-4o-mini"
+AI_SUGGESTION_SYSTEM_PROMPT = "你是一位專業的教育顧問，專長於為台灣學生提供個人化學習建議。"
+AI_SUGGESTION_PARAMS = {'max_tokens': 800, 'temperature': 0.7}
 
-    try:
-        eligible = [s for s in study_sessions if is_eligible_session(s)]
-        total_sessions = len(eligible)
+def build_ai_suggestion_messages(child):
+    """依小孩資料與學習摘要組出 chat messages（相同摘要產生相同內容，供快取計算 key）"""
+    analytics = get_session_analytics(child)
+    total_sessions = analytics.total_sessions
 
-        if total_sessions == 0:
-            learning_summary = "目前尚無學習記錄"
-        else:
-            total_minutes = sum(s.duration_minutes or 0 for s in eligible)
-            avg_attention_percent = compute_overall_avg_attention_percent(eligible)  # ← 與前台一致
-
-            subject_stats = {}
-            for session in eligible:
-                d = subject_stats.setdefault(session.subject, {
-                    'count': 0, 'total_time': 0,
-                    'att_sum': 0.0, 'att_cnt': 0
-                })
-                d['count'] += 1
-                d['total_time'] += (session.duration_minutes or 0)
-                if session.avg_attention:  # ← 忽略 0
-                    d['att_sum'] += session.avg_attention
-                    d['att_cnt'] += 1
-
-            best_subject = ""
-            worst_subject = ""
-            if subject_stats:
-                best_avg = -1
-                worst_avg = 10**9
-                for subj, st in subject_stats.items():
-                    avg_att = (st['att_sum'] / st['att_cnt']) if st['att_cnt'] > 0 else None
-                    if avg_att is not None:
-                        if avg_att > best_avg:
-                            best_avg = avg_att
-                            best_subject = SUBJECTS.get(subj, subj)
-                        if avg_att < worst_avg:
-                            worst_avg = avg_att
-                            worst_subject = SUBJECTS.get(subj, subj)
-                            
-            learning_summary = f"""
+    if total_sessions == 0:
+        learning_summary = "目前尚無學習記錄"
+    else:
+        total_minutes = analytics.total_minutes
+        avg_attention_percent = analytics.overall_attention_percent  # ← 與前台一致
+
+        best_subject = ""
+        worst_subject = ""
+        if analytics.subjects:
+            best_avg = -1
+            worst_avg = 10**9
+            for subj, st in analytics.subjects.items():
+                avg_att = st.avg_attention_nonzero  # ← 忽略 0
+                if avg_att is not None:
+                    if avg_att > best_avg:
+                        best_avg = avg_att
+                        best_subject = SUBJECTS.get(subj, subj)
+                    if avg_att < worst_avg:
+                        worst_avg = avg_att
+                        worst_subject = SUBJECTS.get(subj, subj)
+                        
+        learning_summary = f"""
             總學習次數: {total_sessions}次
             總學習時間: {total_minutes}分鐘
             平均專注度: {avg_attention_percent}%
@@ -328,7 +1375,7 @@ def generate_ai_suggestions(child, study_sessions):
             需要加強科目: {worst_subject}
             """
 
-        prompt = f"""
+    prompt = f"""
         你是一位專業的教育顧問，請根據以下學生資訊提供具體且實用的學習建議：
 
         學生基本資訊：
@@ -350,23 +1397,488 @@ def generate_ai_suggestions(child, study_sessions):
         請用溫柔、鼓勵的口吻，以一段話呈現（非條列），總長度控制在300字內，繁體中文。
         """
 
-        response = client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[
-                {"role": "system", "content": "你是一位專業的教育顧問，專長於為台灣學生提供個人化學習建議。"},
-                {"role": "user", "content": prompt}
-            ],
-            max_tokens=800,
-            temperature=0.7,
-            timeout=30
+    return [
+        {"role": "system", "content": AI_SUGGESTION_SYSTEM_PROMPT},
+        {"role": "user", "content": prompt}
+    ]
+
+def openai_chat_completion(messages):
+    """在 OPENAI_CALL_DEADLINE 內呼叫 chat.completions；連線錯誤、429、5xx 依 OPENAI_MAX_RETRIES 退避重試，
+    每次嘗試的 timeout 為剩餘期限"""
+    deadline = time.monotonic() + OPENAI_CALL_DEADLINE
+    client = get_openai_client()
+    with openai_limiter.slot(deadline):
+        for attempt in range(OPENAI_MAX_RETRIES + 1):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise OpenAIDeadlineExceeded(f'OpenAI 呼叫超過 {OPENAI_CALL_DEADLINE:.0f} 秒期限')
+            try:
+                return client.chat.completions.create(
+                    model=AI_SUGGESTION_MODEL,
+                    messages=messages,
+                    timeout=remaining,
+                    **AI_SUGGESTION_PARAMS
+                )
+            except OPENAI_RETRYABLE_ERRORS as e:
+                backoff = min(0.5 * 2 ** attempt, 8.0)
+                if time.monotonic() >= deadline:
+                    raise OpenAIDeadlineExceeded(f'OpenAI 呼叫超過 {OPENAI_CALL_DEADLINE:.0f} 秒期限') from e
+                if attempt == OPENAI_MAX_RETRIES or deadline - time.monotonic() <= backoff:
+                    raise
+                openai_limiter.count('retries')
+                print(f"⚠ OpenAI 呼叫失敗，{backoff:.1f} 秒後重試: {e}")
+                time.sleep(backoff)
+
+def openai_chat_stream(messages):
+    """串流版：逐段 yield 文字。整段串流受 OPENAI_CALL_DEADLINE 限制；已輸出內容後不重試，避免重複文字"""
+    deadline = time.monotonic() + OPENAI_CALL_DEADLINE
+    client = get_openai_client()
+    with openai_limiter.slot(deadline):
+        stream = client.chat.completions.create(
+            model=AI_SUGGESTION_MODEL,
+            messages=messages,
+            stream=True,
+            timeout=deadline - time.monotonic(),
+            **AI_SUGGESTION_PARAMS
         )
-        ai_suggestion = response.choices[0].message.content.strip() if response else ""
-        return ai_suggestion or FAILURE_TEXT
+        try:
+            for chunk in stream:
+                if time.monotonic() > deadline:
+                    raise OpenAIDeadlineExceeded(f'OpenAI 串流超過 {OPENAI_CALL_DEADLINE:.0f} 秒期限')
+                delta = chunk.choices[0].delta.content if chunk.choices else None
+                if delta:
+                    yield delta
+        finally:
+            stream.response.close()  # 提早結束時歸還連線給連線池
+
+def request_ai_suggestion(messages):
+    """查 AI 建議快取，未命中才呼叫 OpenAI 並寫入快取；失敗或回傳空白時拋出例外，由呼叫端決定重試或回 FAILURE_TEXT"""
+    cache_key = ai_response_cache.make_key(AI_SUGGESTION_MODEL, messages, **AI_SUGGESTION_PARAMS)
+    if AI_CACHE_ENABLED:
+        cached = ai_response_cache.get(cache_key)
+        if cached:
+            return cached
+
+    response = openai_chat_completion(messages)
+    ai_suggestion = response.choices[0].message.content.strip() if response and response.choices else ""
+    if not ai_suggestion:
+        raise ValueError('OpenAI 回傳空白建議')
+    if AI_CACHE_ENABLED:
+        ai_response_cache.put(cache_key, AI_SUGGESTION_MODEL, ai_suggestion)
+    return ai_suggestion
+
+def generate_ai_suggestions(child):
+    """使用 OpenAI 生成個人化學習建議（先查 AI 建議快取）；任一失敗情境皆回 FAILURE_TEXT"""
+    if not has_openai_client():
+        return FAILURE_TEXT
 
+    try:
+        return request_ai_suggestion(build_ai_suggestion_messages(child))
     except Exception as e:
         print(f"AI建議生成過程發生錯誤: {e}")
         return FAILURE_TEXT
 
+def store_ai_suggestion(child, text, version):
+    """寫回 Child.ai_suggestion（讓重新整理仍能看到最新結果）。
+    version 為組 prompt 時的 analytics_version；失敗文字不記版本，讓批次預先產生時重算。"""
+    child.ai_suggestion = text
+    child.pdf_generated_at = None
+    child.ai_suggestion_version = None if text == FAILURE_TEXT else version
+    child.ai_suggestion_at = datetime.utcnow()
+
+# ----------------- AI 建議背景工作佇列 -----------------
+AI_JOB_WORKERS = int(os.environ.get('AI_JOB_WORKERS', 2))
+AI_JOB_STALE_SECONDS = int(os.environ.get('AI_JOB_STALE_SECONDS', 300))    # running 超過此時間視為 worker 已中斷
+AI_JOB_MAX_ATTEMPTS = int(os.environ.get('AI_JOB_MAX_ATTEMPTS', 3))
+AI_JOB_CLAIM_RETRY_SECONDS = 2  # 認領工作時資料庫錯誤，第 n 次重試前等待 n 倍秒數
+AI_JOB_RETENTION_DAYS = int(os.environ.get('AI_JOB_RETENTION_DAYS', 7))
+AI_JOB_ACTIVE_STATUSES = ('queued', 'running')
+
+class AISuggestionJobQueue:
+    """把 generate_ai_suggestions 移出 request：工作先寫入 AISuggestionJob，再交給本行程的執行緒池。
+
+    - 執行緒池在第一次使用時才建立（fork 後的 worker 會各自重新建立），同時接手中斷留下的工作
+    - 以條件式 UPDATE（status='queued'）認領工作，多個 worker 重複排入同一工作也只會執行一次
+    - 同一個小孩已有進行中的工作時直接沿用，避免重複呼叫 OpenAI
+    """
+
+    def __init__(self, workers):
+        self.workers = workers
+        self._lock = threading.Lock()
+        self._executor = None
+        self._pid = None
+        self.stats = {'submitted': 0, 'completed': 0, 'failed': 0, 'recovered': 0}
+
+    def ensure_started(self):
+        with self._lock:
+            if self._executor is not None and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='ai-suggestion-job')
+        self.recover()
+
+    def _submit(self, job_id):
+        self._executor.submit(self._run, job_id)
+        with self._lock:
+            self.stats['submitted'] += 1
+
+    def enqueue(self, child_id):
+        """建立（或沿用進行中的）工作並排入背景執行，回傳 AISuggestionJob"""
+        self.ensure_started()
+        cutoff = datetime.utcnow() - timedelta(seconds=AI_JOB_STALE_SECONDS)
+        active = (AISuggestionJob.query
+                  .filter(AISuggestionJob.child_id == child_id,
+                          AISuggestionJob.status.in_(AI_JOB_ACTIVE_STATUSES),
+                          AISuggestionJob.created_at >= cutoff)
+                  .order_by(AISuggestionJob.created_at.desc())
+                  .first())
+        if active:
+            return active
+
+        job = AISuggestionJob(id=uuid.uuid4().hex, child_id=child_id, status='queued', attempts=0,
+                              created_at=datetime.utcnow())
+        db.session.add(job)
+        db.session.commit()
+        self._submit(job.id)
+        return job
+
+    def recover(self):
+        """重新排入前一個行程留下的 queued / 逾時 running 工作，並清除過期的已完成工作"""
+        now = datetime.utcnow()
+        stale_cutoff = now - timedelta(seconds=AI_JOB_STALE_SECONDS)
+        try:
+            (AISuggestionJob.query
+             .filter(AISuggestionJob.status == 'running', AISuggestionJob.started_at < stale_cutoff)
+             .update({AISuggestionJob.status: 'queued'}, synchronize_session=False))
+            (AISuggestionJob.query
+             .filter(AISuggestionJob.status == 'queued', AISuggestionJob.attempts >= AI_JOB_MAX_ATTEMPTS)
+             .update({AISuggestionJob.status: 'failed', AISuggestionJob.result: FAILURE_TEXT,
+                      AISuggestionJob.error: 'too many attempts', AISuggestionJob.finished_at: now},
+                     synchronize_session=False))
+            (AISuggestionJob.query
+             .filter(AISuggestionJob.status.in_(('done', 'failed')),
+                     AISuggestionJob.finished_at < now - timedelta(days=AI_JOB_RETENTION_DAYS))
+             .delete(synchronize_session=False))
+            pending = [job_id for (job_id,) in
+                       db.session.query(AISuggestionJob.id).filter(AISuggestionJob.status == 'queued').all()]
+            db.session.commit()
+        except SQLAlchemyError as e:
+            db.session.rollback()
+            print(f'⚠ 無法接手中斷的 AI 建議工作: {e}')
+            return 0
+
+        for job_id in pending:
+            self._submit(job_id)
+        if pending:
+            with self._lock:
+                self.stats['recovered'] += len(pending)
+            print(f'✓ 已重新排入 {len(pending)} 個 AI 建議工作')
+        return len(pending)
+
+    def _claim_failed(self, job_id, failures, error):
+        """認領時發生資料庫錯誤：稍後重新排入；重試 AI_JOB_MAX_ATTEMPTS 次仍失敗就標為 failed，
+        避免工作一直停在 queued，enqueue 又把這個不會執行的工作交給每個呼叫端"""
+        print(f'✗ 無法認領 AI 建議工作 {job_id}（第 {failures} 次）: {error}')
+        if failures < AI_JOB_MAX_ATTEMPTS:
+            timer = threading.Timer(AI_JOB_CLAIM_RETRY_SECONDS * failures, self._executor.submit,
+                                    (self._run, job_id, failures))
+            timer.daemon = True
+            timer.start()
+            return
+        try:
+            (AISuggestionJob.query
+             .filter_by(id=job_id, status='queued')
+             .update({AISuggestionJob.status: 'failed', AISuggestionJob.result: FAILURE_TEXT,
+                      AISuggestionJob.error: f'claim failed: {error}'[:500],
+                      AISuggestionJob.finished_at: datetime.utcnow()},
+                     synchronize_session=False))
+            db.session.commit()
+        except SQLAlchemyError as e:
+            db.session.rollback()
+            print(f'✗ 無法將 AI 建議工作 {job_id} 標為失敗: {e}')
+        with self._lock:
+            self.stats['failed'] += 1
+
+    def _run(self, job_id, claim_failures=0):
+        with app.app_context():
+            try:
+                claimed = (AISuggestionJob.query
+                           .filter_by(id=job_id, status='queued')
+                           .update({AISuggestionJob.status: 'running',
+                                    AISuggestionJob.started_at: datetime.utcnow(),
+                                    AISuggestionJob.attempts: AISuggestionJob.attempts + 1},
+                                   synchronize_session=False))
+                db.session.commit()
+            except SQLAlchemyError as e:
+                db.session.rollback()
+                self._claim_failed(job_id, claim_failures + 1, e)
+                return
+            if not claimed:
+                return  # 已由其他執行緒 / worker 認領
+
+            try:
+                job = db.session.get(AISuggestionJob, job_id)
+                child = db.session.get(Child, job.child_id) if job else None
+                if child is None:
+                    raise LookupError('工作或小孩檔案已刪除')
+                if not has_openai_client():
+                    raise RuntimeError('OpenAI 客戶端不可用')
+                version = child.analytics_version
+                # 不經 generate_ai_suggestions（失敗時回 FAILURE_TEXT）：失敗要讓工作標為 failed，保留小孩原本的建議
+                text = request_ai_suggestion(build_ai_suggestion_messages(child))
+                store_ai_suggestion(child, text, version)
+                job.status = 'done'
+                job.result = text
+                job.finished_at = datetime.utcnow()
+                db.session.commit()
+                outcome = 'completed'
+            except Exception as e:
+                db.session.rollback()
+                print(f'✗ AI 建議工作 {job_id} 失敗: {e}')
+                outcome = 'failed'
+                try:
+                    job = db.session.get(AISuggestionJob, job_id)
+                    if job is not None:
+                        job.status = 'failed'
+                        job.result = FAILURE_TEXT
+                        job.error = str(e)[:500]
+                        job.finished_at = datetime.utcnow()
+                        db.session.commit()
+                except SQLAlchemyError as e2:
+                    # 停在 running 的工作超過 AI_JOB_STALE_SECONDS 後由 enqueue / recover 接手
+                    db.session.rollback()
+                    print(f'✗ 無法記錄 AI 建議工作 {job_id} 的失敗: {e2}')
+        with self._lock:
+            self.stats[outcome] += 1
+
+    def snapshot(self):
+        with self._lock:
+            data = dict(self.stats)
+        data['workers'] = self.workers
+        data['started'] = self._executor is not None and self._pid == os.getpid()
+        return data
+
+ai_job_queue = AISuggestionJobQueue(AI_JOB_WORKERS)
+
+# ----------------- AI 建議批次預先產生（每晚排程） -----------------
+AI_PRECOMPUTE_PARALLELISM = int(os.environ.get('AI_PRECOMPUTE_PARALLELISM', 4))
+AI_PRECOMPUTE_RATE_PER_MINUTE = float(os.environ.get('AI_PRECOMPUTE_RATE_PER_MINUTE', 60))   # 0 表示不限速
+AI_PRECOMPUTE_MAX_ATTEMPTS = int(os.environ.get('AI_PRECOMPUTE_MAX_ATTEMPTS', 3))
+AI_PRECOMPUTE_BACKOFF_SECONDS = float(os.environ.get('AI_PRECOMPUTE_BACKOFF_SECONDS', 5))     # 第 n 次重試等待 backoff * 2^(n-1)
+AI_PRECOMPUTE_ACTIVE_DAYS = int(os.environ.get('AI_PRECOMPUTE_ACTIVE_DAYS', 30))
+
+class RateLimiter:
+    """平均分配呼叫時間點的簡易限速器（多執行緒共用）"""
+
+    def __init__(self, per_minute):
+        self.interval = 60.0 / per_minute if per_minute > 0 else 0.0
+        self._lock = threading.Lock()
+        self._next = 0.0
+
+    def wait(self):
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next)
+            self._next = start + self.interval
+        if start > now:
+            time.sleep(start - now)
+
+def query_stale_ai_suggestion_child_ids(active_days=AI_PRECOMPUTE_ACTIVE_DAYS):
+    """近 active_days 天有有效場次、且 AI 建議不存在或產生後場次已異動（ai_suggestion_version != analytics_version）的小孩"""
+    cutoff = get_taiwan_now() - timedelta(days=active_days)
+    active = (db.select(StudySession.child_id)
+              .where(StudySession.start_time >= cutoff, eligible_session_filter())
+              .distinct())
+    stmt = (db.select(Child.id)
+            .where(Child.id.in_(active),
+                   db.or_(Child.ai_suggestion.is_(None),
+                          Child.ai_suggestion_version.is_(None),
+                          Child.ai_suggestion_version != Child.analytics_version))
+            .order_by(Child.id))
+    return list(db.session.scalars(stmt))
+
+def precompute_ai_suggestion(child_id, rate_limiter, max_attempts, backoff_seconds):
+    """為一個小孩產生並寫回 AI 建議（失敗依 backoff 重試）；回傳 'done' / 'skipped'，重試用盡時拋出最後的例外"""
+    with app.app_context():
+        child = db.session.get(Child, child_id)
+        if child is None:
+            return 'skipped'
+        version = child.analytics_version
+        messages = build_ai_suggestion_messages(child)
+        db.session.rollback()  # 呼叫 OpenAI 期間不占用資料庫連線
+
+        for attempt in range(1, max_attempts + 1):
+            rate_limiter.wait()
+            try:
+                text = request_ai_suggestion(messages)
+                db.session.commit()  # 快取寫入
+                break
+            except Exception as e:
+                db.session.rollback()
+                if attempt == max_attempts:
+                    raise
+                delay = backoff_seconds * 2 ** (attempt - 1)
+                print(f'⚠ 小孩 {child_id} 第 {attempt} 次產生失敗，{delay:.1f} 秒後重試: {e}')
+                time.sleep(delay)
+
+        # 產生期間若又有場次異動，留給下一次批次或頁面重新產生
+        child = (Child.query.filter_by(id=child_id, analytics_version=version)
+                 .with_for_update().first())
+        if child is None:
+            db.session.rollback()
+            return 'skipped'
+        store_ai_suggestion(child, text, version)
+        db.session.commit()
+        return 'done'
+
+def load_precompute_checkpoint(path):
+    try:
+        with open(path, encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+def save_precompute_checkpoint(path, checkpoint):
+    """先寫暫存檔再 rename，中斷時不會留下寫到一半的 checkpoint"""
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(checkpoint, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+# ----------------- 密碼雜湊（bcrypt）行程池 -----------------
+# 每個 gunicorn worker 各有一個行程池（第一次登入 / 註冊時才啟動）：雜湊子行程總數 = worker 數 × PASSWORD_HASH_WORKERS，
+# 與報告排版行程池共用同一個 forkserver 行程
+PASSWORD_HASH_WORKERS = int(os.environ.get('PASSWORD_HASH_WORKERS', 2))
+PASSWORD_HASH_MAX_PENDING = int(os.environ.get('PASSWORD_HASH_MAX_PENDING', 8))   # 排隊 + 執行中的上限，超過回 429
+PASSWORD_HASH_TIMEOUT = float(os.environ.get('PASSWORD_HASH_TIMEOUT', 10))         # request 最多等待幾秒
+# process：bcrypt 在子行程（worker_pool_context）執行，不占用 web worker 的 CPU；thread：在 worker 內執行
+PASSWORD_HASH_MODE = os.environ.get('PASSWORD_HASH_MODE', 'process')
+PASSWORD_HASH_RETRY_AFTER = 2  # 429 的 Retry-After 秒數
+PASSWORD_HASH_LATENCY_SAMPLES = 500  # 計算 p50 / p95 的最近樣本數
+PASSWORD_HASH_BUSY_MESSAGE = '目前使用人數眾多，請稍後再試'
+
+class PasswordHashBusy(Exception):
+    """密碼雜湊排隊已滿或等待逾時"""
+
+def _hash_password(password):
+    return bcrypt.generate_password_hash(password).decode('utf-8')
+
+def _check_password(pw_hash, password):
+    return bcrypt.check_password_hash(pw_hash, password)
+
+class PasswordHashPool:
+    """bcrypt 刻意很慢，移出 request 執行緒：雜湊 / 驗證交給固定大小的行程池，request 只等待結果。
+
+    排隊與執行中的工作合計不超過 max_pending，超過或等待逾時就拋出 PasswordHashBusy（路由回 429），
+    整班同時登入時多出來的請求立即被拒絕，不會把 worker 全卡在 bcrypt、讓進行中場次的情緒資料排在後面。
+    """
+
+    def __init__(self, workers, max_pending, timeout, mode):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self.mode = mode
+        self._lock = threading.Lock()
+        self._executor = None
+        self._pid = None
+        self.pending = 0
+        self._latencies = deque(maxlen=PASSWORD_HASH_LATENCY_SAMPLES)
+        self.stats = {'hashes': 0, 'checks': 0, 'rejected': 0, 'timeouts': 0, 'errors': 0,
+                      'max_pending': 0, 'latency_ms_total': 0.0, 'latency_ms_max': 0.0}
+
+    def ensure_started(self):
+        with self._lock:
+            if self._executor is not None and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self.pending = 0
+            if self.mode == 'process':
+                self._executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=worker_pool_context())
+            else:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='password-hash')
+
+    def _release(self, future):
+        # 工作真正結束才歸還名額；request 等待逾時後，仍在執行的工作照樣占用名額
+        with self._lock:
+            self.pending -= 1
+
+    def _run(self, stat, fn, *args):
+        self.ensure_started()
+        with self._lock:
+            if self.pending >= self.max_pending:
+                self.stats['rejected'] += 1
+                raise PasswordHashBusy(f'密碼雜湊排隊已滿（上限 {self.max_pending}）')
+            self.pending += 1
+            self.stats['max_pending'] = max(self.stats['max_pending'], self.pending)
+            executor = self._executor
+
+        start = time.monotonic()
+        try:
+            future = executor.submit(fn, *args)
+        except Exception:
+            self._release(None)
+            raise
+        future.add_done_callback(self._release)
+        try:
+            result = future.result(timeout=self.timeout)
+        except FutureTimeoutError:
+            with self._lock:
+                self.stats['timeouts'] += 1
+            raise PasswordHashBusy(f'密碼雜湊等待超過 {self.timeout:.0f} 秒')
+        except BrokenExecutor:
+            # 子行程異常結束：丟掉這個行程池，下一次呼叫重新建立
+            with self._lock:
+                self.stats['errors'] += 1
+                if self._executor is executor:
+                    self._executor = None
+            raise
+        except Exception:
+            with self._lock:
+                self.stats['errors'] += 1
+            raise
+
+        elapsed_ms = (time.monotonic() - start) * 1000
+        with self._lock:
+            self.stats[stat] += 1
+            self.stats['latency_ms_total'] += elapsed_ms
+            self.stats['latency_ms_max'] = max(self.stats['latency_ms_max'], elapsed_ms)
+            self._latencies.append(elapsed_ms)
+        return result
+
+    def hash(self, password):
+        """回傳 bcrypt 雜湊字串（工作因子為 BCRYPT_LOG_ROUNDS）"""
+        return self._run('hashes', _hash_password, password)
+
+    def check(self, pw_hash, password):
+        return self._run('checks', _check_password, pw_hash, password)
+
+    def snapshot(self):
+        with self._lock:
+            data = dict(self.stats)
+            data['pending'] = self.pending
+            latencies = sorted(self._latencies)
+        calls = data['hashes'] + data['checks']
+        data['latency_ms_avg'] = round(data['latency_ms_total'] / calls, 1) if calls else 0.0
+        data['latency_ms_total'] = round(data['latency_ms_total'], 1)
+        data['latency_ms_max'] = round(data['latency_ms_max'], 1)
+        data['latency_ms_p50'] = round(latencies[len(latencies) // 2], 1) if latencies else 0.0
+        data['latency_ms_p95'] = round(latencies[int(len(latencies) * 0.95)], 1) if latencies else 0.0
+        data['rounds'] = app.config['BCRYPT_LOG_ROUNDS']
+        data['workers'] = self.workers
+        data['max_pending_limit'] = self.max_pending
+        data['mode'] = self.mode
+        return data
+
+password_hasher = PasswordHashPool(PASSWORD_HASH_WORKERS, PASSWORD_HASH_MAX_PENDING, PASSWORD_HASH_TIMEOUT,
+                                   PASSWORD_HASH_MODE)
+
+def password_hash_busy_response():
+    response = jsonify({'success': False, 'message': PASSWORD_HASH_BUSY_MESSAGE})
+    response.headers['Retry-After'] = str(PASSWORD_HASH_RETRY_AFTER)
+    return response, 429
+
 # ----------------- Flask Routes -----------------
 @app.route('/')
 def index():
@@ -407,7 +1919,10 @@ def register():
             
             # 生成密碼哈希
             try:
-                password_hash = bcrypt.generate_password_hash(password).decode('utf-8')
+                password_hash = password_hasher.hash(password)
+            except PasswordHashBusy as busy:
+                print(f'⚠ 註冊暫時拒絕: {busy}')
+                return password_hash_busy_response()
             except Exception as hash_error:
                 print(f'✗ 密碼哈希失敗: {hash_error}')
                 return jsonify({'success': False, 'message': '密碼處理失敗'}), 500
@@ -464,7 +1979,10 @@ def login():
             
             # 驗證密碼
             try:
-                password_valid = bcrypt.check_password_hash(user.password_hash, password)
+                password_valid = password_hasher.check(user.password_hash, password)
+            except PasswordHashBusy as busy:
+                print(f'⚠ 登入暫時拒絕: {busy}')
+                return password_hash_busy_response()
             except Exception as check_error:
                 print(f'✗ 密碼驗證失敗: {check_error}')
                 return jsonify({'success': False, 'message': '登入驗證失敗'}), 500
@@ -501,18 +2019,83 @@ def logout():
     print(f'✓ 使用者已登出: {username}')
     return redirect(url_for('index'))
 
-# ===== 新增：檢查 Session 有效性 =====
+# ===== 資料庫斷路器：不在每個請求前 SELECT 1，改看記憶體中的狀態 =====
+DB_CIRCUIT_FAILURE_THRESHOLD = int(os.environ.get('DB_CIRCUIT_FAILURE_THRESHOLD', 3))  # 連續失敗幾次後斷開
+DB_CIRCUIT_OPEN_SECONDS = float(os.environ.get('DB_CIRCUIT_OPEN_SECONDS', 10))       # 斷開後多久再放行請求
+DB_UNAVAILABLE_MESSAGE = '資料庫連線失敗，請稍後再試'
+# 斷路時仍可回應的端點（不需要資料庫）
+DB_CIRCUIT_EXEMPT_ENDPOINTS = {'static', 'favicon', 'health_check', 'index'}
+
+class DbCircuitBreaker:
+    """由 engine / 連線池事件驅動：建立連線失敗或連線中斷時計數，連續失敗達門檻就在一段時間內直接回 503；
+    任何一次成功取得連線（pool checkout）即恢復。查詢本身的錯誤（語法、約束、鎖等待）不計入；
+    不論錯誤之後是否被路由自己的 except 攔截，判斷方式都相同。"""
+
+    def __init__(self, failure_threshold, open_seconds):
+        self.failure_threshold = failure_threshold
+        self.open_seconds = open_seconds
+        self._lock = threading.Lock()
+        self.failures = 0
+        self.opened_until = 0.0
+        self.trips = 0
+        self.last_error = None
+
+    def is_open(self):
+        return time.monotonic() < self.opened_until
+
+    def record_success(self):
+        if not self.failures and not self.opened_until:
+            return
+        with self._lock:
+            self.failures = 0
+            self.opened_until = 0.0
+
+    def record_failure(self, error):
+        with self._lock:
+            self.failures += 1
+            self.last_error = str(error)[:200]
+            if self.failures >= self.failure_threshold and not self.is_open():
+                self.opened_until = time.monotonic() + self.open_seconds
+                self.trips += 1
+                print(f"✗ 資料庫斷路器開啟 {self.open_seconds:.0f} 秒（連續失敗 {self.failures} 次）")
+
+    def snapshot(self):
+        return {
+            'state': 'open' if self.is_open() else 'closed',
+            'consecutive_failures': self.failures,
+            'trips': self.trips,
+            'last_error': self.last_error
+        }
+
+db_circuit = DbCircuitBreaker(DB_CIRCUIT_FAILURE_THRESHOLD, DB_CIRCUIT_OPEN_SECONDS)
+
+@event.listens_for(Pool, 'checkout')
+def _on_pool_checkout(dbapi_connection, connection_record, connection_proxy):
+    # pool_pre_ping 已在取得連線時確認可用；能取得連線就代表資料庫正常
+    db_circuit.record_success()
+
+@event.listens_for(Engine, 'handle_error')
+def _on_db_error(context):
+    # connection 為 None：建立連線（含 pre-ping 後重連）失敗；is_disconnect：使用中的連線斷線
+    if context.connection is None or context.is_disconnect:
+        db_circuit.record_failure(context.original_exception)
+
 @app.before_request
 def before_request():
-    """每個請求前確保資料庫連線正常"""
+    """斷路器開啟時直接回 503，不再對資料庫多打一次 SELECT 1"""
+    if db_circuit.is_open() and request.endpoint not in DB_CIRCUIT_EXEMPT_ENDPOINTS:
+        return jsonify({'success': False, 'message': DB_UNAVAILABLE_MESSAGE}), 503
+
+@app.errorhandler(OperationalError)
+def handle_db_operational_error(e):
+    """未被路由攔截的資料庫錯誤回 503（是否計入斷路器由 _on_db_error 判斷）"""
+    print(f"✗ 資料庫連線失敗: {e}")
     try:
-        # 測試資料庫連線
-        db.session.execute(text('SELECT 1'))  # ✅ 正確
-    except OperationalError as e:
-        print(f"✗ 資料庫連線失敗: {e}")
         db.session.rollback()
-        return jsonify({'success': False, 'message': '資料庫連線失敗，請稍後再試'}), 503
-    
+    except Exception:
+        pass
+    return jsonify({'success': False, 'message': DB_UNAVAILABLE_MESSAGE}), 503
+
 def check_session():
     """每個請求前檢查 Session 是否有效"""
     if 'user_id' in session:
@@ -638,52 +2221,32 @@ def dashboard():
     if not child:
         return redirect(url_for('child_selection'))
 
-    # 只統計「已完成（end_time 不為空）」的學習場次
-    user_study_sessions = (StudySession.query
-                           .filter_by(child_id=child_id)
-                           .filter(StudySession.end_time.isnot(None))
-                           .filter(StudySession.duration_minutes >= MIN_SESSION_MINUTES)  # ★ 新增
-                           .all())
-
-    subject_stats = {}
-    for s in user_study_sessions:
-        d = subject_stats.setdefault(s.subject, {
-            'count': 0,
-            'total_time': 0,
-            'avg_attention_sum': 0.0,
-            'attention_count': 0,
-            'avg_attention': 0.0
-        })
-        d['count'] += 1
-        d['total_time'] += (s.duration_minutes or 0)
-        if s.avg_attention is not None:
-            d['avg_attention_sum'] += s.avg_attention
-            d['attention_count'] += 1
-
-    for subject, d in subject_stats.items():
-        cnt = d['attention_count']
-        d['avg_attention'] = (d['avg_attention_sum'] / cnt) if cnt else 0.0
-        d.pop('avg_attention_sum', None)
-        d.pop('attention_count', None)
+    # 只統計「已完成（end_time 不為空）」的學習場次：讀共用的 SessionAnalytics，不掃描歷史場次
+    analytics = get_session_analytics(child)
+    subject_stats = {
+        subject: {
+            'count': r.session_count,
+            'total_time': r.total_minutes,
+            'avg_attention': r.avg_attention
+        }
+        for subject, r in analytics.subjects.items()
+    }
 
     # ★ 供首頁顯示：以「時數最長」當作最常學習科目
-    most_by_time_key = max(subject_stats.items(), key=lambda kv: kv[1]['total_time'])[0] if subject_stats else None
+    most_by_time_key = analytics.most_studied_subject
     most_by_time_name = SUBJECTS.get(most_by_time_key, most_by_time_key) if most_by_time_key else None
 
     # ★ 供首頁顯示：整體平均專注度（百分比）
-    att_list = [s.avg_attention for s in user_study_sessions if s.avg_attention is not None]
-    # overall_avg_attention_percent = round(sum(att_list)/len(att_list) * 100/3) if att_list else 0
-    overall_avg_attention_percent = compute_overall_avg_attention_percent(user_study_sessions)
+    overall_avg_attention_percent = analytics.overall_attention_percent
 
-    total_minutes = sum(s.duration_minutes or 0 for s in user_study_sessions)
-    total_hours = total_minutes / 60
+    total_hours = analytics.total_minutes / 60
 
     return render_template('dashboard.html',
                            subjects=SUBJECTS,
                            stats=subject_stats,
                            child=child,
                            overall_avg_attention=overall_avg_attention_percent,
-                           total_sessions=len(user_study_sessions),
+                           total_sessions=analytics.total_sessions,
                            total_hours=total_hours,
                            most_studied_subject_by_time=most_by_time_name)
 
@@ -718,7 +2281,7 @@ def study_session(subject):
         return redirect(url_for('child_selection'))
 
     return render_template('study.html', subject=subject, subject_name=SUBJECTS[subject],
-                           child=child, video_path=None, video_name=None)
+                           child=child, video_path=None, video_name=None, emotion_batch_mode=EMOTION_BATCH_MODE)
 
 @app.route('/study/<subject>/video/<path:video_filename>')
 def study_with_video(subject, video_filename):
@@ -745,7 +2308,8 @@ def study_with_video(subject, video_filename):
     video_name = os.path.splitext(os.path.basename(video_filename))[0]
 
     return render_template('study.html', subject=subject, subject_name=SUBJECTS[subject],
-                           child=child, video_path=video_url, video_name=video_name)
+                           child=child, video_path=video_url, video_name=video_name,
+                           emotion_batch_mode=EMOTION_BATCH_MODE)
 
 @app.get('/api/videos/<subject>')
 def api_list_videos(subject):
@@ -797,11 +2361,15 @@ def api_session_end():
 
     data = request.get_json(force=True) or {}
     session_id = data.get('session_id')
-    
+
+    # 先把本 worker 緩衝中的情緒資料寫入，讓累計值完整（其他 worker 較晚寫入的資料見 apply_emotion_aggregates）
+    emotion_buffer.flush()
+
     s = StudySession.query.get(session_id)
     if not s or s.child_id != session['child_id']:
         return jsonify({'ok': False, 'error': 'invalid session'}), 400
 
+    remove_session_from_summary(s)  # 重複結束同一場次時，先扣掉先前計入的值
     now = get_taiwan_now()  # 使用台灣時間
     s.end_time = now
     
@@ -816,17 +2384,14 @@ def api_session_end():
         print(f"  結束時間: {s.end_time}")
         print(f"  學習時長: {s.duration_minutes} 分鐘")
 
-    # 計算情緒統計
-    emotion_records = EmotionData.query.filter_by(session_id=session_id).all()
-    if emotion_records:
-        avg_attention = sum(r.attention_level for r in emotion_records) / len(emotion_records)
-        avg_emotion = sum(r.confidence for r in emotion_records) / len(emotion_records)
-        s.avg_attention = avg_attention
-        s.avg_emotion_score = avg_emotion
-        print(f"  平均專注度: {avg_attention:.2f}")
-        print(f"  情緒記錄數: {len(emotion_records)}")
+    # 計算情緒統計（讀取累計欄位，O(1)）
+    if apply_session_emotion_averages(s):
+        print(f"  平均專注度: {s.avg_attention:.2f}")
+        print(f"  情緒記錄數: {s.emotion_count}")
 
+    add_session_to_summary(s)
     db.session.commit()
+    prerender_report(s.child)
     
     # 清除 session
     session.pop('current_session_id', None)
@@ -914,24 +2479,179 @@ def record_emotion():
     if 'current_session_id' not in session:
         return jsonify({'success': False, 'message': '沒有活躍的學習階段'})
 
-    data = request.get_json()
-    emotion = data.get('emotion')
-    attention_level = data.get('attention_level')
-    confidence = data.get('confidence')
-
-    now = get_taiwan_now()  # 使用台灣時間
+    data = request.get_json(force=True, silent=True)
+    sample = normalize_emotion_sample(data)
+    if sample is None:
+        return jsonify({'success': False, 'message': '情緒數據格式錯誤'}), 400
+
+    # 每秒一次的路徑不查資料庫：場次是否進行中以 session cookie 為準（/api/session/end 會清除 current_session_id），
+    # 其他裝置結束場次後才寫入的資料由 apply_emotion_aggregates 重新結算
+    row = dict(sample, session_id=session['current_session_id'], timestamp=get_taiwan_now(),  # 使用台灣時間
+               seq=parse_seq(data.get('seq')))
+    if EMOTION_BUFFER_ENABLED:
+        # 先放進 write-behind 緩衝，立即回應；由背景執行緒批次寫入
+        if not emotion_buffer.add(row):
+            # 緩衝已滿（資料庫長時間無法寫入）：回 503 讓前端稍後重送
+            return jsonify({'success': False, 'message': DB_UNAVAILABLE_MESSAGE}), 503, {'Retry-After': '5'}
+        return jsonify({'success': True})
 
-    emotion_data = EmotionData(
-        session_id=session['current_session_id'],
-        emotion=emotion,
-        attention_level=attention_level,
-        confidence=confidence,
-        timestamp=now
-    )
-    db.session.add(emotion_data)
+    write_emotion_samples([row])
     db.session.commit()
     return jsonify({'success': True})
 
+# ===== 批次情緒寫入（前端緩衝 N 秒後一次送出，一次 INSERT + 一次 commit） =====
+EMOTION_BATCH_MAX_SAMPLES = int(os.environ.get('EMOTION_BATCH_MAX_SAMPLES', 600))
+# true：study 頁面緩衝樣本後送 /api/emotion/batch；false：每個樣本送一次 /record_emotion
+EMOTION_BATCH_MODE = os.environ.get('EMOTION_BATCH_MODE', 'true').lower() == 'true'
+
+def parse_client_timestamp(value, fallback):
+    """前端送來的毫秒 epoch 或 ISO 字串 → 台灣時間 naive datetime；無法解析或超前現在則用 fallback"""
+    try:
+        if isinstance(value, (int, float)):
+            parsed = datetime.fromtimestamp(value / 1000.0, timezone.utc) + timedelta(hours=8)
+            parsed = parsed.replace(tzinfo=None)
+        elif isinstance(value, str) and value:
+            parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+            if parsed.tzinfo is not None:
+                parsed = (parsed.astimezone(timezone.utc) + timedelta(hours=8)).replace(tzinfo=None)
+        else:
+            return fallback
+    except (ValueError, OverflowError, OSError):
+        return fallback
+    return parsed if parsed <= fallback else fallback
+
+@app.post('/api/emotion/batch')
+def api_emotion_batch():
+    """批次記錄情緒數據：{session_id, samples: [{timestamp, emotion, attention_level, confidence}, ...]}"""
+    if 'user_id' not in session or 'child_id' not in session:
+        return jsonify({'ok': False, 'error': 'unauthorized'}), 401
+
+    data = request.get_json(force=True, silent=True) or {}
+    session_id = data.get('session_id') or session.get('current_session_id')
+    samples = data.get('samples')
+    if not isinstance(samples, list):
+        return jsonify({'ok': False, 'error': 'invalid samples'}), 400
+    if len(samples) > EMOTION_BATCH_MAX_SAMPLES:
+        return jsonify({'ok': False, 'error': 'too many samples'}), 413
+
+    s = StudySession.query.get(session_id) if session_id else None
+    if not s or s.child_id != session['child_id']:
+        return jsonify({'ok': False, 'error': 'invalid session'}), 400
+    if s.end_time is not None:
+        return jsonify({'ok': False, 'error': 'session ended'}), 409
+
+    now = get_taiwan_now()
+    rows = []
+    for sample in samples:
+        values = normalize_emotion_sample(sample)
+        if values is None:
+            continue  # 格式錯誤的樣本略過，不影響同批其他樣本
+        rows.append(dict(values, session_id=s.id,
+                         timestamp=parse_client_timestamp(sample.get('timestamp'), now),
+                         seq=parse_seq(sample.get('seq'))))
+    rejected = len(samples) - len(rows)
+    if samples and not rows:
+        return jsonify({'ok': False, 'error': 'invalid samples', 'rejected': rejected}), 400
+
+    written = 0
+    if rows:
+        written = write_emotion_samples(rows)
+        db.session.commit()
+    # 重送的樣本算成功（冪等），只是不重複寫入
+    return jsonify({'ok': True, 'accepted': written, 'duplicates': len(rows) - written, 'rejected': rejected})
+
+@app.get('/api/session/<int:session_id>/emotions')
+def api_session_emotions(session_id):
+    """匯出一個學習場次的情緒時間序列（rows / chunks 兩種儲存方式皆可）"""
+    if 'user_id' not in session or 'child_id' not in session:
+        return jsonify({'ok': False, 'error': 'unauthorized'}), 401
+    if not NUMPY_AVAILABLE:
+        return jsonify({'ok': False, 'error': 'numpy unavailable'}), 503
+
+    s = StudySession.query.filter_by(id=session_id, child_id=session['child_id']).first()
+    if not s:
+        return jsonify({'ok': False, 'error': 'invalid session'}), 404
+
+    import numpy as np
+    series = read_session_emotion_series(session_id)
+    labels = [EMOTION_LABEL_CODES[c] if c < len(EMOTION_LABEL_CODES) else None for c in series['emotion'].tolist()]
+    return jsonify({
+        'ok': True,
+        'session_id': session_id,
+        'timestamps': series['timestamp'].astype(str).tolist(),
+        'emotions': labels,
+        'attention_levels': series['attention'].tolist(),
+        'confidences': np.round(series['confidence'].astype(np.float64), 3).tolist()
+    })
+
+SESSION_HISTORY_PAGE_SIZE = 20
+SESSION_HISTORY_MAX_PAGE_SIZE = 100
+
+def encode_history_cursor(row):
+    raw = f'{row.start_time.isoformat()}|{row.id}'
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+def decode_history_cursor(cursor):
+    """回傳 (start_time, id)；格式錯誤時拋出 ValueError"""
+    try:
+        start_raw, id_raw = base64.urlsafe_b64decode(cursor.encode()).decode().split('|')
+        return datetime.fromisoformat(start_raw), int(id_raw)
+    except ValueError:
+        raise ValueError('invalid cursor')
+
+@app.get('/api/session/history')
+def api_session_history():
+    """
+    已完成場次的歷史記錄（新到舊），以 (start_time, id) keyset 游標分頁。
+    參數：limit、cursor（上一頁的 next_cursor）、subject、date_from / date_to（YYYY-MM-DD，含當天）、
+         min_attention / max_attention（百分比 0~100）
+    """
+    if 'user_id' not in session or 'child_id' not in session:
+        return jsonify({'ok': False, 'error': 'unauthorized'}), 401
+
+    args = request.args
+    limit = max(1, min(args.get('limit', SESSION_HISTORY_PAGE_SIZE, type=int), SESSION_HISTORY_MAX_PAGE_SIZE))
+    criteria = [eligible_session_filter()]
+    try:
+        if args.get('cursor'):
+            cursor_start, cursor_id = decode_history_cursor(args['cursor'])
+            criteria.append(db.or_(StudySession.start_time < cursor_start,
+                                   db.and_(StudySession.start_time == cursor_start, StudySession.id < cursor_id)))
+        if args.get('subject'):
+            if args['subject'] not in SUBJECTS:
+                raise ValueError('invalid subject')
+            criteria.append(StudySession.subject == args['subject'])
+        if args.get('date_from'):
+            criteria.append(StudySession.start_time >= datetime.strptime(args['date_from'], '%Y-%m-%d'))
+        if args.get('date_to'):
+            day_end = datetime.strptime(args['date_to'], '%Y-%m-%d') + timedelta(days=1)
+            criteria.append(StudySession.start_time < day_end)
+        if args.get('min_attention'):
+            criteria.append(StudySession.avg_attention >= float(args['min_attention']) * 3 / 100)
+        if args.get('max_attention'):
+            criteria.append(StudySession.avg_attention <= float(args['max_attention']) * 3 / 100)
+    except ValueError as e:
+        return jsonify({'ok': False, 'error': str(e)}), 400
+
+    rows = query_session_rows(session['child_id'], *criteria,
+                              order_by=(StudySession.start_time.desc(), StudySession.id.desc()),
+                              limit=limit + 1)
+    next_cursor = encode_history_cursor(rows[limit - 1]) if len(rows) > limit else None
+
+    return jsonify({
+        'ok': True,
+        'sessions': [{
+            'id': r.id,
+            'subject': r.subject,
+            'subject_name': SUBJECTS.get(r.subject, r.subject),
+            'start_time': r.start_time.strftime('%Y-%m-%d %H:%M'),
+            'duration_minutes': r.duration_minutes,
+            'avg_attention': r.avg_attention,
+            'completed': r.end_time is not None
+        } for r in rows[:limit]],
+        'next_cursor': next_cursor
+    })
+
 @app.route('/end_session', methods=['POST'])
 def end_session():
     """⚠️ 已廢棄：請使用 /api/session/end"""
@@ -941,9 +2661,11 @@ def end_session():
         return jsonify({'success': False, 'message': '沒有活躍的學習階段'})
 
     session_id = session['current_session_id']
+    emotion_buffer.flush()
     current_study_session = StudySession.query.get(session_id)
 
     if current_study_session:
+        remove_session_from_summary(current_study_session)
         local_now = get_taiwan_now()
         current_study_session.end_time = local_now
 
@@ -952,14 +2674,11 @@ def end_session():
             actual_duration = (local_now - start_time).total_seconds() / 60
             current_study_session.duration_minutes = int(actual_duration)
 
-        emotion_records = EmotionData.query.filter_by(session_id=session_id).all()
-        if emotion_records:
-            avg_attention = sum(r.attention_level for r in emotion_records) / len(emotion_records)
-            avg_emotion = sum(r.confidence for r in emotion_records) / len(emotion_records)
-            current_study_session.avg_attention = avg_attention
-            current_study_session.avg_emotion_score = avg_emotion
+        apply_session_emotion_averages(current_study_session)
+        add_session_to_summary(current_study_session)
 
         db.session.commit()
+        prerender_report(current_study_session.child)
         session.pop('current_session_id', None)
         session.pop('session_start_time', None)
         return jsonify({'success': True, 'session_id': session_id})
@@ -998,15 +2717,8 @@ def end_session():
     return jsonify({'success': False, 'message': '找不到學習階段'})'''
 
 def get_best_subject_for_date(child_id, date):
-    sessions = StudySession.query.filter(
-        StudySession.child_id == child_id,
-        db.func.date(StudySession.start_time) == date,
-        StudySession.avg_attention.isnot(None)
-    ).all()
-    if not sessions:
-        return None
-    best_session = max(sessions, key=lambda x: x.avg_attention)
-    return best_session.subject
+    best = best_daily_rollup(load_daily_rollups(child_id, date, date + timedelta(days=1)))
+    return best.subject if best else None
 
 @app.route('/delete_session/<int:session_id>', methods=['POST'])
 def delete_session(session_id):
@@ -1020,6 +2732,7 @@ def delete_session(session_id):
             child.ai_suggestion = None
             child.pdf_report_path = None
             child.pdf_generated_at = None
+        remove_session_from_summary(study_session)
         db.session.delete(study_session)
         db.session.commit()
         return jsonify({'success': True})
@@ -1033,49 +2746,61 @@ def get_calendar_data():
     year = request.args.get('year', datetime.now().year, type=int)
     month = request.args.get('month', datetime.now().month, type=int)
 
-    start_date = datetime(year, month, 1)
-    end_date = datetime(year + (month // 12), (month % 12) + 1, 1)
+    # span=year 時一次回傳整年（最多 366×6 筆彙總）
+    if request.args.get('span') == 'year':
+        start_date = datetime(year, 1, 1).date()
+        end_date = datetime(year + 1, 1, 1).date()
+    else:
+        start_date = datetime(year, month, 1).date()
+        end_date = datetime(year + (month // 12), (month % 12) + 1, 1).date()
 
-    sessions = StudySession.query.filter(
-        StudySession.child_id == session['child_id'],
-        StudySession.start_time >= start_date,
-        StudySession.start_time < end_date
-    ).all()
+    daily_rows = {}
+    for r in load_daily_rollups(session['child_id'], start_date, end_date):
+        daily_rows.setdefault(r.study_date.strftime('%Y-%m-%d'), []).append(r)
 
     calendar_data = {}
-    daily_subjects = {}
-    for study_session in sessions:
-        date_key = study_session.start_time.strftime('%Y-%m-%d')
-        if date_key not in daily_subjects:
-            daily_subjects[date_key] = []
-        daily_subjects[date_key].append({
-            'subject': study_session.subject,
-            'attention': study_session.avg_attention or 0,
-            'session_data': {
-                'id': study_session.id,
-                'subject': SUBJECTS.get(study_session.subject, study_session.subject),
-                'duration_minutes': study_session.duration_minutes,
-                'avg_attention': study_session.avg_attention,
-                'start_time': study_session.start_time.strftime('%H:%M')
-            }
-        })
+    for date_key, rows in daily_rows.items():
+        best_subject = best_daily_rollup(rows).subject
+        calendar_data[date_key] = {
+            'best_subject': best_subject,
+            'color': CALENDAR_SUBJECT_COLORS.get(best_subject, '#95A5A6'),
+            'session_count': sum(r.session_count for r in rows),
+            'total_minutes': sum(r.total_minutes for r in rows),
+            'subjects': [{
+                'subject': SUBJECTS.get(r.subject, r.subject),
+                'session_count': r.session_count,
+                'total_minutes': r.total_minutes,
+                'avg_attention': r.avg_attention
+            } for r in rows]
+        }
 
-    subject_colors = {
-        'math': '#3498DB', 'science': '#2ECC71', 'language': '#E74C3C',
-        'social': '#F39C12', 'art': '#9B59B6', 'cs': '#1ABC9C'
-    }
+    return jsonify({'success': True, 'data': calendar_data})
 
-    for date_key, subjects in daily_subjects.items():
-        if subjects:
-            best_subject_data = max(subjects, key=lambda x: x['attention'])
-            best_subject = best_subject_data['subject']
-            calendar_data[date_key] = {
-                'best_subject': best_subject,
-                'color': subject_colors.get(best_subject, '#95A5A6'),
-                'sessions': [s['session_data'] for s in subjects]
-            }
+@app.route('/get_calendar_day')
+def get_calendar_day():
+    """行事曆點選某天時才載入當天的場次明細"""
+    if 'user_id' not in session or 'child_id' not in session:
+        return jsonify({'success': False, 'message': '請先登入並選擇小孩'})
 
-    return jsonify({'success': True, 'data': calendar_data})
+    try:
+        day = datetime.strptime(request.args.get('date', ''), '%Y-%m-%d')
+    except ValueError:
+        return jsonify({'success': False, 'message': '日期格式錯誤'}), 400
+
+    day_start, day_end = _day_range(day)
+    sessions = query_session_rows(session['child_id'],
+                                  StudySession.start_time >= day_start,
+                                  StudySession.start_time < day_end,
+                                  eligible_session_filter(),
+                                  order_by=StudySession.start_time)
+
+    return jsonify({'success': True, 'sessions': [{
+        'id': s.id,
+        'subject': SUBJECTS.get(s.subject, s.subject),
+        'duration_minutes': s.duration_minutes,
+        'avg_attention': s.avg_attention,
+        'start_time': s.start_time.strftime('%H:%M')
+    } for s in sessions]})
 
 @app.route('/get_child_profile/<int:child_id>')
 def get_child_profile(child_id):
@@ -1107,19 +2832,17 @@ def data_analysis():
     if not child:
         return redirect(url_for('child_selection'))
 
-    # 只取已完成的學習場次（有 end_time）
-    study_sessions = (StudySession.query
-                     .filter_by(child_id=child.id)
-                     .filter(StudySession.end_time.isnot(None))
-                     .filter(StudySession.duration_minutes >= MIN_SESSION_MINUTES)  # ★ 新增
-                     .order_by(StudySession.start_time.desc())
-                     .all())
-    
-    chart_data = prepare_chart_data(study_sessions)
-    overall_avg_attention_percent = compute_overall_avg_attention_percent(study_sessions)
+    # 統計卡片取自 SessionAnalytics；歷史記錄由前端透過 /api/session/history 分頁載入
+    analytics = get_session_analytics(child)
+    chart_data = prepare_chart_data(analytics)
+    overall_avg_attention_percent = analytics.overall_attention_percent
+    most_frequent = analytics.most_frequent_subject
     return render_template('data_analysis.html',
                            child=child,
-                           study_sessions=study_sessions,
+                           subjects=SUBJECTS,
+                           total_sessions=analytics.total_sessions,
+                           total_hours=analytics.total_minutes / 60,
+                           most_studied_subject=SUBJECTS.get(most_frequent, most_frequent) if most_frequent else None,
                            chart_data=chart_data,
                            overall_avg_attention=overall_avg_attention_percent)
 
@@ -1166,7 +2889,7 @@ def data_analysis():
 
 @app.route('/smart_suggestions')
 def smart_suggestions():
-    """智慧建議頁面：不自動產生；若偵測到舊的離線文案，載入時即清掉並顯示統一失敗訊息。"""
+    """智慧建議頁面：尚無建議時由前端自動產生（auto_generate，SSE 串流或背景工作）；若偵測到舊的離線文案，載入時即清掉並顯示統一失敗訊息。"""
     if 'user_id' not in session or 'child_id' not in session:
         return redirect(url_for('child_selection'))
 
@@ -1174,15 +2897,9 @@ def smart_suggestions():
     if not child:
         return redirect(url_for('child_selection'))
 
-    # 只取已完成的學習場次（有 end_time）
-    study_sessions = (StudySession.query
-                     .filter_by(child_id=child.id)
-                     .filter(StudySession.end_time.isnot(None))
-                     .filter(StudySession.duration_minutes >= MIN_SESSION_MINUTES)  # ★ 新增
-                     .order_by(StudySession.start_time.asc())
-                     .all())
-    
-    suggestions = generate_comprehensive_suggestions(child, study_sessions)
+    # 只計已完成的學習場次（見 SessionAnalytics）
+    analytics = get_session_analytics(child)
+    suggestions = generate_comprehensive_suggestions(child, analytics)
 
     ai_suggestion_db = child.ai_suggestion or ""
     # 清除舊的離線文案
@@ -1197,7 +2914,7 @@ def smart_suggestions():
     else:
         ai_suggestion_display = ai_suggestion_db or None
 
-    performance_data = prepare_performance_data(study_sessions)
+    performance_data = prepare_performance_data(analytics)
 
     return render_template(
         'smart_suggestions.html',
@@ -1206,6 +2923,7 @@ def smart_suggestions():
         ai_suggestion=ai_suggestion_display,
         ai_enabled=True,
         ai_can_generate=has_openai_client(),
+        ai_stream_enabled=AI_STREAM_ENABLED,
         auto_generate=(has_openai_client() and not ai_suggestion_db),
         performance_data=performance_data
     )
@@ -1300,8 +3018,8 @@ def smart_suggestions():
 @app.route('/generate_ai_suggestion', methods=['POST'])
 def generate_ai_suggestion_api():
     """
-    生成 AI 建議（僅線上；不可用時一律回 FAILURE_TEXT）。
-    前端無論如何都能拿到 ai_suggestion，避免「功能未啟用」的冷冰冰錯誤。
+    排入 AI 建議背景工作並立即回傳 job_id；前端以 /api/ai_suggestion/jobs/<job_id> 輪詢結果。
+    OpenAI 不可用或呼叫失敗時工作標為 failed 並回 FAILURE_TEXT（小孩原本的建議不變），避免「功能未啟用」的冷冰冰錯誤。
     """
     if 'user_id' not in session or 'child_id' not in session:
         return jsonify({'success': False, 'message': '請先登入並選擇小孩'})
@@ -1310,28 +3028,355 @@ def generate_ai_suggestion_api():
     if not child:
         return jsonify({'success': False, 'message': '找不到小孩檔案'})
 
-    study_sessions = StudySession.query.filter_by(child_id=child.id).order_by(StudySession.start_time.asc()).all()
-
     try:
-        if has_openai_client():
-            text = generate_ai_suggestions(child, study_sessions).strip()
-        else:
-            text = FAILURE_TEXT
+        job = ai_job_queue.enqueue(child.id)
+    except Exception as e:
+        db.session.rollback()
+        print(f"建立 AI 建議工作時發生錯誤: {e}")
+        # 仍回 200 + 統一友善訊息，讓前端把 spinner 停掉
+        return jsonify({'success': True, 'status': 'failed', 'ai_suggestion': FAILURE_TEXT})
 
-        # 寫回 DB（讓重新整理仍能看到最新結果）
-        child.ai_suggestion = text
-        child.pdf_generated_at = None
+    return jsonify({'success': True, 'job_id': job.id, 'status': job.status}), 202
+
+# 串流期間會占住一個 worker 直到 OpenAI 回應完畢；只有 gevent / gthread 等非同步或多執行緒 worker 才建議開啟，
+# 預設（sync worker）走背景工作佇列 + 輪詢
+AI_STREAM_ENABLED = os.environ.get('AI_STREAM_ENABLED', 'false').lower() == 'true'
+
+def sse_event(data, event=None):
+    """組出一則 Server-Sent Event（data 為 JSON）"""
+    prefix = f'event: {event}\n' if event else ''
+    return f'{prefix}data: {json.dumps(data, ensure_ascii=False)}\n\n'
+
+@app.post('/api/ai_suggestion/stream')
+def api_ai_suggestion_stream():
+    """
+    以 SSE 格式逐段回傳 AI 建議：每段文字為一則 {"delta": ...}，結束時送出 event: done {"ai_suggestion": 全文}。
+    完整文字寫回 Child.ai_suggestion 並存入 AI 建議快取；失敗時 done 事件帶 FAILURE_TEXT（不寫回 DB）。
+    會修改資料，所以只接受 POST + application/json（瀏覽器預先載入不會觸發，跨站表單也送不出 JSON）。
+    """
+    if 'user_id' not in session or 'child_id' not in session:
+        return jsonify({'ok': False, 'error': 'unauthorized'}), 401
+    if not AI_STREAM_ENABLED:
+        return jsonify({'ok': False, 'error': 'streaming disabled'}), 404
+    if not request.is_json:
+        return jsonify({'ok': False, 'error': 'json required'}), 415
+
+    child = Child.query.filter_by(id=session['child_id'], user_id=session['user_id']).first()
+    if not child:
+        return jsonify({'ok': False, 'error': 'child not found'}), 404
+
+    child_id = child.id
+    version = child.analytics_version
+    messages = build_ai_suggestion_messages(child) if has_openai_client() else None
+
+    @stream_with_context
+    def generate():
+        yield ': connected\n\n'  # 立刻送出第一個 byte，讓瀏覽器與 proxy 開始接收
+        text = ''
+        if messages is not None:
+            cache_key = ai_response_cache.make_key(AI_SUGGESTION_MODEL, messages, **AI_SUGGESTION_PARAMS)
+            cached = ai_response_cache.get(cache_key) if AI_CACHE_ENABLED else None
+            if cached:
+                text = cached
+                yield sse_event({'delta': cached})
+            else:
+                parts = []
+                try:
+                    with closing(openai_chat_stream(messages)) as deltas:
+                        for delta in deltas:
+                            parts.append(delta)
+                            yield sse_event({'delta': delta})
+                    text = ''.join(parts).strip()
+                except Exception as e:
+                    print(f"AI建議串流過程發生錯誤: {e}")
+                    text = ''
+                if text and AI_CACHE_ENABLED:
+                    ai_response_cache.put(cache_key, AI_SUGGESTION_MODEL, text)
+
+        # 串流期間小孩檔案可能已被刪除：重新讀取，不存在就不寫回
+        child = db.session.get(Child, child_id, populate_existing=True) if text else None
+        if child is not None:
+            store_ai_suggestion(child, text, version)
         db.session.commit()
+        yield sse_event({'ai_suggestion': text or FAILURE_TEXT}, event='done')
+
+    return Response(generate(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
 
-        return jsonify({'success': True, 'ai_suggestion': text})
+@app.get('/api/ai_suggestion/jobs/<job_id>')
+def api_ai_suggestion_job(job_id):
+    """查詢 AI 建議工作狀態；done / failed 時附上 ai_suggestion"""
+    if 'user_id' not in session:
+        return jsonify({'ok': False, 'error': 'unauthorized'}), 401
+
+    job = (AISuggestionJob.query
+           .join(Child, Child.id == AISuggestionJob.child_id)
+           .filter(AISuggestionJob.id == job_id, Child.user_id == session['user_id'])
+           .first())
+    if not job:
+        return jsonify({'ok': False, 'error': 'job not found'}), 404
+
+    ai_job_queue.ensure_started()  # 重啟後第一次輪詢也能接手未完成的工作
+    data = {'ok': True, 'job_id': job.id, 'status': job.status}
+    if job.status in ('done', 'failed'):
+        data['ai_suggestion'] = job.result or FAILURE_TEXT
+    return jsonify(data)
+
+# ----------------- PDF 報告背景產生 -----------------
+REPORTS_DIR = os.environ.get('REPORTS_DIR') or os.path.join(app.root_path, 'reports')  # 絕對路徑，與啟動時的工作目錄無關
+REPORTS_MAX_BYTES = int(os.environ.get('REPORTS_MAX_BYTES', 200 * 1024 * 1024))       # reports/ 內 PDF 總大小上限
+REPORT_LAYOUT_VERSION = 1  # 修改 render_report_pdf 的版面時遞增，讓舊報告的雜湊失效
+# 每個 gunicorn worker 各有一個行程池（第一次產生報告時才啟動）：排版子行程總數 = worker 數 × REPORT_RENDER_WORKERS，
+# 另外每個 worker 多一個 forkserver 行程
+REPORT_RENDER_WORKERS = int(os.environ.get('REPORT_RENDER_WORKERS', 2))
+# process：ReportLab 排版在子行程（worker_pool_context）執行，不占用 web worker 的 CPU / GIL；thread：在 worker 內執行
+REPORT_RENDER_MODE = os.environ.get('REPORT_RENDER_MODE', 'process')
+REPORT_RENDER_TIMEOUT = float(os.environ.get('REPORT_RENDER_TIMEOUT', 120))
+REPORT_JOB_RETENTION_SECONDS = 300  # 完成的工作（含 PDF 內容）在記憶體保留多久
+REPORT_PRERENDER_ON_SESSION_END = os.environ.get('REPORT_PRERENDER_ON_SESSION_END', 'true').lower() == 'true'
+REPORT_ACTIVE_STATUSES = ('queued', 'rendering')
+
+def report_content_key(context):
+    """報告輸入資料的 sha256：相同輸入共用同一份 PDF，也作為下載時的 ETag"""
+    payload = json.dumps({'layout': REPORT_LAYOUT_VERSION, 'font': pdf_font_identifier(), 'context': context},
+                         ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+class ReportStore:
+    """以內容雜湊命名的 PDF（reports/report_<sha256>.pdf）。檔案 mtime 即最近使用時間，
+    總大小超過 max_bytes 時由最久未使用的開始刪除（舊版以時間戳命名的報告一併納入）。"""
+
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self.stats = {'hits': 0, 'misses': 0, 'stores': 0, 'evicted': 0}
+
+    def _count(self, name, n=1):
+        with self._lock:
+            self.stats[name] += n
+
+    def path_for(self, key):
+        return os.path.join(self.directory, f'report_{key}.pdf')
+
+    def lookup(self, key):
+        """報告存在時更新最近使用時間並回傳路徑，否則回傳 None"""
+        path = self.path_for(key)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            self._count('misses')
+            return None
+        self._count('hits')
+        return path
+
+    def read(self, key):
+        """報告存在時更新最近使用時間並讀入記憶體；之後即使被 enforce_limit 刪除也能照常回傳"""
+        path = self.path_for(key)
+        try:
+            os.utime(path)
+            with open(path, 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            self._count('misses')
+            return None
+        self._count('hits')
+        return data
+
+    def put(self, key, data):
+        os.makedirs(self.directory, exist_ok=True)
+        path = self.path_for(key)
+        tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'  # 先寫暫存檔再 rename，讀取端不會看到寫到一半的檔案
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        self._count('stores')
+        self.enforce_limit(keep=path)
+        return path
+
+    def enforce_limit(self, keep=None):
+        entries = []
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                if not (entry.name.startswith('report_') and entry.name.endswith('.pdf')):
+                    continue
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+        total = sum(size for _, size, _ in entries)
+        evicted = 0
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            if path == keep:
+                continue
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+            evicted += 1
+        if evicted:
+            self._count('evicted', evicted)
+        return evicted
+
+    def snapshot(self):
+        with self._lock:
+            data = dict(self.stats)
+        data['max_bytes'] = self.max_bytes
+        return data
+
+report_store = ReportStore(REPORTS_DIR, REPORTS_MAX_BYTES)
+
+class ReportRenderJob:
+    __slots__ = ('child_id', 'context', 'key', 'data', 'path', 'status', 'error', 'finished_at', 'done')
+
+    def __init__(self, child_id, context, key):
+        self.child_id = child_id
+        self.context = context
+        self.key = key
+        self.data = None
+        self.path = None
+        self.status = 'queued'
+        self.error = None
+        self.finished_at = None
+        self.done = threading.Event()
+
+    def wait(self, timeout):
+        return self.done.wait(timeout)
+
+class ReportRenderQueue:
+    """把 PDF 報告的排版移出 request：request 內只收集報告資料（需要資料庫），ReportLab 交給行程池。
+
+    - 每個小孩只保留最新一個工作；內容雜湊相同的工作仍在進行中時直接沿用
+    - PDF 在記憶體中產生，存入 report_store 後仍保留 REPORT_JOB_RETENTION_SECONDS，等待中的下載直接由記憶體回傳
+    - 工作狀態只存在本行程記憶體；其他 worker 以 report_store 中是否已有相同雜湊的報告判斷
+    """
+
+    def __init__(self, workers, mode):
+        self.workers = workers
+        self.mode = mode
+        self._lock = threading.Lock()
+        self._threads = None
+        self._processes = None
+        self._pid = None
+        self._jobs = {}
+        self.stats = {'submitted': 0, 'deduplicated': 0, 'completed': 0, 'failed': 0}
+
+    def ensure_started(self):
+        with self._lock:
+            if self._threads is not None and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._jobs = {}
+            # 執行緒只負責等待結果與寫回；排版在行程池（mode=thread 時直接在執行緒）
+            self._threads = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='report-render')
+            self._processes = None
+            if self.mode == 'process':
+                self._processes = ProcessPoolExecutor(max_workers=self.workers, mp_context=worker_pool_context())
+
+    def _prune(self):
+        cutoff = time.monotonic() - REPORT_JOB_RETENTION_SECONDS
+        for child_id in [cid for cid, job in self._jobs.items() if job.finished_at and job.finished_at < cutoff]:
+            del self._jobs[child_id]
+
+    def enqueue(self, child, context, key, retry_failed=True):
+        """排入（或沿用雜湊相同的）報告產生工作，回傳 ReportRenderJob"""
+        self.ensure_started()
+        with self._lock:
+            self._prune()
+            job = self._jobs.get(child.id)
+            if job and job.key == key and (job.status in REPORT_ACTIVE_STATUSES or job.status == 'done' or
+                                           (job.status == 'failed' and not retry_failed)):
+                self.stats['deduplicated'] += 1
+                return job
+            job = ReportRenderJob(child.id, context, key)
+            self._jobs[child.id] = job
+            self.stats['submitted'] += 1
+        self._threads.submit(self._run, job)
+        return job
+
+    def _run(self, job):
+        job.status = 'rendering'
+        try:
+            if self._processes is not None:
+                job.data = self._processes.submit(render_report_pdf, job.context).result(timeout=REPORT_RENDER_TIMEOUT)
+            else:
+                job.data = render_report_pdf(job.context)
+            job.path = report_store.put(job.key, job.data)
+            job.status = 'done'
+            outcome = 'completed'
+        except Exception as e:
+            print(f'✗ 產生小孩 {job.child_id} 的 PDF 報告失敗: {e}')
+            job.status = 'failed'
+            job.error = str(e)[:500]
+            outcome = 'failed'
+        finally:
+            job.finished_at = time.monotonic()
+            job.done.set()
+        with self._lock:
+            self.stats[outcome] += 1
+
+        if outcome == 'completed':
+            try:
+                with app.app_context():
+                    (Child.query.filter_by(id=job.child_id)
+                     .update({Child.pdf_report_path: job.path,
+                              Child.pdf_generated_at: datetime.utcnow()},
+                             synchronize_session=False))
+                    db.session.commit()
+            except SQLAlchemyError as e:
+                print(f'⚠ 無法記錄小孩 {job.child_id} 的報告路徑: {e}')
+
+    def snapshot(self):
+        with self._lock:
+            data = dict(self.stats)
+            active = sum(1 for job in self._jobs.values() if job.status in REPORT_ACTIVE_STATUSES)
+        data['active'] = active
+        data['workers'] = self.workers
+        data['mode'] = self.mode
+        data['started'] = self._threads is not None and self._pid == os.getpid()
+        return data
+
+report_render_queue = ReportRenderQueue(REPORT_RENDER_WORKERS, REPORT_RENDER_MODE)
+
+def current_report_key(child):
+    """回傳 (context, key)：報告內容取決於學習統計、AI 建議與基本資料，任一改變雜湊就不同"""
+    context = build_report_context(child, child.ai_suggestion)
+    return context, report_content_key(context)
+
+def prerender_report(child):
+    """場次結束後預先排入報告產生；失敗不影響呼叫端"""
+    if not REPORT_PRERENDER_ON_SESSION_END:
+        return
+    try:
+        context, key = current_report_key(child)
+        if report_store.lookup(key) is None:
+            report_render_queue.enqueue(child, context, key, retry_failed=False)
     except Exception as e:
-        print(f"生成 AI 建議時發生錯誤: {e}")
-        # 仍回 200 + 統一友善訊息，讓前端把 spinner 停掉
-        return jsonify({'success': True, 'ai_suggestion': FAILURE_TEXT})
+        print(f'⚠ 無法排入報告產生工作: {e}')
+
+def report_download_name(child):
+    return f'學習報告_{child.nickname}_{datetime.now().strftime("%Y%m%d")}.pdf'
+
+def send_report(source, key, child):
+    """回傳記憶體中的 PDF，ETag 為內容雜湊；瀏覽器每次以 If-None-Match 確認"""
+    response = send_file(source, mimetype='application/pdf', as_attachment=True,
+                         download_name=report_download_name(child), etag=key, conditional=True)
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
 
 # ----------------- 報告/刪除/更新等其餘路由 -----------------
 @app.route('/generate_report/<int:child_id>')
 def generate_report(child_id):
+    """
+    報告以輸入資料的雜湊命名：If-None-Match 相符回 304，已有相同雜湊的報告讀入記憶體後回傳；
+    否則（含剛被容量上限淘汰）排入背景產生並立即回 202，Location 指向 /api/report/<id>/status 供輪詢，不占用 worker 等待排版。
+    """
     if 'user_id' not in session:
         return redirect(url_for('login'))
 
@@ -1339,27 +3384,161 @@ def generate_report(child_id):
     if not child:
         return redirect(url_for('dashboard'))
 
-    study_sessions = StudySession.query.filter_by(child_id=child.id).all()
-
-    should_regenerate = False
-    if not child.pdf_report_path or not os.path.exists(child.pdf_report_path) or not child.pdf_generated_at:
-        should_regenerate = True
-    elif child.pdf_generated_at and study_sessions:
-        latest = max(study_sessions, key=lambda x: x.start_time)
-        if latest.start_time > child.pdf_generated_at:
-            should_regenerate = True
-
-    if should_regenerate:
-        ai_suggestion = child.ai_suggestion
-        pdf_path = create_comprehensive_report(child, study_sessions, ai_suggestion)
-        child.pdf_report_path = pdf_path
-        child.pdf_generated_at = datetime.utcnow()
-        db.session.commit()
-        return send_file(pdf_path, as_attachment=True,
-                         download_name=f'學習報告_{child.nickname}_{datetime.now().strftime("%Y%m%d")}.pdf')
-    else:
-        return send_file(child.pdf_report_path, as_attachment=True,
-                         download_name=f'學習報告_{child.nickname}_{datetime.now().strftime("%Y%m%d")}.pdf')
+    context, key = current_report_key(child)
+    if request.if_none_match.contains(key):
+        response = Response(status=304)
+        response.set_etag(key)
+        return response
+
+    data = report_store.read(key)  # 讀入記憶體：回傳途中檔案被其他 worker 淘汰也不會 FileNotFoundError
+    if data is not None:
+        return send_report(BytesIO(data), key, child)
+
+    job = report_render_queue.enqueue(child, context, key)
+    if job.status == 'done':  # 剛完成但檔案已被淘汰，由記憶體回傳
+        return send_report(BytesIO(job.data), key, child)
+    return Response('報告產生中，請稍後再試', status=202, mimetype='text/plain',
+                    headers={'Location': url_for('api_report_status', child_id=child.id), 'Retry-After': '5'})
+
+@app.get('/api/report/<int:child_id>/status')
+def api_report_status(child_id):
+    """報告狀態：ready（可立即下載）/ queued / rendering / failed；報告過時且沒有進行中的工作時會排入產生"""
+    if 'user_id' not in session:
+        return jsonify({'ok': False, 'error': 'unauthorized'}), 401
+
+    child = Child.query.filter_by(id=child_id, user_id=session['user_id']).first()
+    if not child:
+        return jsonify({'ok': False, 'error': 'child not found'}), 404
+
+    context, key = current_report_key(child)
+    data = {'ok': True, 'download_url': url_for('generate_report', child_id=child.id), 'etag': key}
+    if report_store.lookup(key):
+        data['status'] = 'ready'
+        return jsonify(data)
+
+    job = report_render_queue.enqueue(child, context, key, retry_failed=False)
+    data['status'] = 'ready' if job.status == 'done' else job.status
+    if job.status == 'failed':
+        data['error'] = job.error
+    return jsonify(data)
+
+# ----------------- 帳號內所有報告的 ZIP 匯出 -----------------
+REPORT_EXPORT_TIMEOUT = float(os.environ.get('REPORT_EXPORT_TIMEOUT', 300))  # 整份匯出最多等待背景產生幾秒
+REPORT_EXPORT_CHUNK_BYTES = 64 * 1024
+
+class ZipChunkStream(RawIOBase):
+    """zipfile 的寫入目的地：寫入的 bytes 只暫存到下一次 drain，讓 ZIP 邊產生邊送出。
+    不支援 seek，zipfile 會自動改用 data descriptor 記錄每個檔案的大小。"""
+
+    def __init__(self):
+        super().__init__()
+        self._chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        self._chunks.append(bytes(b))
+        return len(b)
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks.clear()
+        return data
+
+class ReportExportEntry:
+    __slots__ = ('name', 'path', 'job')
+
+    def __init__(self, name, path, job):
+        self.name = name
+        self.path = path
+        self.job = job
+
+    @property
+    def ready(self):
+        return self.job is None or self.job.done.is_set()
+
+def collect_report_exports(children):
+    """為每個小孩找出已存在的報告，或排入背景產生（共用 report_render_queue 的有限行程池）；需在 app context 內呼叫"""
+    entries, names = [], set()
+    for child in children:
+        name = report_download_name(child).replace('/', '_').replace('\\', '_')
+        if name in names:
+            name = name.replace('.pdf', f'_{child.id}.pdf')
+        names.add(name)
+
+        context, key = current_report_key(child)
+        path = report_store.lookup(key)
+        job = None if path else report_render_queue.enqueue(child, context, key)
+        entries.append(ReportExportEntry(name, path, job))
+    return entries
+
+def _write_report_to_zip(zf, stream, entry):
+    """把一份報告分段寫入 ZIP，每段寫完就 yield 已壓縮的 bytes；回傳 None 或失敗原因"""
+    path = entry.path or (entry.job.path if entry.job.status == 'done' else None)
+    try:
+        source = open(path, 'rb') if path else None
+    except FileNotFoundError:
+        source = None  # 已被容量上限淘汰，改用記憶體中的內容
+    if source is None and (entry.job is None or entry.job.data is None):
+        return entry.job.error if entry.job and entry.job.error else '報告檔案不存在'
+
+    with zf.open(entry.name, 'w') as dest:
+        if source is None:
+            dest.write(entry.job.data)
+            yield stream.drain()
+        else:
+            with source:
+                for chunk in iter(lambda: source.read(REPORT_EXPORT_CHUNK_BYTES), b''):
+                    dest.write(chunk)
+                    yield stream.drain()
+    yield stream.drain()
+    return None
+
+def stream_reports_zip(entries, timeout=REPORT_EXPORT_TIMEOUT):
+    """依完成順序把報告寫入 ZIP 並逐段 yield；同一時間只讀入一份報告的一個區塊。
+    產生失敗或逾時的報告列在 ZIP 內的「未完成的報告.txt」。"""
+    stream = ZipChunkStream()
+    deadline = time.monotonic() + timeout
+    failures = []
+    with zipfile.ZipFile(stream, 'w', compression=zipfile.ZIP_DEFLATED) as zf:
+        pending = list(entries)
+        while pending:
+            ready = [entry for entry in pending if entry.ready]
+            if not ready:
+                if time.monotonic() >= deadline:
+                    failures.extend(f'{entry.name}：產生逾時' for entry in pending)
+                    break
+                pending[0].job.wait(0.1)
+                continue
+            for entry in ready:
+                pending.remove(entry)
+                error = yield from _write_report_to_zip(zf, stream, entry)
+                if error:
+                    failures.append(f'{entry.name}：{error}')
+        if failures:
+            zf.writestr('未完成的報告.txt', '\n'.join(failures))
+    yield stream.drain()  # central directory
+
+@app.route('/export_reports')
+def export_reports():
+    """把帳號下所有小孩的報告打包成 ZIP 下載：報告由背景行程池平行產生，完成一份就寫入並送出一份"""
+    if 'user_id' not in session:
+        return redirect(url_for('login'))
+
+    user = db.session.get(User, session['user_id'])
+    children = Child.query.filter_by(user_id=session['user_id']).order_by(Child.id).all()
+    if not user or not children:
+        return redirect(url_for('child_selection'))
+
+    entries = collect_report_exports(children)
+    filename = f'學習報告_{user.username}_{datetime.now().strftime("%Y%m%d")}.zip'
+    db.session.commit()  # 串流期間不需要資料庫
+    return Response(stream_reports_zip(entries), mimetype='application/zip', headers={
+        'Content-Disposition': f"attachment; filename=\"reports.zip\"; filename*=UTF-8''{quote(filename)}",
+        'Cache-Control': 'no-store',
+        'X-Accel-Buffering': 'no'
+    })
 
 @app.route('/delete_child/<int:child_id>', methods=['POST'])
 def delete_child(child_id):
@@ -1388,7 +3567,14 @@ def reset_learning_history(child_id):
 
     child = Child.query.filter_by(id=child_id, user_id=session['user_id']).first()
     if child:
-        StudySession.query.filter_by(child_id=child_id).delete()
+        # 批次刪除不會觸發 ORM cascade，先刪掉這些場次的情緒資料，避免留下孤兒列
+        session_ids = db.session.query(StudySession.id).filter_by(child_id=child_id).scalar_subquery()
+        EmotionData.query.filter(EmotionData.session_id.in_(session_ids)).delete(synchronize_session=False)
+        EmotionChunk.query.filter(EmotionChunk.session_id.in_(session_ids)).delete(synchronize_session=False)
+        StudySession.query.filter_by(child_id=child_id).delete(synchronize_session=False)
+        ChildSubjectSummary.query.filter_by(child_id=child_id).delete()
+        ChildDailySubjectRollup.query.filter_by(child_id=child_id).delete()
+        bump_analytics_version(child_id)
         child.ai_suggestion = None
         if child.pdf_report_path and os.path.exists(child.pdf_report_path):
             try:
@@ -1441,10 +3627,14 @@ def update_user_profile():
             if User.query.filter_by(email=new_email).first():
                 return jsonify({'success': False, 'message': '電子郵件已被使用'})
 
+        if new_password:
+            try:
+                user.password_hash = password_hasher.hash(new_password)
+            except PasswordHashBusy as busy:
+                print(f'⚠ 更新密碼暫時拒絕: {busy}')
+                return password_hash_busy_response()
         user.username = new_username
         user.email = new_email
-        if new_password:
-            user.password_hash = bcrypt.generate_password_hash(new_password).decode('utf-8')
 
         db.session.commit()
         session['username'] = new_username
@@ -1536,7 +3726,8 @@ def update_child_profile():
         traceback.print_exc()
         return jsonify({'success': False, 'message': '更新失敗，請稍後再試'}), 500
 
-def prepare_chart_data(study_sessions):
+def prepare_chart_data(analytics):
+    """科目統計與近期趨勢皆取自 SessionAnalytics"""
     chart_data = {
         'subjects': [],
         'attention_scores': [],
@@ -1556,184 +3747,43 @@ def prepare_chart_data(study_sessions):
         'cs': '#26c6da'
     }
     
-    subject_stats = {}
-    for s in study_sessions:
-        if s.subject not in subject_stats:
-            subject_stats[s.subject] = {
-                'total_time': 0,
-                'avg_attention': 0,
-                'count': 0,
-                'attention_count': 0
-            }
-        subject_stats[s.subject]['total_time'] += s.duration_minutes
-        subject_stats[s.subject]['count'] += 1
-        if s.avg_attention:
-            subject_stats[s.subject]['avg_attention'] += s.avg_attention
-            subject_stats[s.subject]['attention_count'] += 1
-        # if s.avg_attention is not None:
-        #     subject_stats[s.subject]['avg_attention'] += s.avg_attention
-        #     subject_stats[s.subject]['attention_count'] += 1
-
-    for subject, stats in subject_stats.items():
+    for subject, stats in analytics.subjects.items():
         chart_data['subjects'].append(SUBJECTS.get(subject, subject))
-        chart_data['study_times'].append(stats['total_time'])
+        chart_data['study_times'].append(stats.total_minutes)
         chart_data['subject_colors'].append(COLOR_MAP.get(subject, '#95a5a6'))  # 新增顏色
         
-        if stats['attention_count'] > 0:
-            avg = stats['avg_attention'] / stats['attention_count']
+        avg = stats.avg_attention_nonzero  # 忽略 0 與 None
+        if avg is not None:
             chart_data['attention_scores'].append(round(avg * 100 / 3))
         else:
             chart_data['attention_scores'].append(0)
 
-    recent = sorted(study_sessions, key=lambda x: x.start_time)[-10:]
-    for s in recent:
-        chart_data['dates'].append(s.start_time.strftime('%m/%d'))
-        chart_data['attention_trend'].append(round(s.avg_attention * 100 / 3) if s.avg_attention else 0)
+    for start_time, avg_attention in analytics.recent_trend:
+        chart_data['dates'].append(start_time.strftime('%m/%d'))
+        chart_data['attention_trend'].append(round(avg_attention * 100 / 3) if avg_attention else 0)
     
     return chart_data
 
-'''
-def prepare_chart_data(study_sessions):
-    chart_data = {'subjects': [], 'attention_scores': [], 'study_times': [], 'dates': [], 'attention_trend': []}
-    subject_stats = {}
-    for s in study_sessions:
-        if s.subject not in subject_stats:
-            subject_stats[s.subject] = {'total_time': 0, 'avg_attention': 0, 'count': 0}
-        subject_stats[s.subject]['total_time'] += s.duration_minutes
-        if s.avg_attention:
-            subject_stats[s.subject]['avg_attention'] += s.avg_attention
-            subject_stats[s.subject]['count'] += 1
-
-    for subject, stats in subject_stats.items():
-        chart_data['subjects'].append(SUBJECTS.get(subject, subject))
-        chart_data['study_times'].append(stats['total_time'])
-        if stats['count'] > 0:
-            avg = stats['avg_attention'] / stats['count']
-            chart_data['attention_scores'].append(round(avg * 100 / 3))
-        else:
-            chart_data['attention_scores'].append(0)
-
-    recent = sorted(study_sessions, key=lambda x: x.start_time)[-10:]
-    for s in recent:
-        chart_data['dates'].append(s.start_time.strftime('%m/%d'))
-        chart_data['attention_trend'].append(round(s.avg_attention * 100 / 3) if s.avg_attention else 0)
-    return chart_data'''
-
-def prepare_performance_data(study_sessions):
-    # data = {
-    #     'total_sessions': len(study_sessions),
-    #     'total_hours': sum(s.duration_minutes for s in study_sessions) / 60,
-    #     'avg_attention': 0,
-    #     'best_subject': '',
-    #     'improvement_rate': 0
-    # }
-    eligible = [s for s in study_sessions if is_eligible_session(s)]
+def prepare_performance_data(analytics):
+    # 全部取自 SessionAnalytics
     data = {
-        'total_sessions': len(eligible),
-        'total_hours': sum(s.duration_minutes or 0 for s in eligible) / 60,
-        'avg_attention': compute_overall_avg_attention_percent(eligible),  # ← 統一
+        'total_sessions': analytics.total_sessions,
+        'total_hours': analytics.total_minutes / 60,
+        'avg_attention': analytics.overall_attention_percent,  # ← 統一
         'best_subject': '',
-        'improvement_rate': 0
+        'improvement_rate': analytics.improvement_rate
     }
 
-    if not study_sessions:
+    if not analytics.subjects:
         return data
 
-    # # 平均專注度（百分比）
-    # att = [s.avg_attention for s in study_sessions if s.avg_attention is not None]
-    # if att:
-    #     data['avg_attention'] = round(sum(att) / len(att) * 100 / 3)
-    # data['avg_attention'] = compute_overall_avg_attention_percent(study_sessions)
-
     # ★ 以總學習時間決定「最常學習科目」
-    time_by_subject = {}
-    for s in study_sessions:
-        time_by_subject[s.subject] = time_by_subject.get(s.subject, 0) + (s.duration_minutes or 0)
-    if time_by_subject:
-        best_key = max(time_by_subject.items(), key=lambda kv: kv[1])[0]
-        data['best_subject'] = SUBJECTS.get(best_key, best_key)
-
-    # att = [s.avg_attention for s in study_sessions if s.avg_attention is not None]
-    # # 進步幅度（用最近 3 場 vs 最早 3 場）
-    # if len(att) >= 5:
-    #     early = sum(att[:3]) / 3
-    #     recent = sum(att[-3:]) / 3
-    #     if early:
-    #         data['improvement_rate'] = round((recent - early) / early * 100)
-    # att = [s.avg_attention for s in eligible if s.avg_attention is not None]
-    att = [s.avg_attention for s in eligible if s.avg_attention]
-    if len(att) >= 5:
-        early = sum(att[:3]) / 3
-        recent = sum(att[-3:]) / 3
-        if early:
-            data['improvement_rate'] = round((recent - early) / early * 100)
+    best_key = analytics.most_studied_subject
+    data['best_subject'] = SUBJECTS.get(best_key, best_key)
 
     return data
 
-''' # 10/07 12:06 註解
-def prepare_performance_data(study_sessions):
-    data = {
-        'total_sessions': len(study_sessions),
-        'total_hours': sum(s.duration_minutes for s in study_sessions) / 60,
-        'avg_attention': 0,
-        'best_subject': '',
-        'improvement_rate': 0
-    }
-    
-    if study_sessions:
-        # 計算平均專注度
-        att = [s for s in study_sessions if s.avg_attention]
-        if att:
-            data['avg_attention'] = round(sum(s.avg_attention for s in att) / len(att) * 100 / 3)
-        
-        # 找出最常學習的科目（以學習次數為準）
-        subject_count = {}
-        subject_attention = {}
-        for s in study_sessions:
-            subject_count[s.subject] = subject_count.get(s.subject, 0) + 1
-            if s.avg_attention:
-                if s.subject not in subject_attention:
-                    subject_attention[s.subject] = []
-                subject_attention[s.subject].append(s.avg_attention)
-        
-        # 找出學習次數最多的科目
-        if subject_count:
-            best_subject_key = max(subject_count.items(), key=lambda x: x[1])[0]
-            data['best_subject'] = SUBJECTS.get(best_subject_key, best_subject_key)
-        
-        # 計算進步幅度
-        if len(att) >= 5:
-            early = sum(s.avg_attention for s in att[:3]) / 3
-            recent = sum(s.avg_attention for s in att[-3:]) / 3
-            if early:
-                data['improvement_rate'] = round((recent - early) / early * 100)
-    
-    return data
-'''
-
-'''
-def prepare_performance_data(study_sessions):
-    data = {'total_sessions': len(study_sessions), 'total_hours': sum(s.duration_minutes for s in study_sessions) / 60,
-            'avg_attention': 0, 'best_subject': '', 'improvement_rate': 0}
-    if study_sessions:
-        att = [s for s in study_sessions if s.avg_attention]
-        if att:
-            data['avg_attention'] = round(sum(s.avg_attention for s in att) / len(att) * 100 / 3)
-        subject_perf = {}
-        for s in study_sessions:
-            if s.avg_attention:
-                subject_perf.setdefault(s.subject, []).append(s.avg_attention)
-        if subject_perf:
-            best_subject = max(subject_perf.items(), key=lambda x: sum(x[1])/len(x[1]))
-            data['best_subject'] = SUBJECTS.get(best_subject[0], best_subject[0])
-        if len(att) >= 5:
-            early = sum(s.avg_attention for s in att[:3]) / 3
-            recent = sum(s.avg_attention for s in att[-3:]) / 3
-            if early:
-                data['improvement_rate'] = round((recent - early) / early * 100)
-    return data'''
-
-def generate_comprehensive_suggestions(child, study_sessions):
+def generate_comprehensive_suggestions(child, analytics):
     suggestions = {'learning_style': [], 'schedule': [], 'subject_specific': [], 'attention_improvement': [], 'age_appropriate': []}
     suggestions['age_appropriate'].append("建議使用番茄鐘技巧：學習25分鐘，休息5分鐘，有助於維持專注力")
 
@@ -1754,10 +3804,9 @@ def generate_comprehensive_suggestions(child, study_sessions):
     else:
         suggestions['learning_style'].append("可以設定挑戰性目標，競爭性學習環境較能激發學習動力")
 
-    if study_sessions:
-        attention_sessions = [s for s in study_sessions if s.avg_attention]
-        if attention_sessions:
-            avg_attention = sum(s.avg_attention for s in attention_sessions) / len(attention_sessions)
+    if analytics.total_sessions:
+        avg_attention = analytics.overall_attention  # 忽略 0 與 None
+        if avg_attention is not None:
             if avg_attention < 1.5:
                 suggestions['attention_improvement'].append("專注度偏低，建議檢查學習環境是否有干擾因素")
                 suggestions['attention_improvement'].append("可以嘗試使用白噪音或輕音樂幫助集中注意力")
@@ -1769,13 +3818,8 @@ def generate_comprehensive_suggestions(child, study_sessions):
                 suggestions['attention_improvement'].append("專注度佳，可嘗試更具挑戰的內容")
                 suggestions['schedule'].append("可延長單次學習至30-35分鐘，仍需適當休息")
 
-        study_hours = {}
-        for s in study_sessions:
-            study_hours.setdefault(s.start_time.hour, [])
-            if s.avg_attention:
-                study_hours[s.start_time.hour].append(s.avg_attention)
-        if study_hours:
-            best_hour, values = max(study_hours.items(), key=lambda x: sum(x[1])/len(x[1]) if x[1] else 0)
+        best_hour = analytics.best_hour
+        if best_hour is not None:
             if 6 <= best_hour < 9:
                 suggestions['schedule'].append("早上(6-9點)表現最佳，重要科目安排在這時段")
             elif 9 <= best_hour < 12:
@@ -1792,12 +3836,7 @@ def generate_comprehensive_suggestions(child, study_sessions):
             else:
                 suggestions['schedule'].append("可適度延長晚間學習，但務必確保睡眠")
 
-        subject_performance = {}
-        for s in study_sessions:
-            if s.avg_attention:
-                subject_performance.setdefault(s.subject, []).append(s.avg_attention)
-
-        overall_avg = (sum(s.avg_attention for s in attention_sessions) / len(attention_sessions)) if attention_sessions else 2.0
+        overall_avg = avg_attention if avg_attention is not None else 2.0
         attention_level = "high" if overall_avg >= 2.5 else "medium" if overall_avg >= 1.5 else "low"
 
         def get_subject_improvement_suggestion(subject, age, gender, education_stage, attention_level):
@@ -1822,8 +3861,10 @@ def generate_comprehensive_suggestions(child, study_sessions):
             }.get(subject, {}).get(education_stage, "加深加廣，協助同儕學習")
             return adv
 
-        for subject, perf in subject_performance.items():
-            avg_perf = sum(perf) / len(perf)
+        for subject, stats in analytics.subjects.items():
+            avg_perf = stats.avg_attention_nonzero
+            if avg_perf is None:
+                continue
             name = SUBJECTS.get(subject, subject)
             if avg_perf < 2:
                 suggestions['subject_specific'].append(f"{name}需要加強，{get_subject_improvement_suggestion(subject, child.age, child.gender, child.education_stage, attention_level)}")
@@ -1832,15 +3873,47 @@ def generate_comprehensive_suggestions(child, study_sessions):
 
     return suggestions
 
-def create_comprehensive_report(child, study_sessions, ai_suggestion=None):
-    filename = f'report_{child.id}_{datetime.now().strftime("%Y%m%d_%H%M%S")}.pdf'
-    filepath = os.path.join('reports', filename)
-    os.makedirs('reports', exist_ok=True)
+def build_report_context(child, ai_suggestion=None):
+    """收集 PDF 報告需要的資料；只含基本型別，可交給報告行程池排版。
+    不含報告日期（排版時才填入），內容雜湊與 ETag 只隨資料改變，不會每天失效"""
+    analytics = get_session_analytics(child)  # 統計數字與各頁面一致：只計已完成的場次
+    return {
+        'nickname': child.nickname,
+        'gender': GENDERS.get(child.gender, child.gender),
+        'age': child.age,
+        'education_stage': EDUCATION_STAGES.get(child.education_stage, child.education_stage),
+        'ai_suggestion': ai_suggestion,
+        'total_sessions': analytics.total_sessions,
+        'total_minutes': analytics.total_minutes,
+        'avg_attention_percent': analytics.overall_attention_percent,
+        'subject_stats': {
+            subject: {'count': r.session_count, 'total_time': r.total_minutes,
+                      'attention_sum': r.attention_sum, 'attention_count': r.attention_nonzero_count}
+            for subject, r in analytics.subjects.items()
+        },
+        'suggestions': generate_comprehensive_suggestions(child, analytics),
+    }
 
-    doc = SimpleDocTemplate(filepath, pagesize=A4, topMargin=0.5*inch, bottomMargin=0.5*inch)
+def render_report_pdf(context):
+    """以 ReportLab 在記憶體中排版 PDF，回傳 bytes（不存取資料庫，可在子行程執行）"""
+    from reportlab.lib import colors
+    from reportlab.lib.pagesizes import A4
+    from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer, PageBreak
+    from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+    from reportlab.lib.units import inch
+    from reportlab.lib.enums import TA_CENTER, TA_LEFT
+    from reportlab.graphics.shapes import Drawing
+    from reportlab.graphics.charts.barcharts import VerticalBarChart
+    from reportlab.graphics.charts.piecharts import Pie
+
+    total_sessions = context['total_sessions']
+    ai_suggestion = context['ai_suggestion']
+
+    buffer = BytesIO()
+    doc = SimpleDocTemplate(buffer, pagesize=A4, topMargin=0.5*inch, bottomMargin=0.5*inch)
     story = []
     styles = getSampleStyleSheet()
-    font_name = PDF_FONT if PDF_FONT and PDF_FONT != 'Helvetica' else 'Helvetica'
+    font_name = get_pdf_font()
 
     title_style = ParagraphStyle('CustomTitle', parent=styles['Title'],
                                  fontName=font_name, fontSize=24, textColor=colors.HexColor('#2C3E50'),
@@ -1857,12 +3930,12 @@ def create_comprehensive_report(child, study_sessions, ai_suggestion=None):
     story.append(Paragraph('學習評估報告', title_style))
     story.append(Spacer(1, 30))
     basic_info = [
-        ['姓名', child.nickname],
-        ['性別', GENDERS.get(child.gender, child.gender)],
-        ['年齡', str(child.age)],
-        ['教育階段', EDUCATION_STAGES.get(child.education_stage, child.education_stage)],
-        ['報告日期', datetime.now().strftime('%Y-%m-%d')],
-        ['總學習次數', str(len(study_sessions))]
+        ['姓名', context['nickname']],
+        ['性別', context['gender']],
+        ['年齡', str(context['age'])],
+        ['教育階段', context['education_stage']],
+        ['報告日期', datetime.now().strftime('%Y-%m-%d')],  # 產生 PDF 的日期，不列入內容雜湊
+        ['總學習次數', str(total_sessions)]
     ]
     info_table = Table(basic_info, colWidths=[2.5*inch, 3.5*inch])
     info_table.setStyle(TableStyle([
@@ -1889,17 +3962,16 @@ def create_comprehensive_report(child, study_sessions, ai_suggestion=None):
     story.append(Paragraph('數據分析', heading_style))
     story.append(Spacer(1, 20))
 
-    if study_sessions:
-        total_minutes = sum(s.duration_minutes for s in study_sessions)
+    if total_sessions:
+        total_minutes = context['total_minutes']
         total_hours = total_minutes / 60
-        attention_sessions = [s for s in study_sessions if s.avg_attention]
-        avg_attention_percent = round((sum(s.avg_attention for s in attention_sessions) / len(attention_sessions)) * 100 / 3) if attention_sessions else 0
+        avg_attention_percent = context['avg_attention_percent']
 
         stats_data = [
             ['總學習時間', f'{total_hours:.1f} 小時 ({total_minutes} 分鐘)'],
             ['平均專注度', f'{avg_attention_percent}%'],
-            ['學習頻率', f'{len(study_sessions)} 次'],
-            ['平均學習時長', f'{total_minutes/len(study_sessions):.1f} 分鐘']
+            ['學習頻率', f'{total_sessions} 次'],
+            ['平均學習時長', f'{total_minutes/total_sessions:.1f} 分鐘']
         ]
         stats_table = Table(stats_data, colWidths=[3*inch, 3*inch])
         stats_table.setStyle(TableStyle([
@@ -1915,15 +3987,7 @@ def create_comprehensive_report(child, study_sessions, ai_suggestion=None):
         story.append(stats_table)
         story.append(PageBreak())
 
-        subject_stats = {}
-        for s in study_sessions:
-            if s.subject not in subject_stats:
-                subject_stats[s.subject] = {'count': 0, 'total_time': 0, 'attention_sum': 0, 'attention_count': 0}
-            subject_stats[s.subject]['count'] += 1
-            subject_stats[s.subject]['total_time'] += s.duration_minutes
-            if s.avg_attention:
-                subject_stats[s.subject]['attention_sum'] += s.avg_attention
-                subject_stats[s.subject]['attention_count'] += 1
+        subject_stats = context['subject_stats']
 
         story.append(Paragraph('科目表現分析', heading_style))
         story.append(Spacer(1, 20))
@@ -2007,7 +4071,7 @@ def create_comprehensive_report(child, study_sessions, ai_suggestion=None):
 
     story.append(Paragraph('個人化學習建議', heading_style))
     story.append(Spacer(1, 20))
-    suggestions = generate_comprehensive_suggestions(child, study_sessions)
+    suggestions = context['suggestions']
     category_names = {
         'age_appropriate': '年齡適性建議',
         'learning_style': '學習風格建議',
@@ -2026,7 +4090,7 @@ def create_comprehensive_report(child, study_sessions, ai_suggestion=None):
             story.append(Spacer(1, 15))
 
     doc.build(story)
-    return filepath
+    return buffer.getvalue()
 
 @app.route('/favicon.ico')
 def favicon():
@@ -2047,8 +4111,265 @@ def add_coop_coep(resp):
     resp.headers['Cross-Origin-Resource-Policy'] = 'cross-origin'
     return resp
 
+# ===== 資料庫 migration：create_all 只會建立新表格，既有表格的欄位 / 索引由這裡依版本補上 =====
+# 每個 migration 都必須可重複執行（新資料庫的 create_all 已建立好同樣的結構），SQLite 與 PostgreSQL 皆適用
+def _add_missing_columns(table, columns):
+    existing = {c['name'] for c in db.inspect(db.session.connection()).get_columns(table)}
+    missing = [name for name in columns if name not in existing]
+    for name in missing:
+        db.session.execute(text(f'ALTER TABLE {table} ADD COLUMN {name} {columns[name]}'))
+    if missing:
+        print(f'  {table} 新增欄位: {missing}')
+
+def _create_indexes(*statements):
+    for stmt in statements:
+        db.session.execute(text(stmt))
+
+def _migration_emotion_ingest_columns():
+    # 值為 NULL 的舊場次由 backfill-session-aggregates 填入
+    _add_missing_columns('study_session', {
+        'emotion_count': 'INTEGER',
+        'attention_sum': 'FLOAT',
+        'confidence_sum': 'FLOAT',
+        'max_seq': 'INTEGER'
+    })
+    _add_missing_columns('emotion_data', {'seq': 'INTEGER'})
+    _create_indexes('CREATE UNIQUE INDEX IF NOT EXISTS uq_emotion_data_session_seq ON emotion_data (session_id, seq)')
+
+def _migration_hot_path_indexes():
+    _create_indexes(
+        'CREATE INDEX IF NOT EXISTS ix_study_session_child_start ON study_session (child_id, start_time)',
+        'CREATE INDEX IF NOT EXISTS ix_child_user_id ON child (user_id)',
+        'CREATE INDEX IF NOT EXISTS ix_video_watch_session_id ON video_watch (session_id)',
+        'CREATE UNIQUE INDEX IF NOT EXISTS uq_emotion_chunk_session_start ON emotion_chunk (session_id, chunk_start)'
+    )
+
+def _migration_analytics_version():
+    _add_missing_columns('child', {'analytics_version': 'INTEGER NOT NULL DEFAULT 0'})
+
+def _migration_ai_suggestion_version():
+    # 既有建議的版本為 NULL，下一次 precompute-ai-suggestions 會為活躍的小孩重新產生
+    _add_missing_columns('child', {'ai_suggestion_version': 'INTEGER', 'ai_suggestion_at': 'TIMESTAMP'})
+
+SCHEMA_MIGRATIONS = [
+    (1, 'study_session 情緒累計欄位、emotion_data.seq 去重索引', _migration_emotion_ingest_columns),
+    (2, '常用查詢的複合索引', _migration_hot_path_indexes),
+    (3, '由既有場次建立 child_subject_summary', rebuild_subject_summaries),
+    (4, '由既有場次建立 child_daily_subject_rollup', rebuild_daily_rollups),
+    (5, 'child.analytics_version（SessionAnalytics 快取版本）', _migration_analytics_version),
+    (6, 'child.ai_suggestion_version / ai_suggestion_at（AI 建議是否過時）', _migration_ai_suggestion_version),
+]
+SCHEMA_VERSION = SCHEMA_MIGRATIONS[-1][0]
+SCHEMA_MIGRATION_LOCK_ID = 7281001  # PostgreSQL advisory lock，避免多個 worker 同時執行
+
+# 啟動時 worker 只用一次查詢確認 schema 版本，不建表也不執行 migration；部署時在啟動 worker 前先執行 flask migrate-schema
+# warn  : 版本落後（含全新資料庫）時記錄警告，/health 回 503 直到 migrate-schema 完成（預設）
+# strict: 版本落後時 worker 直接結束，不以舊 schema 提供服務
+DB_SCHEMA_CHECK = os.environ.get('DB_SCHEMA_CHECK', 'warn').lower()
+schema_status = {'version': None, 'expected': SCHEMA_VERSION, 'checked_at': None, 'error': None}
+
+def read_schema_version():
+    """已套用的最新 migration 版本（一次查詢）；schema_migration 表格不存在時回 None，連不上資料庫時拋出 OperationalError"""
+    db.session.connection()
+    try:
+        version = db.session.execute(text('SELECT MAX(version) FROM schema_migration')).scalar()
+    except (OperationalError, ProgrammingError):
+        db.session.rollback()
+        version = None
+    schema_status.update(version=version, checked_at=datetime.utcnow().isoformat(timespec='seconds'), error=None)
+    return version
+
+def schema_is_current():
+    return (schema_status['version'] or 0) >= SCHEMA_VERSION
+
+def run_schema_migrations():
+    """依版本順序套用尚未執行的 migration（單一交易），回傳本次套用的版本清單"""
+    if db.session.get_bind().dialect.name == 'postgresql':
+        db.session.execute(text('SELECT pg_advisory_xact_lock(:lock_id)'), {'lock_id': SCHEMA_MIGRATION_LOCK_ID})
+
+    done = {version for (version,) in db.session.query(SchemaMigration.version).all()}
+    applied = []
+    try:
+        for version, description, migrate in SCHEMA_MIGRATIONS:
+            if version in done:
+                continue
+            print(f'→ 套用 migration {version}: {description}')
+            migrate()
+            db.session.add(SchemaMigration(version=version, description=description, applied_at=datetime.utcnow()))
+            applied.append(version)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    return applied
+
+@app.cli.command('rebuild-subject-summaries')
+@click.option('--child-id', type=int, default=None, help='只重建指定小孩（預設全部）')
+def rebuild_subject_summaries_command(child_id):
+    """由 StudySession 重新計算 ChildSubjectSummary（修復用）"""
+    count = rebuild_subject_summaries(child_id)
+    if child_id is not None:
+        bump_analytics_version(child_id)
+    else:
+        Child.query.update({Child.analytics_version: db.func.coalesce(Child.analytics_version, 0) + 1},
+                           synchronize_session=False)
+    db.session.commit()
+    print(f'✓ 已重建 {count} 筆科目彙總')
+
+@app.cli.command('rebuild-daily-rollups')
+@click.option('--child-id', type=int, default=None, help='只重建指定小孩（預設全部）')
+def rebuild_daily_rollups_command(child_id):
+    """由 StudySession 重新計算 ChildDailySubjectRollup（修復用）"""
+    count = rebuild_daily_rollups(child_id)
+    db.session.commit()
+    print(f'✓ 已重建 {count} 筆每日彙總')
+
+@app.cli.command('precompute-ai-suggestions')
+@click.option('--parallelism', type=int, default=AI_PRECOMPUTE_PARALLELISM, show_default=True, help='同時產生的小孩數')
+@click.option('--rate-per-minute', type=float, default=AI_PRECOMPUTE_RATE_PER_MINUTE, show_default=True,
+              help='每分鐘最多呼叫 OpenAI 幾次（含重試；0 表示不限速）')
+@click.option('--max-attempts', type=int, default=AI_PRECOMPUTE_MAX_ATTEMPTS, show_default=True)
+@click.option('--backoff', 'backoff_seconds', type=float, default=AI_PRECOMPUTE_BACKOFF_SECONDS, show_default=True,
+              help='第一次重試前等待秒數，之後每次加倍')
+@click.option('--active-days', type=int, default=AI_PRECOMPUTE_ACTIVE_DAYS, show_default=True,
+              help='只處理最近幾天內有學習場次的小孩')
+@click.option('--limit', type=int, default=None, help='本次最多處理幾個小孩')
+@click.option('--checkpoint', 'checkpoint_path', default=None,
+              help='進度檔路徑（預設 instance/ai_precompute_checkpoint.json）')
+@click.option('--resume', is_flag=True, help='略過進度檔中已處理（成功或失敗）的小孩')
+@click.option('--dry-run', is_flag=True, help='只列出需要產生的小孩')
+def precompute_ai_suggestions(parallelism, rate_per_minute, max_attempts, backoff_seconds, active_days,
+                              limit, checkpoint_path, resume, dry_run):
+    """為近期活躍且 AI 建議已過時的小孩預先產生建議，讓家長開啟智慧建議頁時不必等待 OpenAI"""
+    if not has_openai_client():
+        print('✗ OpenAI 客戶端不可用（未設定 OPENAI_API_KEY 或已停用 AI 建議），略過')
+        return
+
+    child_ids = query_stale_ai_suggestion_child_ids(active_days)
+    db.session.rollback()
+
+    checkpoint_path = checkpoint_path or os.path.join(app.instance_path, 'ai_precompute_checkpoint.json')
+    checkpoint = load_precompute_checkpoint(checkpoint_path) if resume else None
+    if checkpoint is None:
+        checkpoint = {'started_at': datetime.utcnow().isoformat(), 'done': [], 'skipped': [], 'failed': {}}
+    processed = set(checkpoint['done']) | set(checkpoint['skipped']) | {int(k) for k in checkpoint['failed']}
+    child_ids = [cid for cid in child_ids if cid not in processed]
+    if limit is not None:
+        child_ids = child_ids[:limit]
+
+    print(f'→ 需要產生 AI 建議的小孩: {len(child_ids)} 位（已處理 {len(processed)} 位）')
+    if dry_run or not child_ids:
+        for cid in child_ids:
+            print(f'  child {cid}')
+        return
+
+    os.makedirs(os.path.dirname(os.path.abspath(checkpoint_path)), exist_ok=True)
+    rate_limiter = RateLimiter(rate_per_minute)
+    checkpoint_lock = threading.Lock()
+    started = time.monotonic()
+
+    def run(child_id):
+        try:
+            outcome = precompute_ai_suggestion(child_id, rate_limiter, max_attempts, backoff_seconds)
+            error = None
+        except Exception as e:
+            outcome, error = 'failed', str(e)[:500]
+            print(f'✗ 小孩 {child_id} 產生 AI 建議失敗: {e}')
+        with checkpoint_lock:
+            if outcome == 'failed':
+                checkpoint['failed'][str(child_id)] = error
+            else:
+                checkpoint[outcome].append(child_id)
+            save_precompute_checkpoint(checkpoint_path, checkpoint)
+        return outcome
+
+    with ThreadPoolExecutor(max_workers=max(1, parallelism), thread_name_prefix='ai-precompute') as pool:
+        outcomes = Counter(pool.map(run, child_ids))
+
+    print(f"✓ AI 建議預先產生完成：成功 {outcomes['done']}、略過 {outcomes['skipped']}、"
+          f"失敗 {outcomes['failed']}（{time.monotonic() - started:.1f} 秒，進度檔 {checkpoint_path}）")
+
+@app.cli.command('export-reports')
+@click.option('--user-id', type=int, required=True, help='帳號 ID')
+@click.option('--output', required=True, type=click.Path(dir_okay=False), help='輸出的 ZIP 檔案路徑')
+def export_reports_command(user_id, output):
+    """把指定帳號所有小孩的報告匯出成 ZIP（客服用）"""
+    children = Child.query.filter_by(user_id=user_id).order_by(Child.id).all()
+    if not children:
+        print(f'✗ 帳號 {user_id} 沒有任何小孩檔案')
+        return
+
+    entries = collect_report_exports(children)
+    db.session.commit()
+    with open(output, 'wb') as f:
+        for chunk in stream_reports_zip(entries):
+            f.write(chunk)
+    print(f'✓ 已匯出 {len(entries)} 份報告至 {output}')
+
+@app.cli.command('migrate-schema')
+def migrate_schema():
+    """建立缺少的表格並套用尚未執行的 migration（部署時在啟動 worker 前執行一次；唯一會修改 schema 的途徑）"""
+    if not init_database():
+        raise SystemExit(1)
+    print(f'✓ schema 版本 {schema_status["version"]}（程式需要 {SCHEMA_VERSION}）')
+
+@app.cli.command('backfill-session-aggregates')
+@click.option('--all', 'refill_all', is_flag=True, help='重新計算所有場次（預設只處理欄位為空的場次）')
+def backfill_session_aggregates(refill_all):
+    """以 EmotionData / EmotionChunk 重新計算 StudySession 的 emotion_count / attention_sum / confidence_sum"""
+    totals = emotion_totals_subquery()
+    query = (db.session.query(StudySession.id, totals.c.cnt, totals.c.att_sum, totals.c.conf_sum)
+             .outerjoin(totals, totals.c.session_id == StudySession.id))
+    if not refill_all:
+        query = query.filter(StudySession.emotion_count.is_(None))
+
+    updated = 0
+    for session_id, count, att_sum, conf_sum in query.all():
+        db.session.execute(
+            db.update(StudySession)
+            .where(StudySession.id == session_id)
+            .values(emotion_count=count or 0,
+                    attention_sum=float(att_sum or 0),
+                    confidence_sum=float(conf_sum or 0))
+        )
+        updated += 1
+        if updated % 1000 == 0:
+            db.session.commit()
+    db.session.commit()
+    print(f'✓ 已回填 {updated} 個學習場次的情緒累計值')
+
+@app.cli.command('migrate-emotion-chunks')
+@click.option('--batch-size', default=100, show_default=True, help='每處理幾個場次 commit 一次')
+def migrate_emotion_chunks(batch_size):
+    """把既有的 EmotionData 逐場次轉成 EmotionChunk，並刪除已轉換的資料列（累計欄位不變）"""
+    if not NUMPY_AVAILABLE:
+        print('✗ 未安裝 NumPy，無法轉換')
+        return
+
+    session_ids = [sid for (sid,) in db.session.query(EmotionData.session_id).distinct().all()]
+    converted = 0
+    for i, session_id in enumerate(session_ids, 1):
+        records = (db.session.query(EmotionData.timestamp, EmotionData.emotion,
+                                    EmotionData.attention_level, EmotionData.confidence)
+                   .filter(EmotionData.session_id == session_id, EmotionData.timestamp.isnot(None))
+                   .order_by(EmotionData.timestamp)
+                   .all())
+        rows = [{'session_id': session_id, 'timestamp': ts, 'emotion': emotion,
+                 'attention_level': attention_level, 'confidence': confidence}
+                for ts, emotion, attention_level, confidence in records]
+        append_emotion_chunks(rows)
+        (EmotionData.query
+         .filter(EmotionData.session_id == session_id, EmotionData.timestamp.isnot(None))
+         .delete(synchronize_session=False))
+        converted += len(rows)
+        if i % batch_size == 0:
+            db.session.commit()
+            print(f'  已處理 {i}/{len(session_ids)} 個場次')
+    db.session.commit()
+    print(f'✓ 已將 {converted} 筆情緒資料轉為 EmotionChunk（{len(session_ids)} 個場次）')
+
 def init_database():
-    """初始化資料庫 - 確保所有表格都已建立（強化版）"""
+    """初始化資料庫 - 確保所有表格都已建立並套用 migration（flask migrate-schema；本地開發 python app.py）"""
     max_retries = 3
     retry_count = 0
     
@@ -2069,7 +4390,9 @@ def init_database():
                 print(f'✓ 資料表清單: {tables}')
                 
                 # 檢查必要的表格
-                required_tables = ['user', 'child', 'study_session', 'emotion_data', 'video_watch']
+                required_tables = ['user', 'child', 'study_session', 'emotion_data', 'emotion_chunk', 'video_watch',
+                                   'child_subject_summary', 'child_daily_subject_rollup', 'ai_suggestion_job',
+                                   'ai_suggestion_cache', 'schema_migration']
                 missing_tables = [t for t in required_tables if t not in tables]
                 
                 if missing_tables:
@@ -2077,6 +4400,10 @@ def init_database():
                     raise Exception(f'缺少必要表格: {missing_tables}')
                 
                 print('✓ 所有必要表格已確認存在')
+
+                # create_all 不會替既有表格補欄位 / 索引
+                run_schema_migrations()
+                read_schema_version()
                 return True
                 
         except OperationalError as e:
@@ -2097,6 +4424,28 @@ def init_database():
             traceback.print_exc()
             return False
 
+def check_database_schema():
+    """啟動時的資料庫檢查：只查一次 schema 版本，不 create_all、不檢視表格、不重試等待。
+    結束時釋放連線池，gunicorn --preload 的 master 不會把連線帶進 fork 出來的 worker"""
+    with app.app_context():
+        try:
+            version = read_schema_version()
+            if schema_is_current():
+                print(f'✓ 資料庫 schema 版本 {version}')
+            else:
+                message = f'schema 版本 {version or 0} 落後 {SCHEMA_VERSION}，請先執行 flask migrate-schema'
+                schema_status['error'] = message
+                if DB_SCHEMA_CHECK == 'strict':
+                    raise SystemExit(f'✗ {message}')
+                print(f'⚠ {message}')
+        except OperationalError as e:
+            print(f'✗ 資料庫連線失敗，略過 schema 檢查: {e}')
+            schema_status['error'] = str(e)[:200]
+            db.session.rollback()
+        finally:
+            db.session.remove()
+            db.engine.dispose()
+
 # ===== 新增：資料庫健康檢查端點 =====
 @app.route('/health')
 def health_check():
@@ -2104,6 +4453,14 @@ def health_check():
     try:
         # 測試資料庫連線
         db.session.execute(text('SELECT 1'))
+        if not schema_is_current() and (read_schema_version() or 0) < SCHEMA_VERSION:
+            # 版本落後時每次重新確認，執行 migrate-schema 後不必重啟 worker
+            return jsonify({
+                'status': 'schema_outdated',
+                'database': 'connected',
+                'schema': schema_status,
+                'db_circuit': db_circuit.snapshot()
+            }), 503
         
         # 統計基本資料
         user_count = User.query.count()
@@ -2117,7 +4474,16 @@ def health_check():
                 'users': user_count,
                 'children': child_count,
                 'sessions': session_count
-            }
+            },
+            'emotion_buffer': emotion_buffer.snapshot(),
+            'ai_jobs': ai_job_queue.snapshot(),
+            'ai_cache': ai_response_cache.snapshot(),
+            'reports': report_render_queue.snapshot(),
+            'report_store': report_store.snapshot(),
+            'openai': openai_limiter.snapshot(),
+            'password_hash': password_hasher.snapshot(),
+            'db_circuit': db_circuit.snapshot(),
+            'schema': schema_status
         }), 200
         
     except Exception as e:
@@ -2125,13 +4491,14 @@ def health_check():
         return jsonify({
             'status': 'unhealthy',
             'database': 'disconnected',
-            'error': str(e)
+            'error': str(e),
+            'db_circuit': db_circuit.snapshot()
         }), 503
 
-# 啟動時初始化資料庫
-init_database()
+# 啟動時只確認 schema 版本（建表 / migration 見 flask migrate-schema）；行程池子行程匯入 app 時不需要
+if multiprocessing.parent_process() is None:
+    check_database_schema()
 
 if __name__ == '__main__':
-    with app.app_context():
-        db.create_all()
+    init_database()  # 本地開發：等同 flask migrate-schema
     app.run(debug=False, host='0.0.0.0', port=int(os.environ.get('PORT', 5000)))
@@ -0,0 +1,108 @@
+"""
+以本機 OpenAI stub 壓測 AI 建議路徑：同步呼叫 generate_ai_suggestions（模擬 request worker）或走背景工作佇列。
+
+用法：
+    python benchmarks/bench_ai_suggestions.py [--mode direct|jobs] [--children 40] [--threads 16]
+        [--latency lognormal:0.0:0.5] [--tokens-per-second 0] [--error-rate 0] [--timeout-rate 0]
+        [--hang-seconds 60]
+
+應用程式端的連線池 / 併發 / 期限設定沿用環境變數（OPENAI_MAX_CONCURRENCY、OPENAI_CALL_DEADLINE 等）。
+使用暫存 SQLite 資料庫並停用 AI 建議快取；輸出每次呼叫的延遲分布、失敗數與雙方的併發統計。
+"""
+import argparse
+import json
+import math
+import os
+import statistics
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import openai_stub  # noqa: E402
+
+
+def percentile(sorted_values, pct):
+    return sorted_values[min(len(sorted_values) - 1, max(0, math.ceil(len(sorted_values) * pct) - 1))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--mode', choices=['direct', 'jobs'], default='direct')
+    parser.add_argument('--children', type=int, default=40)
+    parser.add_argument('--threads', type=int, default=16, help='direct 模式同時呼叫的執行緒數')
+    parser.add_argument('--latency', default='lognormal:0.0:0.5')
+    parser.add_argument('--tokens-per-second', type=float, default=0.0)
+    parser.add_argument('--completion-tokens', type=int, default=200)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--timeout-rate', type=float, default=0.0)
+    parser.add_argument('--hang-seconds', type=float, default=60.0)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    config = openai_stub.StubConfig(latency=args.latency, tokens_per_second=args.tokens_per_second,
+                                    completion_tokens=args.completion_tokens, error_rate=args.error_rate,
+                                    timeout_rate=args.timeout_rate, hang_seconds=args.hang_seconds, seed=args.seed)
+    server, base_url = openai_stub.start_in_thread(config)
+
+    db_path = os.path.join(tempfile.mkdtemp(), 'bench.db')
+    os.environ.update(DATABASE_URL=f'sqlite:///{db_path}', OPENAI_BASE_URL=base_url, AI_CACHE_ENABLED='false')
+    os.environ.setdefault('OPENAI_API_KEY', 'stub')
+    sys.path.insert(0, ROOT)
+    import app as m
+    m.init_database()  # 啟動時只檢查 schema，建表由 migrate-schema 負責
+
+    with m.app.app_context():
+        user = m.User(username='bench', email='bench@example.com', password_hash='x')
+        m.db.session.add(user)
+        m.db.session.flush()
+        children = [m.Child(user_id=user.id, nickname=f'bench{i}', gender='female', age=10,
+                            education_stage='elementary') for i in range(args.children)]
+        m.db.session.add_all(children)
+        m.db.session.commit()
+        child_ids = [c.id for c in children]
+
+    latencies = []
+    failures = 0
+    started = time.perf_counter()
+    if args.mode == 'direct':
+        def call(child_id):
+            with m.app.app_context():
+                t0 = time.perf_counter()
+                text = m.generate_ai_suggestions(m.db.session.get(m.Child, child_id))
+                return time.perf_counter() - t0, text == m.FAILURE_TEXT
+
+        with ThreadPoolExecutor(max_workers=args.threads) as pool:
+            for elapsed, failed in pool.map(call, child_ids):
+                latencies.append(elapsed)
+                failures += failed
+    else:
+        with m.app.app_context():
+            job_ids = [m.ai_job_queue.enqueue(child_id).id for child_id in child_ids]
+            pending = set(job_ids)
+            while pending:
+                time.sleep(0.05)
+                m.db.session.expire_all()
+                for job in m.AISuggestionJob.query.filter(m.AISuggestionJob.id.in_(pending)).all():
+                    if job.status in ('done', 'failed'):
+                        pending.discard(job.id)
+                        latencies.append((job.finished_at - job.created_at).total_seconds())
+                        failures += job.status == 'failed' or job.result == m.FAILURE_TEXT
+    wall = time.perf_counter() - started
+
+    latencies.sort()
+    print(f'\n{args.mode} 模式：{len(latencies)} 次呼叫，總耗時 {wall:.2f} 秒，失敗 {failures} 次')
+    print(f'延遲 p50 {statistics.median(latencies):.3f}s  p95 {percentile(latencies, 0.95):.3f}s  '
+          f'max {latencies[-1]:.3f}s')
+    print('app openai:', json.dumps(m.openai_limiter.snapshot(), ensure_ascii=False))
+    stub_stats = server.state.snapshot()
+    stub_stats.pop('recent')
+    print('stub:', json.dumps(stub_stats, ensure_ascii=False))
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
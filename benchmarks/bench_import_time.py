@@ -0,0 +1,102 @@
+"""
+量測 `import app` 的冷啟動時間與記憶體（每個 gunicorn worker 開機時都要付一次）。
+
+用法：
+    python benchmarks/bench_import_time.py [--repeat 5] [--top 15] [--warm] [--app-dir PATH]
+
+每次在新的子行程以 `python -X importtime` 匯入 app（暫存 SQLite 資料庫），輸出：
+匯入耗時與 RSS 峰值的中位數、匯入後已載入的重量級套件，以及累計耗時最高的頂層模組。
+--warm 會在匯入後再觸發報告字型、OpenAI client 與 NumPy 的延遲載入，用來對照這些成本被挪到哪裡；
+--app-dir 可指向另一份 app.py（例如 git worktree 裡的舊版本）做前後比較。
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HEAVY_MODULES = ('matplotlib', 'numpy', 'reportlab', 'openai', 'httpx')
+
+CHILD_CODE = """
+import json, resource, sys, time
+sys.path.insert(0, {app_dir!r})
+start = time.perf_counter()
+import app
+elapsed = time.perf_counter() - start
+if {warm!r}:
+    if hasattr(app, 'get_pdf_font'):
+        app.get_pdf_font()
+    if hasattr(app, 'get_openai_client'):
+        app.get_openai_client()
+    import numpy
+print(json.dumps({{
+    'seconds': elapsed,
+    'total_seconds': time.perf_counter() - start,
+    'maxrss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    'heavy': [m for m in {heavy!r} if m in sys.modules],
+}}))
+"""
+
+
+def parse_importtime(stderr):
+    """-X importtime 的輸出 → {app 直接匯入的頂層套件: 累計微秒}；'(app)' 為 app.py 本身的執行時間"""
+    totals, children = {}, {}
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        self_us, cumulative, name = line[len('import time:'):].split('|')
+        depth = (len(name) - len(name.lstrip(' ')) - 1) // 2
+        if depth == 1:  # 子模組先於父模組輸出；更深的已含在累計時間裡
+            package = name.strip().split('.')[0]
+            children[package] = children.get(package, 0) + int(cumulative)
+        elif depth == 0:
+            if name.strip() == 'app':
+                totals = dict(children, **{'(app)': int(self_us)})
+            children = {}
+    return totals
+
+
+def run_once(app_dir, warm):
+    workdir = tempfile.mkdtemp()
+    env = dict(os.environ, DATABASE_URL=f'sqlite:///{os.path.join(workdir, "bench.db")}')
+    env.setdefault('OPENAI_API_KEY', 'stub')
+    code = CHILD_CODE.format(app_dir=app_dir, warm=warm, heavy=HEAVY_MODULES)
+    proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', code], cwd=workdir, env=env,
+                          capture_output=True, text=True, check=True)
+    result = json.loads(proc.stdout.strip().splitlines()[-1])
+    result['modules'] = parse_importtime(proc.stderr)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--top', type=int, default=15)
+    parser.add_argument('--warm', action='store_true', help='匯入後再載入報告 / AI / NumPy 子系統')
+    parser.add_argument('--app-dir', default=ROOT)
+    args = parser.parse_args()
+
+    runs = [run_once(os.path.abspath(args.app_dir), args.warm) for _ in range(args.repeat)]
+
+    print(f'\n{args.app_dir}：執行 {args.repeat} 次（中位數）')
+    print(f'import app      {statistics.median(r["seconds"] for r in runs) * 1000:>8.0f} ms')
+    if args.warm:
+        print(f'含延遲載入      {statistics.median(r["total_seconds"] for r in runs) * 1000:>8.0f} ms')
+    print(f'RSS 峰值        {statistics.median(r["maxrss_kb"] for r in runs) / 1024:>8.1f} MB')
+    print(f'已載入重量級套件 {", ".join(runs[-1]["heavy"]) or "（無）"}')
+
+    modules = {}
+    for r in runs:
+        for name, us in r['modules'].items():
+            modules.setdefault(name, []).append(us)
+    ranked = sorted(((statistics.median(v), name) for name, v in modules.items()), reverse=True)
+    print(f'\n{"app 匯入的套件":<40}{"累計 ms":>10}')
+    for us, name in ranked[:args.top]:
+        print(f'{name:<40}{us / 1000:>10.1f}')
+
+
+if __name__ == '__main__':
+    main()
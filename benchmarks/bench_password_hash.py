@@ -0,0 +1,122 @@
+"""
+量測 bcrypt 工作因子的成本，並模擬整班同時登入時密碼雜湊行程池的排隊、429 與對一般請求的影響。
+
+用法：
+    python benchmarks/bench_password_hash.py [--rounds 10,11,12,13] [--samples 5]
+        [--logins 60] [--threads 30] [--probe-hz 20]
+
+第一部分直接呼叫 bcrypt，列出各 rounds 單次雜湊的中位數耗時（挑選 BCRYPT_LOG_ROUNDS 用）。
+第二部分使用暫存 SQLite 資料庫：--threads 個執行緒同時送出共 --logins 次 POST /login，
+另一個執行緒以 --probe-hz 頻率打首頁，代表登入尖峰時進行中場次的一般請求。
+行程池大小 / 排隊上限 / 工作因子沿用環境變數（PASSWORD_HASH_WORKERS、PASSWORD_HASH_MAX_PENDING、BCRYPT_LOG_ROUNDS 等）。
+"""
+import argparse
+import json
+import math
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+import bcrypt
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PASSWORD = 'bench-password'
+
+
+def percentile(sorted_values, pct):
+    return sorted_values[min(len(sorted_values) - 1, max(0, math.ceil(len(sorted_values) * pct) - 1))]
+
+
+def bench_rounds(rounds_list, samples, configured):
+    print(f'\n{"rounds":>8}{"單次雜湊 ms":>14}')
+    for rounds in rounds_list:
+        timings = []
+        for _ in range(samples):
+            start = time.perf_counter()
+            bcrypt.hashpw(PASSWORD.encode(), bcrypt.gensalt(rounds=rounds))
+            timings.append((time.perf_counter() - start) * 1000)
+        marker = '  ← BCRYPT_LOG_ROUNDS' if rounds == configured else ''
+        print(f'{rounds:>8}{statistics.median(timings):>14.1f}{marker}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--rounds', default='10,11,12,13')
+    parser.add_argument('--samples', type=int, default=5)
+    parser.add_argument('--logins', type=int, default=60)
+    parser.add_argument('--threads', type=int, default=30, help='同時登入的執行緒數')
+    parser.add_argument('--probe-hz', type=float, default=20.0)
+    args = parser.parse_args()
+
+    configured = int(os.environ.get('BCRYPT_LOG_ROUNDS', 12))
+    bench_rounds([int(r) for r in args.rounds.split(',')], args.samples, configured)
+
+    db_path = os.path.join(tempfile.mkdtemp(), 'bench.db')
+    os.environ['DATABASE_URL'] = f'sqlite:///{db_path}'
+    sys.path.insert(0, ROOT)
+    import app as m
+    m.init_database()  # 啟動時只檢查 schema，建表由 migrate-schema 負責
+
+    with m.app.app_context():
+        pw_hash = m.password_hasher.hash(PASSWORD)
+        users = [m.User(username=f'bench{i}', email=f'bench{i}@example.com', password_hash=pw_hash)
+                 for i in range(args.threads)]
+        m.db.session.add_all(users)
+        m.db.session.commit()
+        usernames = [u.username for u in users]
+
+    stop = threading.Event()
+    probe_latencies = []
+
+    def probe():
+        client = m.app.test_client()
+        while not stop.is_set():
+            start = time.perf_counter()
+            client.get('/')
+            probe_latencies.append(time.perf_counter() - start)
+            stop.wait(1 / args.probe_hz)
+
+    def login(i):
+        client = m.app.test_client()
+        start = time.perf_counter()
+        response = client.post('/login', json={'username': usernames[i % len(usernames)], 'password': PASSWORD})
+        return response.status_code, time.perf_counter() - start
+
+    probe_thread = threading.Thread(target=probe, daemon=True)
+    probe_thread.start()
+    time.sleep(0.5)  # 先量一段沒有登入的基準
+    idle_count = len(probe_latencies)
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.threads) as pool:
+        results = list(pool.map(login, range(args.logins)))
+    wall = time.perf_counter() - started
+    stop.set()
+    probe_thread.join()
+
+    statuses = Counter(code for code, _ in results)
+    ok = sorted(elapsed for code, elapsed in results if code == 200)
+    shed = sorted(elapsed for code, elapsed in results if code == 429)
+    busy_probe = sorted(probe_latencies[idle_count:]) or [0.0]
+    idle_probe = sorted(probe_latencies[:idle_count]) or [0.0]
+
+    print(f'\n{args.logins} 次登入（{args.threads} 個執行緒），總耗時 {wall:.2f} 秒：'
+          + '，'.join(f'{code} × {n}' for code, n in sorted(statuses.items())))
+    if ok:
+        print(f'成功登入 p50 {statistics.median(ok) * 1000:.0f} ms  p95 {percentile(ok, 0.95) * 1000:.0f} ms  '
+              f'max {ok[-1] * 1000:.0f} ms')
+    if shed:
+        print(f'429 回應   p50 {statistics.median(shed) * 1000:.0f} ms  max {shed[-1] * 1000:.0f} ms')
+    print(f'首頁（閒置） p50 {statistics.median(idle_probe) * 1000:.1f} ms  '
+          f'p95 {percentile(idle_probe, 0.95) * 1000:.1f} ms')
+    print(f'首頁（尖峰） p50 {statistics.median(busy_probe) * 1000:.1f} ms  '
+          f'p95 {percentile(busy_probe, 0.95) * 1000:.1f} ms  max {busy_probe[-1] * 1000:.1f} ms')
+    print('password_hash:', json.dumps(m.password_hasher.snapshot(), ensure_ascii=False))
+
+
+if __name__ == '__main__':
+    main()
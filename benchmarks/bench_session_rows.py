@@ -0,0 +1,101 @@
+"""
+比較分析頁面讀取學習場次的兩種方式：完整 StudySession ORM 物件 vs SessionRow 欄位投影。
+
+用法：
+    python benchmarks/bench_session_rows.py [--sessions 10000] [--repeat 5]
+
+使用暫存 SQLite 資料庫，不會動到正式資料；輸出每 10k 場次的延遲與記憶體峰值。
+"""
+import argparse
+import gc
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def measure(fn, repeat):
+    """回傳 (中位數延遲 ms, 記憶體峰值 bytes, 筆數)"""
+    timings = []
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        rows = fn()
+        timings.append((time.perf_counter() - start) * 1000)
+        del rows
+
+    gc.collect()
+    tracemalloc.start()
+    rows = fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return statistics.median(timings), peak, len(rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sessions', type=int, default=10000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    db_path = os.path.join(tempfile.mkdtemp(), 'bench.db')
+    os.environ['DATABASE_URL'] = f'sqlite:///{db_path}'
+    sys.path.insert(0, ROOT)
+    import app as m
+    m.init_database()  # 啟動時只檢查 schema，建表由 migrate-schema 負責
+
+    with m.app.app_context():
+        user = m.User(username='bench', email='bench@example.com', password_hash='x')
+        m.db.session.add(user)
+        m.db.session.flush()
+        child = m.Child(user_id=user.id, nickname='bench', gender='female', age=10, education_stage='elementary')
+        m.db.session.add(child)
+        m.db.session.flush()
+
+        rnd = random.Random(0)
+        base = datetime(2025, 1, 1, 8, 0)
+        subjects = list(m.SUBJECTS)
+        rows = []
+        for i in range(args.sessions):
+            start = base + timedelta(minutes=37 * i)
+            minutes = rnd.randint(1, 45)
+            rows.append({
+                'child_id': child.id, 'subject': rnd.choice(subjects), 'start_time': start,
+                'end_time': start + timedelta(minutes=minutes), 'duration_minutes': minutes,
+                'avg_attention': rnd.choice([None, 0.0, rnd.uniform(1, 3)])
+            })
+        m.db.session.execute(m.StudySession.__table__.insert(), rows)
+        m.db.session.commit()
+        child_id = child.id
+
+        def load_orm():
+            result = (m.StudySession.query
+                      .filter_by(child_id=child_id)
+                      .filter(m.eligible_session_filter())
+                      .order_by(m.StudySession.start_time.desc())
+                      .all())
+            m.db.session.expunge_all()  # 每次都從空的 identity map 開始，與一般 request 相同
+            return result
+
+        def load_rows():
+            return m.query_session_rows(child_id, m.eligible_session_filter(),
+                                        order_by=m.StudySession.start_time.desc())
+
+        results = [('StudySession ORM', measure(load_orm, args.repeat)),
+                   ('SessionRow', measure(load_rows, args.repeat))]
+
+    scale = 10000 / args.sessions
+    print(f'\n{args.sessions} 場次，每種方式執行 {args.repeat} 次（數值換算為每 10k 場次）')
+    print(f'{"方式":<20}{"延遲 ms":>12}{"記憶體峰值 MB":>16}{"筆數":>10}')
+    for name, (ms, peak, count) in results:
+        print(f'{name:<20}{ms * scale:>12.1f}{peak * scale / 1024 / 1024:>16.2f}{count:>10}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,299 @@
+"""
+本機 OpenAI 相容假伺服器（/v1/chat/completions，含 stream=True），供離線壓測 AI 建議相關路徑。
+
+用法：
+    python benchmarks/openai_stub.py [--port 8765] [--latency lognormal:0.0:0.5] [--tokens-per-second 40]
+        [--completion-tokens 300] [--error-rate 0.05] [--error-status 500,429]
+        [--timeout-rate 0.02] [--hang-seconds 120] [--record stub_requests.jsonl]
+
+讓應用程式與 cli_chat.py 改連此伺服器（不會檢查 API Key，但 SDK 需要有值）：
+    OPENAI_BASE_URL=http://127.0.0.1:8765/v1 OPENAI_API_KEY=stub python app.py
+
+延遲分布（第一個 token 前的等待）：const:秒、uniform:最小:最大、normal:平均:標準差、lognormal:mu:sigma、exp:平均
+逾時注入：非串流請求在回應前卡住 --hang-seconds 秒；串流請求在輸出一半後卡住。
+GET /stub/stats 回傳統計與最近的請求紀錄；POST /stub/config 可在執行中調整設定（JSON 欄位同下方 StubConfig）。
+"""
+import argparse
+import json
+import math
+import random
+import statistics
+import threading
+import time
+import uuid
+from collections import Counter, deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+SAMPLE_TEXT = '建議孩子每天固定時段學習，每二十五分鐘休息五分鐘，並在專注力較佳的時段安排較難的科目。'
+RECENT_REQUESTS = 200
+
+
+def parse_latency(spec):
+    """把延遲分布字串轉成回傳秒數（>= 0）的函式"""
+    kind, _, args = spec.partition(':')
+    values = [float(v) for v in args.split(':')] if args else []
+    samplers = {
+        'const': lambda rnd: values[0],
+        'uniform': lambda rnd: rnd.uniform(values[0], values[1]),
+        'normal': lambda rnd: rnd.gauss(values[0], values[1]),
+        'lognormal': lambda rnd: rnd.lognormvariate(values[0], values[1]),
+        'exp': lambda rnd: rnd.expovariate(1 / values[0]) if values[0] > 0 else 0.0,
+    }
+    if kind not in samplers:
+        raise ValueError(f'未知的延遲分布: {spec}')
+    sampler = samplers[kind]
+    return lambda rnd: max(0.0, sampler(rnd))
+
+
+class StubConfig:
+    """假伺服器設定；欄位皆可由 POST /stub/config 更新"""
+
+    FIELDS = ('latency', 'tokens_per_second', 'completion_tokens', 'error_rate', 'error_status',
+              'timeout_rate', 'hang_seconds')
+
+    def __init__(self, latency='const:0', tokens_per_second=0.0, completion_tokens=200, error_rate=0.0,
+                 error_status=(500,), timeout_rate=0.0, hang_seconds=120.0, record=None, seed=None):
+        self.latency = latency
+        self.tokens_per_second = tokens_per_second
+        self.completion_tokens = completion_tokens
+        self.error_rate = error_rate
+        self.error_status = tuple(error_status)
+        self.timeout_rate = timeout_rate
+        self.hang_seconds = hang_seconds
+        self.record = record
+        self.rnd = random.Random(seed)
+        self.sample_latency = parse_latency(latency)
+
+    def update(self, data):
+        for name in self.FIELDS:
+            if name in data:
+                value = data[name]
+                setattr(self, name, tuple(value) if name == 'error_status' else value)
+        self.sample_latency = parse_latency(self.latency)
+
+    def as_dict(self):
+        return {name: getattr(self, name) for name in self.FIELDS}
+
+
+class StubState:
+    """請求紀錄與統計（所有 handler 執行緒共用）"""
+
+    def __init__(self, record_path=None):
+        self._lock = threading.Lock()
+        self.record_path = record_path
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.outcomes = Counter()
+        self.durations = []
+        self.recent = deque(maxlen=RECENT_REQUESTS)
+
+    def begin(self):
+        with self._lock:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+            return self.in_flight
+
+    def finish(self, record):
+        line = json.dumps(record, ensure_ascii=False)
+        with self._lock:
+            self.in_flight -= 1
+            self.outcomes[record['outcome']] += 1
+            self.durations.append(record['duration_s'])
+            self.recent.append(record)
+            if self.record_path:
+                with open(self.record_path, 'a', encoding='utf-8') as f:
+                    f.write(line + '\n')
+
+    def snapshot(self):
+        with self._lock:
+            durations = sorted(self.durations)
+            data = {
+                'requests': len(durations),
+                'in_flight': self.in_flight,
+                'max_in_flight': self.max_in_flight,
+                'outcomes': dict(self.outcomes),
+                'recent': list(self.recent),
+            }
+        if durations:
+            data['duration_p50_s'] = round(statistics.median(durations), 3)
+            data['duration_p95_s'] = round(durations[min(len(durations) - 1, math.ceil(len(durations) * 0.95) - 1)], 3)
+        return data
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # 支援 keep-alive，才量得到用戶端連線池的效果
+
+    def log_message(self, format, *args):
+        pass
+
+    @property
+    def config(self):
+        return self.server.config
+
+    @property
+    def state(self):
+        return self.server.state
+
+    def send_json(self, status, data, headers=None):
+        body = json.dumps(data, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def read_json(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        return json.loads(self.rfile.read(length) or b'{}')
+
+    def do_GET(self):
+        if self.path == '/stub/stats':
+            self.send_json(200, self.state.snapshot())
+        elif self.path.rstrip('/').endswith('/models'):
+            self.send_json(200, {'object': 'list', 'data': [{'id': 'gpt-4o-mini', 'object': 'model', 'owned_by': 'stub'}]})
+        else:
+            self.send_json(404, {'error': {'message': 'not found', 'type': 'invalid_request_error'}})
+
+    def do_POST(self):
+        if self.path == '/stub/config':
+            self.config.update(self.read_json())
+            self.send_json(200, self.config.as_dict())
+        elif self.path.rstrip('/').endswith('/chat/completions'):
+            self.chat_completions()
+        else:
+            self.send_json(404, {'error': {'message': 'not found', 'type': 'invalid_request_error'}})
+
+    def chat_completions(self):
+        started = time.monotonic()
+        concurrent = self.state.begin()
+        body = self.read_json()
+        cfg = self.config
+        rnd = cfg.rnd
+        stream = bool(body.get('stream'))
+        tokens = min(int(body.get('max_tokens') or cfg.completion_tokens), cfg.completion_tokens)
+        latency = cfg.sample_latency(rnd)
+        roll = rnd.random()
+        record = {
+            'ts': time.time(), 'model': body.get('model'), 'stream': stream,
+            'messages': len(body.get('messages') or []), 'max_tokens': body.get('max_tokens'),
+            'concurrent': concurrent, 'latency_s': round(latency, 3), 'completion_tokens': 0,
+        }
+        try:
+            time.sleep(latency)
+            if roll < cfg.error_rate:
+                status = rnd.choice(cfg.error_status)
+                record['outcome'] = f'error:{status}'
+                headers = {'Retry-After': '1'} if status == 429 else None
+                self.send_json(status, {'error': {'message': f'stub injected error {status}', 'type': 'server_error'}}, headers)
+            elif roll < cfg.error_rate + cfg.timeout_rate and not stream:
+                record['outcome'] = 'timeout'
+                time.sleep(cfg.hang_seconds)
+                self.close_connection = True
+            elif stream:
+                stall = roll < cfg.error_rate + cfg.timeout_rate
+                record['outcome'] = 'timeout' if stall else 'ok'
+                record['completion_tokens'] = self.write_stream(body, tokens, stall)
+            else:
+                time.sleep(tokens / cfg.tokens_per_second if cfg.tokens_per_second else 0)
+                record['outcome'] = 'ok'
+                record['completion_tokens'] = tokens
+                self.send_json(200, self.completion(body, tokens))
+        except (BrokenPipeError, ConnectionResetError):
+            record['outcome'] = 'disconnect'
+            self.close_connection = True
+        finally:
+            record['duration_s'] = round(time.monotonic() - started, 3)
+            self.state.finish(record)
+
+    @staticmethod
+    def completion_text(tokens):
+        return ''.join(SAMPLE_TEXT[i % len(SAMPLE_TEXT)] for i in range(tokens))
+
+    def completion(self, body, tokens):
+        return {
+            'id': f'chatcmpl-stub-{uuid.uuid4().hex[:12]}', 'object': 'chat.completion',
+            'created': int(time.time()), 'model': body.get('model') or 'stub',
+            'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': self.completion_text(tokens)},
+                         'finish_reason': 'stop'}],
+            'usage': {'prompt_tokens': 0, 'completion_tokens': tokens, 'total_tokens': tokens},
+        }
+
+    def write_chunk(self, data):
+        self.wfile.write(b'%x\r\n%s\r\n' % (len(data), data))
+        self.wfile.flush()
+
+    def write_stream(self, body, tokens, stall):
+        """以 SSE 逐 token 輸出；stall 時輸出一半後停住（模擬上游卡住）。回傳已輸出的 token 數"""
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        chunk_id = f'chatcmpl-stub-{uuid.uuid4().hex[:12]}'
+        interval = 1 / self.config.tokens_per_second if self.config.tokens_per_second else 0
+        text = self.completion_text(tokens)
+        for i, piece in enumerate(text):
+            if stall and i == tokens // 2:
+                time.sleep(self.config.hang_seconds)
+                self.close_connection = True
+                return i
+            chunk = {'id': chunk_id, 'object': 'chat.completion.chunk', 'created': int(time.time()),
+                     'model': body.get('model') or 'stub',
+                     'choices': [{'index': 0, 'delta': {'content': piece}, 'finish_reason': None}]}
+            self.write_chunk(f'data: {json.dumps(chunk, ensure_ascii=False)}\n\n'.encode('utf-8'))
+            if interval:
+                time.sleep(interval)
+        self.write_chunk(b'data: [DONE]\n\n')
+        self.wfile.write(b'0\r\n\r\n')
+        return tokens
+
+
+def make_server(config, host='127.0.0.1', port=0):
+    server = ThreadingHTTPServer((host, port), StubHandler)
+    server.daemon_threads = True
+    server.config = config
+    server.state = StubState(config.record)
+    return server
+
+
+def start_in_thread(config, host='127.0.0.1', port=0):
+    """在背景執行緒啟動假伺服器（供 benchmark 使用）；回傳 (server, base_url)"""
+    server = make_server(config, host, port)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f'http://{host}:{server.server_address[1]}/v1'
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--latency', default='const:0', help='第一個 token 前的延遲分布')
+    parser.add_argument('--tokens-per-second', type=float, default=0.0, help='輸出速度；0 表示不限速')
+    parser.add_argument('--completion-tokens', type=int, default=200)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--error-status', default='500', help='注入錯誤時隨機選用的狀態碼，逗號分隔')
+    parser.add_argument('--timeout-rate', type=float, default=0.0)
+    parser.add_argument('--hang-seconds', type=float, default=120.0)
+    parser.add_argument('--record', help='每個請求寫一行 JSON 到此檔案')
+    parser.add_argument('--seed', type=int)
+    args = parser.parse_args()
+
+    config = StubConfig(latency=args.latency, tokens_per_second=args.tokens_per_second,
+                        completion_tokens=args.completion_tokens, error_rate=args.error_rate,
+                        error_status=[int(s) for s in args.error_status.split(',')],
+                        timeout_rate=args.timeout_rate, hang_seconds=args.hang_seconds,
+                        record=args.record, seed=args.seed)
+    server = make_server(config, args.host, args.port)
+    print(f'OpenAI stub 監聽 http://{args.host}:{server.server_address[1]}/v1（Ctrl+C 結束）')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print(json.dumps({k: v for k, v in server.state.snapshot().items() if k != 'recent'}, ensure_ascii=False))
+
+
+if __name__ == '__main__':
+    main()
@@ -5,7 +5,9 @@ from openai import OpenAI
 # 讀 .env（若沒有也沒關係，會直接讀系統環境變數）
 load_dotenv()
 
-client = OpenAI()  # 預設會從 OPENAI_API_KEY 讀金鑰
+# 預設會從 OPENAI_API_KEY 讀金鑰；設定 OPENAI_BASE_URL 可改連 OpenAI 相容服務
+# （例如 benchmarks/openai_stub.py：OPENAI_BASE_URL=http://127.0.0.1:8765/v1 OPENAI_API_KEY=stub）
+client = OpenAI(base_url=os.environ.get("OPENAI_BASE_URL") or None)
 
 # 初始系統行為；你可改成你的專屬助理風格
 SYSTEM_PROMPT = "You are a helpful assistant."
@@ -28,6 +28,16 @@
   let noFaceWarningCount = 0;
   let multipleFaceWarningCount = 0;
 
+  // 批次模式：情緒樣本先緩衝，每 EMOTION_FLUSH_SECONDS 秒送一次 /api/emotion/batch
+  // 由後端 EMOTION_BATCH_MODE 設定（study.html 寫入 window.EMOTION_BATCH_MODE），false 時每個樣本送一次 /record_emotion
+  const EMOTION_BATCH_MODE = window.EMOTION_BATCH_MODE !== false;
+  const EMOTION_FLUSH_SECONDS = 10;
+  let emotionSessionId = null;
+  let nextSeq = 0;  // 每個場次遞增的樣本序號，後端以 (session_id, seq) 去重，重送安全；存在 sessionStorage，重新開始偵測時接續
+  let pendingSamples = [];
+  let flushInterval = null;
+  let flushing = null;
+
   const EMOTION_LABELS = ['anger', 'disgust', 'fear', 'happy', 'neutral', 'sad', 'surprise', 'no_emotion'];
   const EMOTION_LABELS_ZH = {
     anger: '生氣', disgust: '厭惡', fear: '恐懼', happy: '開心',
@@ -47,6 +57,29 @@
   /* ========= 工具函式 ========= */
   const sleep = (ms) => new Promise(r => setTimeout(r, ms));
 
+  // 同一場次重新開始偵測時接續先前的序號，否則新樣本會與已送出的 (session_id, seq) 相同而被當成重送丟棄
+  function seqStorageKey(sessionId) {
+    return `emotionSeq:${sessionId}`;
+  }
+
+  function loadNextSeq(sessionId) {
+    try {
+      return parseInt(sessionStorage.getItem(seqStorageKey(sessionId)), 10) || 0;
+    } catch (err) {
+      return 0;  // 無法使用 sessionStorage（例如隱私模式）
+    }
+  }
+
+  function takeSeq() {
+    const seq = nextSeq++;
+    try {
+      sessionStorage.setItem(seqStorageKey(emotionSessionId), String(nextSeq));
+    } catch (err) {
+      // 無法保存時只影響同一場次重新開始偵測的情況
+    }
+    return seq;
+  }
+
   function ready(fn) {
     if (document.readyState === 'loading') {
       document.addEventListener('DOMContentLoaded', fn);
@@ -106,6 +139,10 @@
     // 暴露控制函式
     window.startDetection = startDetection;
     window.stopDetection = stopDetection;
+    window.flushEmotions = flushEmotions;
+
+    // 離開頁面時用 sendBeacon 送出尚未上傳的樣本
+    window.addEventListener('pagehide', beaconEmotions);
     
     // ✅ 新增：暴露相機回調函式給 study.html
     window.onCameraReady = onCameraReady;
@@ -275,7 +312,7 @@
   }
 
   /* ========= 控制函式（移除 toggleDetection）========= */
-  function startDetection() {
+  function startDetection(sessionId) {
     console.log('[script.js] 開始偵測');
 
     if (!faceDetectionModel || !emotionModel) {
@@ -302,6 +339,13 @@
     detectionCount = 0;
     validDetections = 0;
 
+    emotionSessionId = sessionId || null;
+    nextSeq = loadNextSeq(emotionSessionId);
+    pendingSamples = [];
+    if (EMOTION_BATCH_MODE) {
+      flushInterval = setInterval(flushEmotions, EMOTION_FLUSH_SECONDS * 1000);
+    }
+
     startFaceDetection();
   }
 
@@ -311,7 +355,12 @@
       clearInterval(detectionInterval);
       detectionInterval = null;
     }
+    if (flushInterval) {
+      clearInterval(flushInterval);
+      flushInterval = null;
+    }
     console.log('[script.js] 偵測已停止');
+    return flushEmotions();
   }
 
   /* ========= 人臉偵測主迴圈 ========= */
@@ -470,21 +519,79 @@
       confidence: emo.confidence
     });
 
+    if (EMOTION_BATCH_MODE) {
+      pendingSamples.push({
+        seq: takeSeq(),
+        timestamp: Date.now(),
+        emotion: emo.emotion,
+        attention_level: calcAttention(emo.emotion),
+        confidence: emo.confidence
+      });
+      return;
+    }
+
     try {
-      await fetch('/record_emotion', {
+      const res = await fetch('/record_emotion', {
         method: 'POST',
         headers: { 'Content-Type': 'application/json' },
         body: JSON.stringify({
+          seq: takeSeq(),
           emotion: emo.emotion,
           attention_level: calcAttention(emo.emotion),
           confidence: emo.confidence
         })
       });
+      if (!res.ok) {
+        console.warn(`[script.js] 記錄情緒失敗（HTTP ${res.status}）`);
+      }
     } catch (err) {
       console.error('[script.js] 記錄情緒失敗：', err);
     }
   }
 
+  /* ========= 批次上傳緩衝的情緒樣本 ========= */
+  async function flushEmotions() {
+    // 同一時間只有一個上傳；結束學習時會等待進行中的上傳完成
+    if (flushing) await flushing;
+    if (!pendingSamples.length) return;
+
+    const samples = pendingSamples;
+    pendingSamples = [];
+    flushing = (async () => {
+      try {
+        const res = await fetch('/api/emotion/batch', {
+          method: 'POST',
+          headers: { 'Content-Type': 'application/json' },
+          body: JSON.stringify({ session_id: emotionSessionId, samples })
+        });
+        if (res.status >= 500) throw new Error(`HTTP ${res.status}`);
+        const result = await res.json().catch(() => ({}));
+        if (!res.ok) {
+          // 4xx（場次已結束、格式錯誤等）重送也不會成功，記錄後捨棄
+          console.warn(`[script.js] 伺服器拒收 ${samples.length} 筆情緒樣本（HTTP ${res.status}）：`, result.error);
+        } else if (result.rejected) {
+          console.warn(`[script.js] ${result.rejected} 筆情緒樣本格式錯誤，已略過`);
+        }
+      } catch (err) {
+        console.error('[script.js] 批次記錄情緒失敗，下次重送：', err);
+        pendingSamples = samples.concat(pendingSamples);
+      }
+    })();
+    try {
+      await flushing;
+    } finally {
+      flushing = null;
+    }
+  }
+
+  function beaconEmotions() {
+    if (!EMOTION_BATCH_MODE || !pendingSamples.length || !navigator.sendBeacon) return;
+    const body = JSON.stringify({ session_id: emotionSessionId, samples: pendingSamples });
+    if (navigator.sendBeacon('/api/emotion/batch', new Blob([body], { type: 'application/json' }))) {
+      pendingSamples = [];
+    }
+  }
+
   /* ========= 更新統計數據 ========= */
   function updateStatistics() {
     const avgEl = document.getElementById('avgAttention');
@@ -0,0 +1,87 @@
+"""
+pytest 共用設定：匯入 app 前先把資料庫與報告目錄指到暫存目錄，每個測試重建資料表。
+
+背景工作改在行程內執行（報告排版、密碼雜湊），情緒緩衝不自動 flush，由測試自行呼叫。
+"""
+import os
+import sys
+import tempfile
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+WORKDIR = tempfile.mkdtemp(prefix='app-tests-')
+
+os.environ.update({
+    'DATABASE_URL': f'sqlite:///{os.path.join(WORKDIR, "test.db")}',
+    'REPORTS_DIR': os.path.join(WORKDIR, 'reports'),
+    'REPORT_RENDER_MODE': 'thread',
+    'REPORT_PRERENDER_ON_SESSION_END': 'false',
+    'PASSWORD_HASH_MODE': 'thread',
+    'BCRYPT_LOG_ROUNDS': '4',
+    'EMOTION_BUFFER_FLUSH_SECONDS': '3600',
+    'AI_SUGGESTIONS_ENABLED': 'false',
+    'OPENAI_API_KEY': '',
+})
+sys.path.insert(0, ROOT)
+
+import app as app_module  # noqa: E402
+
+app_module.app.config.update(TESTING=True, SESSION_COOKIE_SECURE=False)
+app_module.init_database()  # 啟動時只檢查 schema，建表與 migration 由 migrate-schema 負責
+
+
+@pytest.fixture
+def m():
+    """app 模組；每個測試使用空白的資料表與情緒緩衝"""
+    with app_module.app.app_context():
+        app_module.db.drop_all()
+        app_module.db.create_all()
+    app_module.emotion_buffer._rows.clear()
+    yield app_module
+    app_module.emotion_buffer._rows.clear()
+    with app_module.app.app_context():
+        app_module.db.session.remove()
+
+
+@pytest.fixture
+def client(m):
+    """已登入並選好小孩的 test client；client.child_id 為該小孩的 id"""
+    client = m.app.test_client()
+    client.post('/register', json={'username': 'alice', 'email': 'alice@example.com', 'password': 'secret1'})
+    assert client.post('/login', json={'username': 'alice', 'password': 'secret1'}).status_code == 200
+    response = client.post('/create_child', json={'nickname': '小明', 'gender': 'male', 'age': 9,
+                                                  'education_stage': 'elementary'})
+    client.child_id = response.json['child_id']
+    client.get(f'/select_child/{client.child_id}')
+    return client
+
+
+@pytest.fixture
+def start_session(client):
+    def start(subject='math'):
+        response = client.post('/api/session/start', json={'subject': subject})
+        assert response.json['ok']
+        return response.json['session_id']
+    return start
+
+
+@pytest.fixture
+def end_session(m, client):
+    """把場次開始時間往前調 minutes 分鐘後結束（未滿 MIN_SESSION_MINUTES 的場次不計入彙總）"""
+    def end(session_id, minutes=5):
+        with m.app.app_context():
+            s = m.db.session.get(m.StudySession, session_id)
+            s.start_time -= m.timedelta(minutes=minutes)
+            m.db.session.commit()
+        assert client.post('/api/session/end', json={'session_id': session_id}).json['ok']
+    return end
+
+
+@pytest.fixture
+def reports(m, monkeypatch, tmp_path):
+    """每個測試使用新的報告目錄與排版佇列（執行緒模式），不沿用其他測試的報告或工作"""
+    monkeypatch.setattr(m, 'report_store', m.ReportStore(str(tmp_path / 'reports'), m.REPORTS_MAX_BYTES))
+    queue = m.ReportRenderQueue(1, 'thread')
+    monkeypatch.setattr(m, 'report_render_queue', queue)
+    return queue
@@ -0,0 +1,91 @@
+"""AI 建議快取：TTL 過期、超過上限時淘汰最久未使用的項目，錯誤只回滾自己的 SAVEPOINT"""
+from types import SimpleNamespace
+
+import pytest
+
+
+@pytest.fixture
+def cache(m):
+    return m.AISuggestionResponseCache(ttl_seconds=3600, max_entries=2)
+
+
+def backdate(m, key, **fields):
+    entry = m.db.session.get(m.AISuggestionCache, key)
+    for name, seconds in fields.items():
+        setattr(entry, name, getattr(entry, name) - m.timedelta(seconds=seconds))
+    m.db.session.commit()
+
+
+def test_key_depends_on_model_messages_and_params(m):
+    messages = [{'role': 'user', 'content': '摘要'}]
+    key = m.AISuggestionResponseCache.make_key('gpt', messages, temperature=0.7)
+    assert key == m.AISuggestionResponseCache.make_key('gpt', list(messages), temperature=0.7)
+    assert key != m.AISuggestionResponseCache.make_key('gpt', messages, temperature=0.2)
+    assert key != m.AISuggestionResponseCache.make_key('gpt', [{'role': 'user', 'content': '其他'}], temperature=0.7)
+
+
+def test_hit_and_miss_are_counted(m, cache):
+    with m.app.app_context():
+        assert cache.get('a') is None
+        cache.put('a', 'gpt', '多休息')
+        m.db.session.commit()
+        assert cache.get('a') == '多休息'
+        m.db.session.commit()
+        assert m.db.session.get(m.AISuggestionCache, 'a').hit_count == 1
+    assert cache.snapshot()['hits'] == 1
+    assert cache.snapshot()['misses'] == 1
+    assert cache.snapshot()['hit_rate'] == 0.5
+
+
+def test_expired_entry_is_a_miss(m, cache):
+    with m.app.app_context():
+        cache.put('a', 'gpt', '多休息')
+        m.db.session.commit()
+        backdate(m, 'a', created_at=7200)
+        assert cache.get('a') is None
+        m.db.session.commit()
+        assert m.db.session.get(m.AISuggestionCache, 'a') is None
+    assert cache.stats['expired'] == 1
+
+
+def test_least_recently_used_entry_is_evicted(m, cache):
+    with m.app.app_context():
+        cache.put('a', 'gpt', 'A')
+        cache.put('b', 'gpt', 'B')
+        m.db.session.commit()
+        backdate(m, 'a', last_used_at=60)
+        backdate(m, 'b', last_used_at=120)
+        assert cache.get('b') == 'B'  # b 變成最近使用
+        cache.put('c', 'gpt', 'C')
+        m.db.session.commit()
+        assert {k for (k,) in m.db.session.query(m.AISuggestionCache.key)} == {'b', 'c'}
+    assert cache.stats['evicted'] == 1
+
+
+def test_cache_error_keeps_the_callers_changes(m, client, cache):
+    with m.app.app_context():
+        child = m.db.session.get(m.Child, client.child_id)
+        child.ai_suggestion = '呼叫端的變更'
+        cache.put('a', 'gpt', None)  # response 不可為 NULL：只回滾快取的 SAVEPOINT
+        m.db.session.commit()
+        assert m.db.session.get(m.AISuggestionCache, 'a') is None
+    with m.app.app_context():
+        assert m.db.session.get(m.Child, client.child_id).ai_suggestion == '呼叫端的變更'
+    assert cache.stats['errors'] == 1
+
+
+def test_request_ai_suggestion_calls_openai_once_per_prompt(m, monkeypatch):
+    calls = []
+
+    def completion(messages):
+        calls.append(messages)
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=' 多休息 '))])
+
+    monkeypatch.setattr(m, 'openai_chat_completion', completion)
+    monkeypatch.setattr(m, 'AI_CACHE_ENABLED', True)
+    messages = [{'role': 'user', 'content': '摘要'}]
+    with m.app.app_context():
+        assert m.request_ai_suggestion(messages) == '多休息'
+        m.db.session.commit()
+        assert m.request_ai_suggestion(messages) == '多休息'
+    assert len(calls) == 1
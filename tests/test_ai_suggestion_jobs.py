@@ -0,0 +1,86 @@
+"""AI 建議背景工作：成功時寫回小孩的建議；失敗或小孩已刪除時工作標為 failed，保留原本的建議"""
+import pytest
+
+
+@pytest.fixture
+def queue(m, monkeypatch):
+    """不啟動執行緒池的佇列：排入的工作記在 queue.submitted，由測試自行呼叫 _run"""
+    queue = m.AISuggestionJobQueue(1)
+    queue.submitted = []
+    monkeypatch.setattr(queue, '_submit', queue.submitted.append)
+    monkeypatch.setattr(m, 'has_openai_client', lambda: True)
+    return queue
+
+
+def add_job(m, child_id, job_id='job1'):
+    with m.app.app_context():
+        m.db.session.add(m.AISuggestionJob(id=job_id, child_id=child_id, status='queued', attempts=0,
+                                           created_at=m.datetime.utcnow()))
+        m.db.session.commit()
+    return job_id
+
+
+def set_suggestion(m, child_id, text):
+    with m.app.app_context():
+        m.db.session.get(m.Child, child_id).ai_suggestion = text
+        m.db.session.commit()
+
+
+def load(m, job_id, child_id):
+    with m.app.app_context():
+        job = m.db.session.get(m.AISuggestionJob, job_id)
+        child = m.db.session.get(m.Child, child_id)
+        return (job.status, job.result, job.attempts), (child.ai_suggestion if child else None)
+
+
+def test_job_stores_the_suggestion(m, client, queue, monkeypatch):
+    monkeypatch.setattr(m, 'request_ai_suggestion', lambda messages: '多休息')
+    job_id = add_job(m, client.child_id)
+    queue._run(job_id)
+    assert load(m, job_id, client.child_id) == (('done', '多休息', 1), '多休息')
+    assert queue.stats['completed'] == 1
+
+
+def test_failed_job_keeps_the_previous_suggestion(m, client, queue, monkeypatch):
+    def fail(messages):
+        raise TimeoutError('openai timeout')
+
+    monkeypatch.setattr(m, 'request_ai_suggestion', fail)
+    set_suggestion(m, client.child_id, '舊的建議')
+    job_id = add_job(m, client.child_id)
+    queue._run(job_id)
+    assert load(m, job_id, client.child_id) == (('failed', m.FAILURE_TEXT, 1), '舊的建議')
+    assert queue.stats['failed'] == 1
+
+
+def test_job_fails_without_openai_client(m, client, queue, monkeypatch):
+    monkeypatch.setattr(m, 'has_openai_client', lambda: False)
+    set_suggestion(m, client.child_id, '舊的建議')
+    job_id = add_job(m, client.child_id)
+    queue._run(job_id)
+    assert load(m, job_id, client.child_id) == (('failed', m.FAILURE_TEXT, 1), '舊的建議')
+
+
+def test_job_for_a_missing_child_fails_cleanly(m, client, queue):
+    job_id = add_job(m, client.child_id + 100)
+    queue._run(job_id)
+    assert load(m, job_id, client.child_id + 100)[0][0] == 'failed'
+    queue._run('no-such-job')  # 未認領到工作時直接結束
+    assert queue.stats['failed'] == 1
+
+
+def test_claimed_job_runs_once(m, client, queue, monkeypatch):
+    calls = []
+    monkeypatch.setattr(m, 'request_ai_suggestion', lambda messages: calls.append(1) or '多休息')
+    job_id = add_job(m, client.child_id)
+    queue._run(job_id)
+    queue._run(job_id)
+    assert len(calls) == 1
+
+
+def test_enqueue_reuses_the_active_job(m, client, queue):
+    with m.app.app_context():
+        first = queue.enqueue(client.child_id).id
+        second = queue.enqueue(client.child_id).id
+    assert first == second
+    assert queue.submitted == [first]
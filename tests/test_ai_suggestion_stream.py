@@ -0,0 +1,65 @@
+"""AI 建議串流（SSE）：完成後寫回小孩的建議；串流期間小孩被刪除時正常結束、不寫回"""
+import json
+
+import pytest
+from sqlalchemy import text
+
+
+@pytest.fixture
+def stream(m, monkeypatch):
+    """開啟串流並以 deltas 取代 OpenAI；回傳 (status, [(event, data)])"""
+    monkeypatch.setattr(m, 'AI_STREAM_ENABLED', True)
+    monkeypatch.setattr(m, 'AI_CACHE_ENABLED', False)
+    monkeypatch.setattr(m, 'has_openai_client', lambda: True)
+
+    def run(client, deltas):
+        monkeypatch.setattr(m, 'openai_chat_stream', lambda messages: (d for d in deltas()))
+        response = client.post('/api/ai_suggestion/stream', json={})
+        events = []
+        for block in response.get_data(as_text=True).split('\n\n'):
+            lines = dict(line.split(': ', 1) for line in block.splitlines() if not line.startswith(':'))
+            if 'data' in lines:
+                events.append((lines.get('event'), json.loads(lines['data'])))
+        return response.status_code, events
+    return run
+
+
+def suggestion(m, child_id):
+    with m.app.app_context():
+        child = m.db.session.get(m.Child, child_id)
+        return child.ai_suggestion if child else None
+
+
+def test_stream_stores_the_full_text(m, client, stream):
+    status, events = stream(client, lambda: ['多休息', '，多喝水'])
+    assert status == 200
+    assert events == [(None, {'delta': '多休息'}), (None, {'delta': '，多喝水'}),
+                      ('done', {'ai_suggestion': '多休息，多喝水'})]
+    assert suggestion(m, client.child_id) == '多休息，多喝水'
+
+
+def test_child_deleted_mid_stream_ends_cleanly(m, client, stream):
+    def deltas():
+        yield '多休息'
+        with m.db.engine.begin() as conn:  # 其他 request 刪除了小孩檔案
+            conn.execute(text('DELETE FROM child WHERE id = :id'), {'id': client.child_id})
+        yield '，多喝水'
+
+    status, events = stream(client, deltas)
+    assert status == 200
+    assert events[-1] == ('done', {'ai_suggestion': '多休息，多喝水'})
+    assert suggestion(m, client.child_id) is None
+
+
+def test_stream_failure_keeps_the_previous_suggestion(m, client, stream):
+    with m.app.app_context():
+        m.db.session.get(m.Child, client.child_id).ai_suggestion = '舊的建議'
+        m.db.session.commit()
+
+    def deltas():
+        yield '多'
+        raise TimeoutError('openai timeout')
+
+    _, events = stream(client, deltas)
+    assert events[-1] == ('done', {'ai_suggestion': m.FAILURE_TEXT})
+    assert suggestion(m, client.child_id) == '舊的建議'
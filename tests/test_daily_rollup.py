@@ -0,0 +1,55 @@
+"""每日彙總（行事曆）與科目彙總使用同一個場次條件，增減要與由場次重算的結果一致"""
+from datetime import date
+
+
+def daily(m, child_id):
+    with m.app.app_context():
+        return {(r.study_date, r.subject): (r.session_count, r.total_minutes, r.best_attention)
+                for r in m.ChildDailySubjectRollup.query.filter_by(child_id=child_id)}
+
+
+def rebuilt(m, child_id):
+    with m.app.app_context():
+        m.rebuild_daily_rollups(child_id)
+        m.db.session.commit()
+    return daily(m, child_id)
+
+
+def record(client, session_id, attention):
+    client.post('/api/emotion/batch', json={'session_id': session_id, 'samples': [
+        {'seq': 0, 'emotion': 'neutral', 'attention_level': attention, 'confidence': 0.5}]})
+
+
+def test_short_session_is_not_counted(m, client, start_session, end_session):
+    session_id = start_session('math')
+    end_session(session_id, minutes=0)
+    assert daily(m, client.child_id) == {}  # 未滿 MIN_SESSION_MINUTES，與科目彙總一致
+    assert rebuilt(m, client.child_id) == {}
+
+
+def test_sessions_on_the_same_day_are_combined(m, client, start_session, end_session):
+    first = start_session('math')
+    record(client, first, 3)
+    end_session(first, minutes=10)
+    second = start_session('math')
+    record(client, second, 1)
+    end_session(second, minutes=20)
+
+    rows = daily(m, client.child_id)
+    assert [(count, minutes, best) for count, minutes, best in rows.values()] == [(2, 30, 3.0)]
+    assert all(isinstance(d, date) for d, _ in rows)
+    assert rows == rebuilt(m, client.child_id)
+
+
+def test_deleting_the_best_session_recomputes_best_attention(m, client, start_session, end_session):
+    best = start_session('math')
+    record(client, best, 3)
+    end_session(best, minutes=10)
+    other = start_session('math')
+    record(client, other, 1)
+    end_session(other, minutes=5)
+
+    assert client.post(f'/delete_session/{best}').json['success']
+    rows = daily(m, client.child_id)
+    assert [(count, minutes, best) for count, minutes, best in rows.values()] == [(1, 5, 1.0)]
+    assert rows == rebuilt(m, client.child_id)
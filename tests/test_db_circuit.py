@@ -0,0 +1,51 @@
+"""資料庫斷路器：只有取不到連線才計入失敗，連續失敗達門檻後回 503，成功取得連線即恢復"""
+import pytest
+from sqlalchemy import create_engine, text
+from sqlalchemy.exc import OperationalError
+
+
+@pytest.fixture
+def circuit(m, monkeypatch):
+    breaker = m.DbCircuitBreaker(failure_threshold=2, open_seconds=60)
+    monkeypatch.setattr(m, 'db_circuit', breaker)
+    return breaker
+
+
+def fail_to_connect(times):
+    engine = create_engine('sqlite:////nonexistent-dir/unreachable.db')
+    for _ in range(times):
+        with pytest.raises(OperationalError):
+            engine.connect()
+    engine.dispose()
+
+
+def test_query_errors_do_not_trip_the_breaker(m, circuit):
+    with m.app.app_context():
+        for _ in range(3):
+            with pytest.raises(OperationalError):
+                m.db.session.execute(text('SELECT * FROM no_such_table'))
+            m.db.session.rollback()
+    assert circuit.snapshot()['consecutive_failures'] == 0
+    assert not circuit.is_open()
+
+
+def test_connect_failures_open_the_breaker(m, client, circuit):
+    fail_to_connect(1)
+    assert not circuit.is_open()
+    fail_to_connect(1)
+    assert circuit.is_open()
+    assert circuit.snapshot()['trips'] == 1
+
+    response = client.get('/dashboard')
+    assert response.status_code == 503
+    assert not response.json['success']
+    assert client.get('/health').status_code == 200  # 不受斷路器限制
+
+
+def test_successful_checkout_closes_the_breaker(m, circuit):
+    fail_to_connect(2)
+    assert circuit.is_open()
+    with m.app.app_context():
+        m.db.session.execute(text('SELECT 1'))
+    assert not circuit.is_open()
+    assert circuit.snapshot()['consecutive_failures'] == 0
@@ -0,0 +1,41 @@
+"""批次情緒寫入 /api/emotion/batch：格式錯誤的樣本略過並計數，整批都錯回 400"""
+
+
+def test_batch_writes_samples_and_updates_totals(m, client, start_session):
+    session_id = start_session()
+    response = client.post('/api/emotion/batch', json={'session_id': session_id, 'samples': [
+        {'emotion': 'happy', 'attention_level': 3, 'confidence': 0.9},
+        {'emotion': 'neutral', 'attention_level': 1, 'confidence': 0.5},
+    ]})
+    assert response.json == {'ok': True, 'accepted': 2, 'duplicates': 0, 'rejected': 0}
+    with m.app.app_context():
+        s = m.db.session.get(m.StudySession, session_id)
+        assert (s.emotion_count, s.attention_sum) == (2, 4.0)
+
+
+def test_invalid_samples_are_skipped(client, start_session):
+    session_id = start_session()
+    response = client.post('/api/emotion/batch', json={'session_id': session_id, 'samples': [
+        {'emotion': 'neutral', 'attention_level': 2, 'confidence': 0.5},
+        {'emotion': 'bored', 'attention_level': 2, 'confidence': 0.5},
+        {'emotion': 'neutral', 'attention_level': 9, 'confidence': 0.5},
+        {'emotion': 'neutral', 'attention_level': 2, 'confidence': 'high'},
+    ]})
+    assert response.json['accepted'] == 1
+    assert response.json['rejected'] == 3
+
+
+def test_all_invalid_samples_return_400(client, start_session):
+    session_id = start_session()
+    response = client.post('/api/emotion/batch', json={'session_id': session_id, 'samples': [
+        {'emotion': 'neutral', 'attention_level': 'high', 'confidence': 'nan'}]})
+    assert response.status_code == 400
+    assert response.json == {'ok': False, 'error': 'invalid samples', 'rejected': 1}
+
+
+def test_batch_rejects_ended_session(client, start_session, end_session):
+    session_id = start_session()
+    end_session(session_id)
+    response = client.post('/api/emotion/batch', json={'session_id': session_id, 'samples': [
+        {'emotion': 'neutral', 'attention_level': 2, 'confidence': 0.5}]})
+    assert response.status_code == 409
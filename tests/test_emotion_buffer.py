@@ -0,0 +1,150 @@
+"""情緒資料 write-behind 緩衝：flush 失敗時放回佇列、容量上限，以及只丟棄寫不進去的壞資料"""
+from sqlalchemy import event
+from sqlalchemy.exc import IntegrityError, OperationalError, ProgrammingError
+
+
+def make_row(m, session_id, seq, attention=2, **overrides):
+    row = {'session_id': session_id, 'timestamp': m.get_taiwan_now(), 'emotion': 'neutral',
+           'attention_level': attention, 'confidence': 0.5, 'seq': seq}
+    row.update(overrides)
+    return row
+
+
+def stored_rows(m, session_id):
+    with m.app.app_context():
+        s = m.db.session.get(m.StudySession, session_id)
+        count = m.EmotionData.query.filter_by(session_id=session_id).count()
+        return count, s.emotion_count, s.attention_sum
+
+
+def test_flush_requeues_rows_on_operational_error(m, start_session, monkeypatch):
+    session_id = start_session()
+    buffer = m.EmotionWriteBuffer(flush_rows=1000, flush_seconds=3600, capacity=100)
+    for seq in range(5):
+        buffer.add(make_row(m, session_id, seq))
+
+    def unavailable(rows):
+        raise OperationalError('INSERT', {}, Exception('database is locked'))
+
+    monkeypatch.setattr(m, 'write_emotion_samples', unavailable)
+    assert buffer.flush() == 0
+    assert buffer.snapshot()['queue_depth'] == 5
+    assert buffer.stats['failed_flushes'] == 1
+    assert stored_rows(m, session_id)[0] == 0
+
+    monkeypatch.undo()
+    assert buffer.flush() == 5
+    snapshot = buffer.snapshot()
+    assert snapshot['queue_depth'] == 0
+    assert snapshot['flushed_rows'] == 5
+    assert stored_rows(m, session_id) == (5, 5, 10.0)
+
+
+def test_flush_requeue_respects_capacity(m, start_session, monkeypatch):
+    session_id = start_session()
+    buffer = m.EmotionWriteBuffer(flush_rows=1000, flush_seconds=3600, capacity=3)
+    for seq in range(3):
+        buffer.add(make_row(m, session_id, seq))
+
+    def add_then_fail(rows):
+        buffer.add(make_row(m, session_id, 99))  # flush 期間又收到新資料
+        raise OperationalError('INSERT', {}, Exception('server closed the connection'))
+
+    monkeypatch.setattr(m, 'write_emotion_samples', add_then_fail)
+    buffer.flush()
+    snapshot = buffer.snapshot()
+    assert snapshot['queue_depth'] == 3
+    assert snapshot['dropped_rows'] == 1
+
+
+def test_flush_drops_only_rows_with_bad_data(m, start_session):
+    session_id = start_session()
+    buffer = m.EmotionWriteBuffer(flush_rows=1000, flush_seconds=3600, capacity=100)
+    for seq in range(5):
+        buffer.add(make_row(m, session_id, seq, timestamp='not a datetime' if seq == 2 else m.get_taiwan_now()))
+
+    assert buffer.flush() == 4
+    snapshot = buffer.snapshot()
+    assert snapshot['rejected_rows'] == 1
+    assert snapshot['failed_flushes'] == 0
+    assert snapshot['queue_depth'] == 0
+    assert stored_rows(m, session_id) == (4, 4, 8.0)
+
+    # 壞資料已丟棄，不會卡住之後的 flush
+    buffer.add(make_row(m, session_id, 5))
+    assert buffer.flush() == 1
+
+
+def test_flush_requeues_rows_on_schema_error(m, start_session, monkeypatch):
+    session_id = start_session()
+    buffer = m.EmotionWriteBuffer(flush_rows=1000, flush_seconds=3600, capacity=100)
+    for seq in range(4):
+        buffer.add(make_row(m, session_id, seq))
+
+    def schema_drift(rows):
+        raise ProgrammingError('INSERT', {}, Exception('column "seq" does not exist'))
+
+    monkeypatch.setattr(m, 'write_emotion_samples', schema_drift)
+    assert buffer.flush() == 0
+    snapshot = buffer.snapshot()
+    assert snapshot['queue_depth'] == 4
+    assert snapshot['rejected_rows'] == 0
+    assert snapshot['failed_flushes'] == 1
+
+
+def test_flush_drops_rows_violating_constraints(m, start_session, monkeypatch):
+    session_id = start_session()
+    buffer = m.EmotionWriteBuffer(flush_rows=1000, flush_seconds=3600, capacity=100)
+    for seq in range(4):
+        buffer.add(make_row(m, session_id, seq, emotion='invalid' if seq == 1 else 'neutral'))
+    write = m.write_emotion_samples
+
+    def check_constraint(rows):
+        if any(r['emotion'] == 'invalid' for r in rows):
+            raise IntegrityError('INSERT', {}, Exception('CHECK constraint failed'))
+        return write(rows)
+
+    monkeypatch.setattr(m, 'write_emotion_samples', check_constraint)
+    assert buffer.flush() == 3
+    assert buffer.snapshot()['rejected_rows'] == 1
+    assert stored_rows(m, session_id)[0] == 3
+
+
+def test_record_emotion_buffers_without_querying(m, client, start_session):
+    session_id = start_session()
+    statements = []
+    with m.app.app_context():
+        engine = m.db.engine
+
+    def listener(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    event.listen(engine, 'before_cursor_execute', listener)
+    try:
+        response = client.post('/record_emotion', json={'emotion': 'happy', 'attention_level': 3, 'confidence': 0.8})
+    finally:
+        event.remove(engine, 'before_cursor_execute', listener)
+    assert response.json['success']
+    assert statements == []
+    assert m.emotion_buffer.snapshot()['queue_depth'] == 1
+
+    m.emotion_buffer.flush()
+    assert stored_rows(m, session_id) == (1, 1, 3.0)
+
+
+def test_record_emotion_returns_503_when_buffer_is_full(m, client, start_session, monkeypatch):
+    start_session()
+    monkeypatch.setattr(m.emotion_buffer, 'capacity', 0)
+    response = client.post('/record_emotion', json={'emotion': 'happy', 'attention_level': 3, 'confidence': 0.8})
+    assert response.status_code == 503
+    assert response.headers['Retry-After'] == '5'
+    assert not response.json['success']
+
+
+def test_record_emotion_requires_an_open_session(m, client, start_session, end_session):
+    session_id = start_session()
+    assert client.post('/record_emotion', json={'emotion': 42}).status_code == 400
+    end_session(session_id)
+    response = client.post('/record_emotion', json={'emotion': 'happy', 'attention_level': 3, 'confidence': 0.8})
+    assert not response.json['success']
+    assert m.emotion_buffer.snapshot()['queue_depth'] == 0
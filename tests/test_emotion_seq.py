@@ -0,0 +1,51 @@
+"""序號去重：相同 (session_id, seq) 的樣本重送只寫入一次，不重複計入場次累計值"""
+
+
+def stored_rows(m, session_id):
+    with m.app.app_context():
+        s = m.db.session.get(m.StudySession, session_id)
+        count = m.EmotionData.query.filter_by(session_id=session_id).count()
+        return count, s.emotion_count, s.attention_sum
+
+
+def test_batch_resend_is_idempotent(m, client, start_session):
+    session_id = start_session()
+    samples = [{'seq': seq, 'emotion': 'happy', 'attention_level': 3, 'confidence': 0.9} for seq in range(4)]
+
+    first = client.post('/api/emotion/batch', json={'session_id': session_id, 'samples': samples}).json
+    assert (first['accepted'], first['duplicates']) == (4, 0)
+
+    again = client.post('/api/emotion/batch', json={'session_id': session_id, 'samples': samples}).json
+    assert again['ok']
+    assert (again['accepted'], again['duplicates']) == (0, 4)
+
+    overlap = samples[2:] + [{'seq': 4, 'emotion': 'sad', 'attention_level': 1, 'confidence': 0.4}] * 2
+    partial = client.post('/api/emotion/batch', json={'session_id': session_id, 'samples': overlap}).json
+    assert (partial['accepted'], partial['duplicates']) == (1, 3)
+
+    assert stored_rows(m, session_id) == (5, 5, 13.0)
+
+
+def test_record_emotion_dedupes_buffered_resend(m, client, start_session):
+    session_id = start_session()
+    sample = {'emotion': 'neutral', 'attention_level': 2, 'confidence': 0.5, 'seq': 7}
+    for _ in range(3):
+        assert client.post('/record_emotion', json=sample).json['success']
+    assert client.post('/record_emotion', json=dict(sample, seq=8)).json['success']
+
+    m.emotion_buffer.flush()
+    assert stored_rows(m, session_id) == (2, 2, 4.0)
+
+
+def test_samples_without_seq_are_not_deduplicated(m, client, start_session):
+    session_id = start_session()
+    sample = {'emotion': 'neutral', 'attention_level': 2, 'confidence': 0.5}
+    response = client.post('/api/emotion/batch', json={'session_id': session_id, 'samples': [sample, sample]}).json
+    assert (response['accepted'], response['duplicates']) == (2, 0)
+    assert stored_rows(m, session_id)[0] == 2
+
+
+def test_study_page_exposes_batch_mode(m, client, monkeypatch):
+    assert b'window.EMOTION_BATCH_MODE = true;' in client.get('/study/math').data
+    monkeypatch.setattr(m, 'EMOTION_BATCH_MODE', False)
+    assert b'window.EMOTION_BATCH_MODE = false;' in client.get('/study/math').data
@@ -0,0 +1,60 @@
+"""bcrypt 行程池：排隊已滿或等待逾時時拋出 PasswordHashBusy，登入 / 註冊回 429 + Retry-After"""
+import threading
+import time
+
+import pytest
+
+
+@pytest.fixture
+def pool(m):
+    """mode=thread 的小型池：1 個 worker、最多 1 個排隊中的工作"""
+    return m.PasswordHashPool(1, 1, 5, 'thread')
+
+
+def test_hash_and_check(m, pool):
+    pw_hash = pool.hash('secret1')
+    assert pw_hash.startswith('$2')
+    assert pool.check(pw_hash, 'secret1')
+    assert not pool.check(pw_hash, 'wrong')
+    snapshot = pool.snapshot()
+    assert (snapshot['hashes'], snapshot['checks'], snapshot['pending']) == (1, 2, 0)
+
+
+def test_full_pool_rejects_immediately(m, pool):
+    gate = threading.Event()
+    worker = threading.Thread(target=pool._run, args=('hashes', gate.wait, 5))
+    worker.start()
+    try:
+        while pool.pending == 0:
+            time.sleep(0.01)
+        with pytest.raises(m.PasswordHashBusy):
+            pool.hash('secret1')
+    finally:
+        gate.set()
+        worker.join()
+    assert pool.stats['rejected'] == 1
+    assert pool.pending == 0
+
+
+def test_timeout_keeps_the_slot_until_the_work_finishes(m):
+    pool = m.PasswordHashPool(1, 2, 0.05, 'thread')
+    gate = threading.Event()
+    with pytest.raises(m.PasswordHashBusy):
+        pool._run('hashes', gate.wait, 5)
+    assert pool.stats['timeouts'] == 1
+    assert pool.pending == 1  # bcrypt 仍在執行，名額尚未歸還
+    gate.set()
+    pool._executor.shutdown(wait=True)
+    assert pool.pending == 0
+
+
+def test_login_returns_429_when_busy(m, client, monkeypatch):
+    monkeypatch.setattr(m, 'password_hasher', m.PasswordHashPool(1, 0, 5, 'thread'))
+    client.get('/logout')
+    response = client.post('/login', json={'username': 'alice', 'password': 'secret1'})
+    assert response.status_code == 429
+    assert response.headers['Retry-After'] == str(m.PASSWORD_HASH_RETRY_AFTER)
+    assert not response.json['success']
+
+    response = client.post('/register', json={'username': 'bob', 'email': 'bob@example.com', 'password': 'secret1'})
+    assert response.status_code == 429
@@ -0,0 +1,82 @@
+"""PDF 報告下載：ETag 為報告輸入資料的雜湊，If-None-Match 相符回 304，資料改變後 ETag 跟著改變"""
+import os
+
+
+def finished_session(client, start_session, end_session, attention=2):
+    session_id = start_session()
+    client.post('/api/emotion/batch', json={'session_id': session_id, 'samples': [
+        {'seq': 0, 'emotion': 'neutral', 'attention_level': attention, 'confidence': 0.5}]})
+    end_session(session_id)
+
+
+def download(client, reports):
+    """排入背景產生並等待完成後下載"""
+    url = f'/generate_report/{client.child_id}'
+    response = client.get(url)
+    if response.status_code == 202:
+        assert reports._jobs[client.child_id].wait(30)
+        response = client.get(url)
+    return response
+
+
+def test_report_etag_and_not_modified(m, client, reports, start_session, end_session):
+    finished_session(client, start_session, end_session)
+    url = f'/generate_report/{client.child_id}'
+
+    first = download(client, reports)
+    assert first.status_code == 200
+    assert first.mimetype == 'application/pdf'
+    assert first.data.startswith(b'%PDF')
+    etag = first.headers['ETag']
+    assert 'no-cache' in first.headers['Cache-Control']
+
+    revalidated = client.get(url, headers={'If-None-Match': etag})
+    assert revalidated.status_code == 304
+    assert revalidated.data == b''
+    assert revalidated.headers['ETag'] == etag
+
+    cached = client.get(url)
+    assert cached.status_code == 200
+    assert cached.headers['ETag'] == etag
+    assert cached.data == first.data
+
+    finished_session(client, start_session, end_session, attention=3)
+    changed = download(client, reports)
+    assert changed.status_code == 200
+    assert changed.headers['ETag'] != etag
+
+
+def test_report_key_does_not_change_with_the_date(m, client, start_session, end_session, monkeypatch):
+    finished_session(client, start_session, end_session)
+    with m.app.app_context():
+        child = m.db.session.get(m.Child, client.child_id)
+        _, key = m.current_report_key(child)
+
+        class Tomorrow(m.datetime):
+            @classmethod
+            def now(cls, tz=None):
+                return m.datetime.now(tz) + m.timedelta(days=1)
+
+        monkeypatch.setattr(m, 'datetime', Tomorrow)
+        assert m.current_report_key(child)[1] == key
+
+
+def test_report_is_rendered_again_after_eviction(m, client, reports, start_session, end_session):
+    finished_session(client, start_session, end_session)
+    first = download(client, reports)
+    key = first.headers['ETag'].strip('"')
+
+    os.remove(m.report_store.path_for(key))  # 被容量上限淘汰
+    reports._jobs.clear()  # 其他 worker：記憶體中沒有剛完成的工作
+    again = download(client, reports)
+    assert again.status_code == 200
+    assert again.headers['ETag'] == first.headers['ETag']
+    assert os.path.exists(m.report_store.path_for(key))
+
+
+def test_report_status_reports_ready(m, client, reports, start_session, end_session):
+    finished_session(client, start_session, end_session)
+    etag = download(client, reports).headers['ETag']
+    status = client.get(f'/api/report/{client.child_id}/status').json
+    assert status['ok'] and status['status'] == 'ready'
+    assert status['etag'] == etag.strip('"')
@@ -0,0 +1,64 @@
+"""PDF 報告背景排版：下載時尚未產生就回 202 並指向狀態 API，不在 request 內等待排版"""
+import os
+import threading
+
+import pytest
+
+
+@pytest.fixture
+def gate(m, monkeypatch):
+    """排版等到 gate.set() 才完成，讓測試能看到進行中的工作"""
+    gate = threading.Event()
+    render = m.render_report_pdf
+
+    def gated_render(context):
+        assert gate.wait(30)
+        return render(context)
+
+    monkeypatch.setattr(m, 'render_report_pdf', gated_render)
+    return gate
+
+
+def test_missing_report_returns_202_with_status_url(m, client, reports, gate):
+    url = f'/generate_report/{client.child_id}'
+    pending = client.get(url)
+    assert pending.status_code == 202
+    assert pending.headers['Location'].endswith(f'/api/report/{client.child_id}/status')
+    assert pending.headers['Retry-After'] == '5'
+
+    status = client.get(pending.headers['Location']).json
+    assert status['status'] in ('queued', 'rendering')
+    assert client.get(url).status_code == 202
+    assert reports.stats['submitted'] == 1  # 進行中的工作直接沿用
+
+    gate.set()
+    assert reports._jobs[client.child_id].wait(30)
+    assert client.get(pending.headers['Location']).json['status'] == 'ready'
+    ready = client.get(url)
+    assert ready.status_code == 200
+    assert ready.data.startswith(b'%PDF')
+
+
+def test_failed_render_is_reported_by_status(m, client, reports, monkeypatch):
+    def broken(context):
+        raise RuntimeError('font missing')
+
+    monkeypatch.setattr(m, 'render_report_pdf', broken)
+    assert client.get(f'/generate_report/{client.child_id}').status_code == 202
+    assert reports._jobs[client.child_id].wait(30)
+
+    status = client.get(f'/api/report/{client.child_id}/status').json
+    assert status['status'] == 'failed'
+    assert 'font missing' in status['error']
+    assert reports.stats['failed'] == 1
+
+
+def test_finished_job_is_served_after_eviction(m, client, reports):
+    assert client.get(f'/generate_report/{client.child_id}').status_code == 202
+    job = reports._jobs[client.child_id]
+    assert job.wait(30)
+
+    os.remove(m.report_store.path_for(job.key))  # 被容量上限淘汰，記憶體中仍有剛完成的內容
+    response = client.get(f'/generate_report/{client.child_id}')
+    assert response.status_code == 200
+    assert response.data == job.data
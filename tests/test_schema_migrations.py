@@ -0,0 +1,88 @@
+"""版本化 migration：依序套用尚未執行的版本、可重複執行，並替既有資料庫補上欄位與索引"""
+import pytest
+from sqlalchemy import text
+
+
+def applied_versions(m):
+    return sorted(v for (v,) in m.db.session.query(m.SchemaMigration.version).all())
+
+
+def columns(m, table):
+    return {c['name'] for c in m.db.inspect(m.db.session.connection()).get_columns(table)}
+
+
+def indexes(m, table):
+    return {i['name'] for i in m.db.inspect(m.db.session.connection()).get_indexes(table)}
+
+
+def test_migrations_apply_once_in_order(m):
+    with m.app.app_context():
+        assert m.run_schema_migrations() == [v for v, _, _ in m.SCHEMA_MIGRATIONS]
+        assert applied_versions(m) == list(range(1, m.SCHEMA_VERSION + 1))
+        assert m.run_schema_migrations() == []
+        assert m.read_schema_version() == m.SCHEMA_VERSION
+        assert m.schema_is_current()
+
+
+def test_migrations_upgrade_an_existing_database(m):
+    with m.app.app_context():
+        # 模擬加上索引與欄位之前建立的資料庫
+        for stmt in ('DROP INDEX uq_emotion_data_session_seq',
+                     'DROP INDEX ix_study_session_child_start',
+                     'ALTER TABLE emotion_data DROP COLUMN seq',
+                     'ALTER TABLE child DROP COLUMN ai_suggestion_version'):
+            m.db.session.execute(text(stmt))
+        m.db.session.commit()
+        assert 'seq' not in columns(m, 'emotion_data')
+
+        m.run_schema_migrations()
+        assert 'seq' in columns(m, 'emotion_data')
+        assert 'ai_suggestion_version' in columns(m, 'child')
+        assert 'uq_emotion_data_session_seq' in indexes(m, 'emotion_data')
+        assert 'ix_study_session_child_start' in indexes(m, 'study_session')
+
+
+def test_failed_migration_records_nothing(m, monkeypatch):
+    def broken():
+        raise RuntimeError('migration failed')
+
+    monkeypatch.setattr(m, 'SCHEMA_MIGRATIONS', m.SCHEMA_MIGRATIONS + [(99, 'broken', broken)])
+    with m.app.app_context():
+        with pytest.raises(RuntimeError):
+            m.run_schema_migrations()
+        assert applied_versions(m) == []
+
+
+@pytest.fixture
+def schema_status(m, monkeypatch):
+    """檢查結果寫入暫時的 schema_status，不影響其他測試的 /health"""
+    status = dict(m.schema_status)
+    monkeypatch.setattr(m, 'schema_status', status)
+    return status
+
+
+def test_startup_check_does_not_modify_schema(m, monkeypatch, schema_status):
+    monkeypatch.setattr(m, 'DB_SCHEMA_CHECK', 'warn')
+    with m.app.app_context():
+        m.db.drop_all()
+    m.check_database_schema()
+    assert not m.schema_is_current()
+    assert 'migrate-schema' in schema_status['error']
+    with m.app.app_context():
+        assert m.db.inspect(m.db.engine).get_table_names() == []
+
+
+def test_strict_startup_check_exits_when_behind(m, monkeypatch, schema_status):
+    monkeypatch.setattr(m, 'DB_SCHEMA_CHECK', 'strict')
+    with pytest.raises(SystemExit):
+        m.check_database_schema()
+
+
+def test_migrate_schema_command_creates_and_migrates(m, schema_status):
+    with m.app.app_context():
+        m.db.drop_all()
+    result = m.app.test_cli_runner().invoke(args=['migrate-schema'])
+    assert result.exit_code == 0, result.output
+    with m.app.app_context():
+        assert m.read_schema_version() == m.SCHEMA_VERSION
+        assert applied_versions(m) == list(range(1, m.SCHEMA_VERSION + 1))
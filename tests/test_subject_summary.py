@@ -0,0 +1,98 @@
+"""結束 / 重複結束 / 刪除 / 重設學習記錄時，科目彙總的增減要與由場次重算的結果一致"""
+
+
+def summaries(m, child_id):
+    with m.app.app_context():
+        subjects = {r.subject: (r.session_count, r.total_minutes, r.attention_sum)
+                    for r in m.ChildSubjectSummary.query.filter_by(child_id=child_id)}
+        daily = {(r.study_date, r.subject): (r.session_count, r.total_minutes)
+                 for r in m.ChildDailySubjectRollup.query.filter_by(child_id=child_id)}
+        version = m.db.session.get(m.Child, child_id).analytics_version
+    return subjects, daily, version
+
+
+def rebuilt_summaries(m, child_id):
+    with m.app.app_context():
+        m.rebuild_subject_summaries(child_id)
+        m.rebuild_daily_rollups(child_id)
+        m.db.session.commit()
+    return summaries(m, child_id)[:2]
+
+
+def record(client, session_id, attention):
+    client.post('/api/emotion/batch', json={'session_id': session_id, 'samples': [
+        {'seq': 0, 'emotion': 'neutral', 'attention_level': attention, 'confidence': 0.5}]})
+
+
+def test_end_adds_session_once(m, client, start_session, end_session):
+    math_id = start_session('math')
+    record(client, math_id, 3)
+    end_session(math_id, minutes=10)
+    art_id = start_session('art')
+    record(client, art_id, 1)
+    end_session(art_id, minutes=5)
+
+    subjects, daily, version = summaries(m, client.child_id)
+    assert subjects == {'math': (1, 10, 3.0), 'art': (1, 5, 1.0)}
+    assert sum(count for count, _ in daily.values()) == 2
+
+    # 重複結束同一場次：先扣掉先前計入的值再加回，不會重複計算
+    assert client.post('/api/session/end', json={'session_id': math_id}).json['ok']
+    subjects, daily, new_version = summaries(m, client.child_id)
+    assert subjects['math'][0] == 1
+    assert sum(count for count, _ in daily.values()) == 2
+    assert new_version > version
+    assert (subjects, daily) == rebuilt_summaries(m, client.child_id)
+
+
+def test_delete_session_removes_it_from_summaries(m, client, start_session, end_session):
+    first = start_session('math')
+    record(client, first, 2)
+    end_session(first, minutes=10)
+    second = start_session('math')
+    record(client, second, 3)
+    end_session(second, minutes=20)
+
+    assert client.post(f'/delete_session/{first}').json['success']
+    subjects, daily, _ = summaries(m, client.child_id)
+    assert subjects == {'math': (1, 20, 3.0)}
+    assert (subjects, daily) == rebuilt_summaries(m, client.child_id)
+
+    assert client.post(f'/delete_session/{second}').json['success']
+    subjects, daily, _ = summaries(m, client.child_id)
+    assert subjects == {} and daily == {}
+
+
+def test_reset_learning_history_clears_summaries(m, client, start_session, end_session):
+    for subject in ('math', 'science'):
+        session_id = start_session(subject)
+        record(client, session_id, 2)
+        end_session(session_id)
+    _, _, version = summaries(m, client.child_id)
+
+    assert client.post(f'/reset_learning_history/{client.child_id}').json['success']
+    subjects, daily, new_version = summaries(m, client.child_id)
+    assert subjects == {} and daily == {}
+    assert new_version > version
+
+
+def test_reset_learning_history_removes_emotion_rows(m, client, start_session, end_session):
+    session_id = start_session('math')
+    record(client, session_id, 2)
+    end_session(session_id)
+    with m.app.app_context():
+        m.db.session.add(m.EmotionChunk(session_id=session_id, chunk_start=m.datetime.now(), payload=b''))
+        m.db.session.commit()
+
+    assert client.post(f'/reset_learning_history/{client.child_id}').json['success']
+    with m.app.app_context():
+        assert m.EmotionData.query.filter_by(session_id=session_id).count() == 0
+        assert m.EmotionChunk.query.filter_by(session_id=session_id).count() == 0
+
+
+def test_snapshot_and_summary_report_the_same_averages(m):
+    row = m.ChildSubjectSummary(child_id=1, subject='math', session_count=3, total_minutes=30,
+                                attention_sum=5.0, attention_count=3, attention_nonzero_count=2)
+    stats = m.SubjectStats(row)
+    assert (stats.avg_attention, stats.avg_attention_nonzero) == (row.avg_attention, row.avg_attention_nonzero)
+    assert (row.avg_attention, row.avg_attention_nonzero) == (5.0 / 3, 2.5)